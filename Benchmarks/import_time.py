@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine measures the import time of the computational modules of PVschedule in fresh
+python processes and checks that they do not load matplotlib. The exit status is 1 if a module
+exceeds the time budget or loads matplotlib.
+
+Usage: python import_time.py [budget in seconds]
+"""
+
+import os
+import sys
+import subprocess
+
+# path to pv_schedule
+root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# time budget per module in seconds
+budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.5
+
+# number of measurements per module, the minimum is used
+num_repeats = 3
+
+modules = ['pv_schedule',
+           'Modules.DynamicProg.dynamic_programming',
+           'Modules.Heuristic.heuristic_batch',
+           'Modules.Clinic.clinic_scheduler',
+           'Modules.Tools.cohort_runner',
+           'Modules.Tools.result_cache']
+
+code = ("import sys, time; sys.path.insert(0, {root!r}); t = time.perf_counter(); import {module}; "
+        "print(time.perf_counter() - t, 'matplotlib' in sys.modules)")
+
+failed = False
+for module in modules:
+    times = []
+    for _ in range(num_repeats):
+        out = subprocess.check_output([sys.executable, '-c', code.format(root=root, module=module)],
+                                      universal_newlines=True).split()
+        times.append(float(out[-2]))
+        uses_matplotlib = out[-1] == 'True'
+    ok = min(times) <= budget and not uses_matplotlib
+    failed = failed or not ok
+    print('%-45s %.3f s  matplotlib: %-5s %s' % (module, min(times), uses_matplotlib, 'ok' if ok else 'FAILED'))
+
+# plotting is still possible after lazy import
+out = subprocess.check_output([sys.executable, '-c', code.format(root=root, module='Modules.Tools.plot_tools')],
+                              universal_newlines=True).split()
+print('%-45s %.3f s  matplotlib: %s' % ('Modules.Tools.plot_tools', float(out[-2]), out[-1]))
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+This routine checks many variations of a pv schedule, where single treatments are shifted in time,
+for feasibility at once.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from pv_schedule import pv_schedule
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.schedule_checker import check_schedules
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'forbidden_days': [range(81, 96)], 'objective': 'heuristic'}
+result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, [beta, gamma], patient_volume, dict_opts)
+
+# 5000 candidates, each with one treatment shifted by up to 10 allowed times
+rng = np.random.RandomState(0)
+num_allowed = len(result.u)
+candidates = np.repeat(np.asarray(result.u)[None, :], 5000, axis=0)
+for schedule in candidates[1:]:
+    j = rng.choice(np.flatnonzero(schedule > 0.5))
+    schedule[j] = 0
+    schedule[np.clip(j + rng.randint(-10, 11), 0, num_allowed - 1)] = 1
+
+t_start = time.time()
+first_violation, x3_min, x3_max, num_treatments, time_in_range = check_schedules(
+    Tf, candidates, result.allowed_arr, x0, Base, [beta, gamma], pv_lambda, 500 / patient_volume)
+print('Computation time:', time.time() - t_start)
+print('Feasible schedules:', np.sum(first_violation < 0), 'of', len(candidates))
+print('Time in range (5%, 50% quantile):', np.quantile(time_in_range, [0.05, 0.5]))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine generates pv schedules of a cohort of patients sharing a clinic
+with a limited number of treatment places per time slot.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Clinic.clinic_scheduler import clinic_schedule
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+# cohort built from the patient parameters; for more information see Modules/Tools/patient_parameters.py
+indices = ['F01', 'F02', 'F03', 'F04', 'F05', 'F06', 'F07', 'F08', 'F09', 'F10', 'F11', 'F12', 'F13', 'F14',
+           'F15', 'F16', 'F17', 'F18', 'F19', 'F20', 'F21', 'F23', 'F24', 'F25', 'F26', 'F27', 'F28', 'F29']
+num_patients = 500
+patients = []
+for n in range(num_patients):
+    gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters(indices[n % len(indices)],
+                                                                         lambda_version=n % 5)
+    patients.append({'x0': x0, 'B': Base, 'pv_lambda': pv_lambda, 'p_in': [beta, gamma],
+                     'patient_volume': patient_volume})
+
+# opening hours of the clinic
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'forbidden_days': [range(81, 96)]}
+
+# number of treatment places per time slot
+capacity = 20
+
+t_start = time.time()
+x1, x2, x3, q, u, tgrid, allowed_arr, load, error_flag = clinic_schedule(Tf, Nperday, patients, capacity, dict_opts)
+print('Computation time:', time.time() - t_start)
+print('Number of treatments:', int(np.sum(u)))
+print('Maximal load:', np.max(load), 'of', capacity)
+print('Patients without valid schedule:', int(np.sum(error_flag)))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine generates pv schedules for all Freiburg subjects and pv_lambda versions
+with the heuristic algorithm and the relaxed NLP in parallel on all cpus.
+
+"""
+
+import sys
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from Modules.Tools.cohort_runner import run_cohort, cohort_results
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+freiburg_indices = ['F01', 'F02', 'F03', 'F04', 'F05', 'F06', 'F07', 'F08', 'F09', 'F10', 'F11', 'F12', 'F13', 'F14',
+                    'F15', 'F16', 'F17', 'F18', 'F19', 'F20', 'F21', 'F23', 'F24', 'F25', 'F26', 'F27', 'F28', 'F29']
+
+dict_allowed = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+                'forbidden_days': [range(81, 96), range(280, 302)]}
+
+jobs = []
+for objective in ['heuristic', 'relaxed_int_u']:
+    dict_opts = {'objective': objective}
+    dict_opts.update(dict_allowed)
+    for index in freiburg_indices:
+        for pv_lambda_index in range(5):
+            jobs.append((index, pv_lambda_index, dict_opts, Tf, Nperday))
+
+out_dir = 'cohort_results'
+if __name__ == '__main__':
+    for j, info in run_cohort(jobs, out_dir):
+        print(j, jobs[j][2]['objective'], info['index'], info['lambda_version'], 'treatments:', info['num_treatments'],
+              'time: %.1f' % info['time'])
+
+    results = cohort_results(out_dir)
+    print('Mean number of treatments:', np.mean(np.sum(results['u'], axis=1)))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine estimates the patient parameters beta, gamma and pv_lambda from tHb measurements.
+Here, the measurements are generated by simulation of a known patient with noise.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.parameter_estimation import estimate_parameters
+from Modules.Heuristic.heuristic_batch import pv_heuristic_batch
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 1
+
+# true patient and treatments by the heuristic algorithm with one allowed time per day
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+N = Tf * Nperday
+x, q, u, tgrid, load, error_flag = pv_heuristic_batch(Tf, N, np.array([x0]), np.array([[beta, gamma]]), pv_lambda,
+                                                      Base, 500 / patient_volume, np.ones(N, dtype=bool))
+treatment_times = np.array(tgrid[1:])[u[0] > 0]
+
+# weekly measurements with 0.2% noise
+thb_times = np.arange(0, Tf + 1, 7)
+thb_values = x[0, thb_times * Nperday, 2] * (1 + 0.002 * np.random.RandomState(1).randn(len(thb_times)))
+
+t_start = time.time()
+p_opt, cov, x_fit, tgrid_fit, residuals, costs = estimate_parameters(Tf, Nperday, thb_times, thb_values, Base,
+                                                                     patient_volume, treatment_times, 500, x0)
+print('Computation time:', time.time() - t_start)
+print('True parameters:     ', [beta, gamma, pv_lambda])
+print('Estimated parameters:', p_opt)
+print('Standard deviations: ', np.sqrt(np.diag(cov)))
@@ -25,6 +25,7 @@ This routine generates pv schedules of a chosen patient using
 - Heuristic algorithm with restrictions
 - Relaxed NLP algorithm 
 - Sumup method applied on solution of the relaxed NLP algorithm
+- Constraint-aware rounding of the solution of the relaxed NLP algorithm
 
 """
 
@@ -39,6 +40,7 @@ from Modules.Tools.patient_parameters import return_parameters
 from Modules.Model.model_integrator import model_integrator
 from Modules.NLP.integrate_nlp_sol import integrate_nlp_sol
 from Modules.Sumup.sumup_alg import sumup
+from Modules.Sumup.rounding import round_schedules
 from Modules.Tools.plot_tools import plot_sol
 
 # length of time horizon (days)
@@ -154,6 +156,28 @@ input_names.append('Sumup method')
 marker_styles.append(None)
 line_width.append(1.0)
 
+################## ROUNDING #####################
+
+# Generation of integer control by rounding with repair of violations of the bounds of x3
+round_u_opt, round_method, _, _ = round_schedules(Tf, u_opt, allowed_arr, x0, Base, p_in, pv_lambda, max_fraction)
+
+# Integration of system using rounded control
+x1_round, x2_round, x3_round, q_round, u_round, tgrid = \
+    integrate_nlp_sol(list(round_u_opt[0]), x0, allowed_arr, N, dt, Nperday, Tf, integrator_function, None,
+                      max_fraction, p_in, sol_is_u=True)
+
+# Append entries
+x1.append(x1_round)
+x2.append(x2_round)
+x3.append(x3_round)
+q.append(q_round)
+u.append(u_round)
+tgrids.append(tgrid)
+allowed_arrs.append(allowed_arr)
+input_names.append('Rounding (' + round_method[0] + ')')
+marker_styles.append(None)
+line_width.append(1.0)
+
 # Plot solution
 plot_sol(x1, x2, x3, q, u, tgrids, allowed_arrs, len(input_names), input_names=input_names, title='pyCombina',
          show_forbidden=True, show_plot=True, limit=x3_up, marker_styles=marker_styles, line_width=line_width)
@@ -32,6 +32,7 @@ sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/
 sys.path.append('../')
 
 from pv_schedule import pv_schedule
+from Modules.Tools.result_cache import cached_pv_schedule
 from Modules.Tools.patient_parameters import return_parameters
 from Modules.Tools.plot_tools import plot_sol
 
@@ -39,6 +40,10 @@ from Modules.Tools.plot_tools import plot_sol
 Tf = 103.0 
 Nperday = 6 
 
+# store results in the cache on disk ($PVSCHEDULE_CACHE_DIR or ~/.cache/pvschedule) and reuse them in later runs
+use_cache = False
+schedule = cached_pv_schedule if use_cache else pv_schedule
+
 # get patient parameters; for more information see Modules/Tools/patient_parameters.py
 patient_index = 'F20'
 lambda_version = 1   
@@ -73,8 +78,8 @@ Tf_heuristic = int(Tf*2.5)
 options = {'objective':'heuristic'}
 options.update(default_options)
 options.update(allowed_options)
-_,_,_,_,_,_,_,allowed_old, _ = pv_schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
-x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = pv_schedule(Tf_heuristic, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
+_,_,_,_,_,_,_,allowed_old, _ = schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
+x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = schedule(Tf_heuristic, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
 
 
 if error_flag == 0:
@@ -102,8 +107,8 @@ else:
 
 options = {'objective':'heuristic'}
 options.update(default_options)
-_,_,_,_,_,_,_,allowed_old, error_flag = pv_schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
-x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = pv_schedule(Tf_heuristic, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
+_,_,_,_,_,_,_,allowed_old, error_flag = schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
+x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = schedule(Tf_heuristic, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
 
 x1.append(x1_opt)
 x2.append(x2_opt)
@@ -132,7 +137,7 @@ while valid_k:
     options.update(default_options)
     options.update(allowed_options)
 
-    x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = pv_schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
+    x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag = schedule(Tf, Nperday, x0, base, pv_lambda, p_in, patient_volume, options)
     
     x1.append(x1_opt)
     x2.append(x2_opt)
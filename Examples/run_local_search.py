@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+This routine rounds the relaxed pv schedule by the sumup method and improves the (possibly infeasible)
+integer schedule by local search.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from pv_schedule import pv_schedule
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.schedule_checker import check_schedules
+from Modules.Sumup.sumup_alg import sumup
+from Modules.Heuristic.local_search import local_search
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+p_in = [beta, gamma]
+max_fraction = 500 / patient_volume
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'forbidden_days': [range(81, 96)], 'objective': 'relaxed_int_u'}
+result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume, dict_opts)
+
+u_sumup = np.asarray(sumup(result.u), dtype=float)
+first_violation, _, _, _, _ = check_schedules(Tf, u_sumup[None, :], result.allowed_arr, x0, Base, p_in, pv_lambda,
+                                              max_fraction)
+print('Sumup:', int(np.sum(u_sumup)), 'treatments,', 'feasible' if first_violation[0] < 0 else 'infeasible')
+
+t_start = time.time()
+improved = local_search(Tf, u_sumup, result.allowed_arr, x0, Base, p_in, pv_lambda, max_fraction, {'time_budget': 60})
+print('Computation time:', time.time() - t_start)
+print('Local search:', int(np.sum(improved.u)), 'treatments,', 'feasible' if not improved.error_flag else 'infeasible')
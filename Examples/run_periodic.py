@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+This routine computes a periodic pv schedule for maintenance therapy, where the cycle length is chosen
+among several weeks by the number of treatments of the rounded schedule, and repeats it to a time horizon
+of two years.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from pv_schedule import pv_schedule
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.plot_tools import plot_sol
+from Modules.Sumup.rounding import round_schedules
+
+# length of time horizon (days)
+Tf = 730
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'objective': 'periodic', 'cycle_days': [28, 42, 56, 84]}
+
+t_start = time.time()
+result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, [beta, gamma], patient_volume, dict_opts)
+print('Computation time:', time.time() - t_start)
+print('Periodic state:', result.x[0])
+print('x3 in [', np.min(result.x3) / Base, ',', np.max(result.x3) / Base, '] * B')
+print('Relaxed treatments per year:', 365 * np.sum(result.u) / Tf)
+
+# integer schedule of the relaxed periodic control
+u_round, method, _, error_flag = round_schedules(Tf, result.u[None, :], result.allowed_arr, result.x[0], Base,
+                                                 [beta, gamma], pv_lambda, 500. / patient_volume)
+print('Rounded treatments per year:', 365 * np.sum(u_round[0]) / Tf, 'method:', method[0], 'error flag:', error_flag[0])
+
+plot_sol(result.x1, result.x2, result.x3, result.q, result.u, result.tgrid, result.allowed_arr,
+         title='Periodic schedule', show_plot=True, limit=1.1 * Base)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine computes a pv schedule and re-plans it after a measurement during the treatment.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from pv_schedule import pv_schedule
+from Modules.NLP.nlp_replan import pv_replan
+from Modules.Tools.patient_parameters import return_parameters
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+p_in = [beta, gamma]
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'forbidden_days': [range(81, 96)], 'objective': 'relaxed_int_u'}
+
+t_start = time.time()
+result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume, dict_opts)
+print('Computation time of schedule:', time.time() - t_start)
+
+# measurements every five weeks, here the predicted state with a deviation of a few percent
+for day in range(35, Tf, 35):
+    x_meas = result.x[day * Nperday] * np.array([1.02, 1.02, 1.01])
+    t_start = time.time()
+    previous = result
+    result = pv_replan(previous, day, x_meas, Base, pv_lambda, p_in, patient_volume, dict_opts)
+    print('Day', day, 'computation time of re-planning:', time.time() - t_start,
+          'remaining treatments:', np.sum(result.u_grid[day * Nperday:]))
+    # the past of the previous plan (including earlier measurements) is kept
+    print('    Maximal change of past states:', np.max(np.abs(result.x[:day * Nperday] - previous.x[:day * Nperday])),
+          'measured state kept:', np.allclose(result.x[day * Nperday], x_meas))
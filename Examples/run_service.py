@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+
+This routine is a smoke run of the scheduling service (see pv_service.py) with one request of each method
+"""
+
+import sys
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+from Modules.Service.schedule_service import ScheduleService
+
+
+# calendar options similar to pv_schedule
+calendar = {'allowed_hours': [1, 0, 0, 0, 0, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+            'forbidden_days': [[81, 96]]}
+patient = {'index': 'F02', 'lambda_version': 1}
+
+requests = [{'id': 'heuristic', 'Tf': 120, 'Nperday': 6, 'patient': patient,
+             'dict_opts': dict(calendar, objective='heuristic')},
+            {'id': 'relaxed', 'Tf': 120, 'Nperday': 6, 'patient': patient,
+             'dict_opts': dict(calendar, objective='relaxed_int_u')},
+            {'id': 'dynamic_programming', 'Tf': 120, 'Nperday': 6, 'patient': patient,
+             'dict_opts': dict(calendar, objective='dynamic_programming'),
+             'dp_options': {'NX': 101, 'NU': 2, 'NK': 6}}]
+
+service = ScheduleService()
+for response in service.handle_batch(requests):
+    if 'error' in response.keys():
+        print(response['id'], 'failed:', response['error'])
+    else:
+        print(response['id'], 'treatments:', sum(response['u']), 'error flag:', response['error_flag'],
+              'time:', response['time'])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine computes a pv schedule for the nominal patient parameters and tests it for
+uncertain parameters and noisy measurements by Monte Carlo simulation.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from pv_schedule import pv_schedule
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.stress_test import stress_test
+from Modules.NLP.nlp_builder_robust import robust_scenarios
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0],
+             'forbidden_days': [range(81, 96)], 'objective': 'heuristic'}
+result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, [beta, gamma], patient_volume, dict_opts)
+
+# 5000 parameter samples with standard deviations of 5%, 5% and 3% of beta, gamma and pv_lambda
+p_samples = robust_scenarios([beta, gamma, pv_lambda], np.diag([0.05, 0.05, 0.03]) ** 2, 5000)
+
+t_start = time.time()
+p_violation, p_upper, p_lower, time_in_range, daily_risk, x3_quantiles = stress_test(
+    Tf, result.u_grid, x0, Base, p_samples, 500 / patient_volume, {'x0_noise': 0.01, 'thb_noise': 0.01})
+print('Computation time:', time.time() - t_start)
+print('Probability of leaving [0.8B, 1.1B]:', p_violation, '(upper:', p_upper, 'lower:', p_lower, ')')
+print('Time in range (5%, 50% quantile):', np.quantile(time_in_range, [0.05, 0.5]))
+print('Day with highest risk:', np.argmax(daily_risk), 'risk:', np.max(daily_risk))
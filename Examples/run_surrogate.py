@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This routine builds a surrogate table of schedule summaries over a grid of patient parameters
+and compares interpolated values with direct computations by pv_schedule.
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.surrogate_table import build_surrogate_table, SurrogateTable, surrogate_error
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0]}
+
+# directory of the table outside of the repository
+table_dir = os.path.join(tempfile.gettempdir(), 'pvschedule_surrogate_table')
+
+# grid covering the parameters of the subjects in Modules/Tools/patient_parameters.py
+t_start = time.time()
+build_surrogate_table(table_dir, np.linspace(0.3, 3.5, 9), np.linspace(0.1, 1.0, 7), np.linspace(0.2, 0.9, 8),
+                      np.linspace(0.08, 0.14, 4), Tf, Nperday, dict_opts, verbose=True)
+print('Computation time of table:', time.time() - t_start, 'directory:', table_dir)
+
+surrogate = SurrogateTable(table_dir)
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+t_start = time.time()
+summary = surrogate.query(beta, gamma, pv_lambda, 500 / patient_volume)
+print('Query time:', time.time() - t_start)
+print('Treatments per year:', summary[0], 'mean treatment interval (days):', summary[1])
+
+surrogate_error(surrogate, num_samples=20)
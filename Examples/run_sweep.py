@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep  5 10:06:53 2019
+
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+This routine computes relaxed pv schedules for a sweep of the patient parameter beta in small steps
+by continuation with a tangential predictor and compares the number of treatments.
+
+"""
+
+import sys
+import time
+# path to casadi if not in PYTHONPATH
+sys.path.append(r'/home/lilienthal/Programmieren/casadi-linux-py36-v3.4.5-64bit/')
+# path to pv_schedule
+sys.path.append('../')
+
+import numpy as np
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.NLP.nlp_sensitivity import pv_sweep
+
+# length of time horizon (days)
+Tf = 365
+Nperday = 6
+
+gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters('F02', lambda_version=1)
+dict_opts = {'allowed_hours': [0, 0, 1, 1, 1, 0], 'allowed_days': [1, 1, 1, 1, 1, 0, 0]}
+
+# beta from 100% to 110% in steps of 0.5%
+num_points = 21
+p_path = np.column_stack([beta * np.linspace(1, 1.1, num_points), np.full(num_points, gamma),
+                          np.full(num_points, pv_lambda)])
+
+t_start = time.time()
+results, methods = pv_sweep(Tf, Nperday, x0, Base, p_path, patient_volume, dict_opts)
+print('Computation time:', time.time() - t_start)
+for p, result, method in zip(p_path, results, methods):
+    print('beta:', round(p[0], 5), 'relaxed treatments:', round(float(np.sum(result.u)), 3), 'method:', method)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Heuristic.heuristic_batch import pv_heuristic_batch
+
+"""
+Generation of pv treatment schedules for a cohort of patients sharing a clinic with a limited
+number of treatment places (e.g. phlebotomy chairs) per grid point. Each patient keeps x3 inside
+[0.8B, 1.1B] using the heuristic algorithm, where treatment times at full grid points are not valid
+and conflicts are repaired by moving treatments of other patients to earlier valid times
+(see Modules/Heuristic/heuristic_batch.py).
+
+Inputs:
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+patients:       List of dictionaries with patient data with keys
+    'x0':               Initial value of x
+    'B':                Steady state value of x3
+    'pv_lambda':        Patient parameter pv_lambda
+    'p_in':             Patient parameters [beta, gamma]
+    'patient_volume':   Total blood volume of patient
+    'dict_opts':        Optional dictionary with 'allowed_hours', 'allowed_days', 'forbidden_days'
+                        and 'max_treatment_volume' of the patient in format of pv_schedule
+capacity:       Number of treatment places per grid point, int or array with length Tf*Nperday
+dict_opts:      Dictionary with options of the clinic in format of pv_schedule ('allowed_hours',
+                'allowed_days', 'forbidden_days', 'max_treatment_volume'), combined with the options of each patient
+
+Outputs:
+x1_opt:         Trajectories for x1 with shape (K, N+1)
+x2_opt:         Trajectories for x2 with shape (K, N+1)
+x3_opt:         Trajectories for x3 with shape (K, N+1)
+q_opt:          Trajectories of objective value with shape (K, N+1)
+u:              Control on the integration grid with shape (K, N)
+tgrid:          Time grid of trajectories for plotting
+allowed_arr:    Boolean array of allowed times with shape (K, N)
+load:           Number of occupied treatment places at each grid point
+error_flag:     Array indicating for each patient whether no valid schedule was found
+"""
+def clinic_schedule(Tf, Nperday, patients, capacity, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+
+    N = int(Tf * Nperday)
+    dt = Tf / N
+    K = len(patients)
+
+    x0 = np.empty((K, 3))
+    p_in = np.empty((K, 2))
+    pv_lambda = np.empty(K)
+    B = np.empty(K)
+    max_fraction = np.empty(K)
+    allowed_arr = np.empty((K, N), dtype=bool)
+
+    # calendars are shared by many patients and generated only once
+    calendars = {}
+    for i, patient in enumerate(patients):
+        opts = dict(dict_opts)
+        if 'dict_opts' in patient.keys():
+            opts.update(patient['dict_opts'])
+        x0[i] = patient['x0']
+        p_in[i] = patient['p_in']
+        pv_lambda[i] = patient['pv_lambda']
+        B[i] = patient['B']
+
+        # maximal fractional blood removal, default treatment volume is 500 ml
+        if 'max_treatment_volume' in opts.keys():
+            max_treatment_volume = opts['max_treatment_volume']
+        else:
+            max_treatment_volume = 500
+        max_fraction[i] = max_treatment_volume / patient['patient_volume']
+
+        key = repr(sorted((k, opts[k]) for k in ('allowed_hours', 'allowed_days', 'forbidden_days') if k in opts))
+        if key not in calendars:
+            calendars[key] = allowed_generator(Nperday, opts, N, dt)
+        allowed_arr[i] = calendars[key]
+
+    x_opt, q_opt, u, tgrid, load, error_flag = pv_heuristic_batch(Tf, N, x0, p_in, pv_lambda, B, max_fraction,
+                                                                  allowed_arr, capacity=capacity)
+    if np.any(error_flag):
+        print('No valid schedule found for', int(np.sum(error_flag)), 'patients. Capacity is too low.')
+
+    return x_opt[:, :, 0], x_opt[:, :, 1], x_opt[:, :, 2], q_opt, u, tgrid, allowed_arr, load, error_flag
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+This file contains the closed-loop policy computed by the dynamic programming approach
+and helpers for its bit-packed storage.
+
+"""
+
+import numpy as np
+
+
+"""
+Storage of the policy of one stage with ceil(log2(NU)) bits per state.
+
+_pack_policy:
+Inputs:
+u_idx:      Array of control indices for each state
+num_bits:   Number of bits per state
+
+Output:
+Array of shape (num_bits, ceil(len(u_idx)/8)) with one packed bit plane per row
+
+_policy_values:
+Inputs:
+u_packed:   Packed policy returned by _pack_policy
+idx:        Flattened state indices (int or array)
+
+Output:
+Control indices of the states idx
+"""
+def _pack_policy(u_idx, num_bits):
+    return np.stack([np.packbits((u_idx >> b) & 1) for b in range(num_bits)])
+
+
+def _policy_values(u_packed, idx):
+    idx = np.asarray(idx)
+    byte = idx >> 3
+    shift = 7 - (idx & 7)
+    u_ind = np.zeros(idx.shape, dtype=np.int64)
+    for b in range(u_packed.shape[0]):
+        u_ind |= ((u_packed[b][byte] >> shift) & 1).astype(np.int64) << b
+    return u_ind
+
+
+"""
+Closed-loop policy and cost-to-go of the dynamic programming approach on the whole state grid.
+The policy is computed once by dp_policy_pv and can be queried for arbitrary initial values
+and start days of patients with the same dynamics parameters without recomputation.
+
+Attributes:
+x1, x2, x3:     State grids of the three dimensions
+U:              Discrete control values
+next_idx:       List with flattened index of the next state for each control
+stage_cost:     List with stage cost for each control, inf if the next state is out-of-bounds
+U_opt:          List with packed policy for each stage, None for blocked stages (u=0)
+J:              Cost-to-go of stage 0 for each state
+stages_per_day: Number of decision stages per day
+stage_hour:     First allowed hour of each stage of a day on the integration grid
+Nperday:        Number of integration points per day
+params:         Dictionary with Tf, Base, pv_lambda, p_in, max_fraction and p_shift
+
+Methods:
+state_index(x):             Flattened indices of states x with shape (K, 3), -1 outside of the grid
+control(x, k):              Optimal control values for states x in stage k
+rollout(x0, start_day):     Closed-loop trajectories for initial values x0 with shape (K, 3)
+cost_to_go(x, start_day):   Optimal cost of states x from stage 0 until the end of the horizon, only the
+                            cost-to-go of stage 0 is stored (start_day 0), the rollout cost of the policy
+                            is available for other start days
+grid_control(u, start_day): Controls of stages mapped to the integration grid with Nperday points
+save(path), load(path):     Storage in a NumPy .npz container
+"""
+class DPPolicy:
+
+    def __init__(self, x1, x2, x3, U, next_idx, stage_cost, U_opt, J, stages_per_day, stage_hour, Nperday, params):
+        self.x1 = x1
+        self.x2 = x2
+        self.x3 = x3
+        self.U = U
+        self.next_idx = next_idx
+        self.stage_cost = stage_cost
+        self.U_opt = U_opt
+        self.J = J
+        self.stages_per_day = stages_per_day
+        self.stage_hour = stage_hour
+        self.Nperday = Nperday
+        self.params = params
+        self.shape = (len(x1), len(x2), len(x3))
+
+    @property
+    def N(self):
+        return len(self.U_opt)
+
+    def state_index(self, x):
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        idx = []
+        for d, grid in enumerate((self.x1, self.x2, self.x3)):
+            idx.append(np.round((x[:, d] - grid[0]) / (grid[-1] - grid[0]) * (len(grid) - 1)).astype(np.int64))
+        valid = np.all([(i >= 0) & (i < n) for i, n in zip(idx, self.shape)], axis=0)
+        flat = np.full(x.shape[0], -1, dtype=np.int64)
+        flat[valid] = np.ravel_multi_index([i[valid] for i in idx], self.shape)
+        return flat
+
+    def _control_index(self, idx, k):
+        if self.U_opt[k] is None:
+            return np.zeros(idx.shape, dtype=np.int64)
+        return _policy_values(self.U_opt[k], idx)
+
+    def control(self, x, k):
+        idx = self.state_index(x)
+        u_ind = self._control_index(np.maximum(idx, 0), k)
+        u_ind[idx < 0] = 0
+        return self.U[u_ind]
+
+    def cost_to_go(self, x, start_day=0):
+        if start_day != 0:
+            raise ValueError('The cost-to-go is only stored for start_day 0, use the cost of rollout instead')
+        idx = self.state_index(x)
+        J = np.full(idx.shape, np.inf)
+        J[idx >= 0] = self.J[idx[idx >= 0]]
+        return J
+
+    """
+    Closed-loop simulation on the state grid from start_day until the end of the horizon.
+
+    Inputs:
+    x0:         Initial values with shape (K, 3) or (3,)
+    start_day:  Day of the initial values, the policy of the following stages is used
+
+    Outputs:
+    u:          Control values with shape (K, number of stages)
+    x:          Trajectories on the state grid with shape (K, number of stages + 1, 3),
+                nan for initial values outside of the grid
+    cost:       Cost of the trajectories, inf if infeasible
+    """
+    def rollout(self, x0, start_day=0):
+        k0 = int(start_day * self.stages_per_day)
+        idx = self.state_index(x0)
+        valid = idx >= 0
+        idx = np.maximum(idx, 0)
+        K = idx.shape[0]
+        u = np.zeros((K, self.N - k0))
+        x = np.full((K, self.N - k0 + 1, 3), np.nan)
+        cost = np.where(valid, 0., np.inf)
+
+        def store(j, idx):
+            i1, i2, i3 = np.unravel_index(idx, self.shape)
+            x[valid, j, 0] = self.x1[i1[valid]]
+            x[valid, j, 1] = self.x2[i2[valid]]
+            x[valid, j, 2] = self.x3[i3[valid]]
+
+        store(0, idx)
+        for k in range(k0, self.N):
+            u_ind = self._control_index(idx, k)
+            idx_next = np.empty_like(idx)
+            for uind in np.unique(u_ind):
+                m = u_ind == uind
+                cost[m] += self.stage_cost[uind][idx[m]]
+                idx_next[m] = self.next_idx[uind][idx[m]]
+            idx = idx_next
+            u[:, k - k0] = self.U[u_ind]
+            store(k - k0 + 1, idx)
+        u[~valid] = 0
+        return u, x, cost
+
+    def grid_control(self, u, start_day=0):
+        u = np.asarray(u)
+        u_grid = np.zeros(u.shape[:-1] + (int(u.shape[-1] / self.stages_per_day * self.Nperday),))
+        k0 = int(start_day * self.stages_per_day)
+        for i in range(u.shape[-1]):
+            s = (k0 + i) % self.stages_per_day
+            if self.stage_hour[s] is not None:
+                u_grid[..., (i // self.stages_per_day) * self.Nperday + self.stage_hour[s]] = u[..., i]
+        return u_grid
+
+    def save(self, path):
+        # stages sharing the same policy (e.g. by stationarity) are stored once
+        packed = []
+        policy_map = np.full(self.N, -1, dtype=np.int64)
+        ids = {}
+        for k, u_packed in enumerate(self.U_opt):
+            if u_packed is not None:
+                if id(u_packed) not in ids:
+                    ids[id(u_packed)] = len(packed)
+                    packed.append(u_packed)
+                policy_map[k] = ids[id(u_packed)]
+        arrays = {'x1': self.x1, 'x2': self.x2, 'x3': self.x3, 'U': self.U, 'J': self.J,
+                  'policy_map': policy_map, 'stages_per_day': self.stages_per_day, 'Nperday': self.Nperday,
+                  'stage_hour': np.array([-1 if h is None else h for h in self.stage_hour])}
+        if packed:
+            arrays['policies'] = np.stack(packed)
+        for uind in range(len(self.U)):
+            arrays['next_idx_' + str(uind)] = self.next_idx[uind]
+            arrays['stage_cost_' + str(uind)] = self.stage_cost[uind]
+        for key, value in self.params.items():
+            arrays['param_' + key] = np.asarray(value)
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        NU = len(data['U'])
+        policy_map = data['policy_map']
+        policies = data['policies'] if 'policies' in data.files else []
+        U_opt = [None if m < 0 else policies[m] for m in policy_map]
+        params = {}
+        for key in data.files:
+            if key.startswith('param_'):
+                value = data[key]
+                params[key[6:]] = value.tolist() if value.ndim > 0 else value.item()
+        return DPPolicy(data['x1'], data['x2'], data['x3'], data['U'],
+                        [data['next_idx_' + str(uind)] for uind in range(NU)],
+                        [data['stage_cost_' + str(uind)] for uind in range(NU)],
+                        U_opt, data['J'], int(data['stages_per_day']),
+                        [None if h < 0 else int(h) for h in data['stage_hour']], int(data['Nperday']), params)
@@ -24,13 +24,15 @@ sys.path.append('../../')
 
 from Modules.NLP.integrate_nlp_sol import integrate_nlp_sol
 from Modules.Model.model_integrator import model_integrator
+from Modules.Model.allowed_generator import allowed_generator
 from Modules.Tools.patient_parameters import *
+from Modules.DynamicProg.dp_policy import DPPolicy, _pack_policy
 
-from pylab import * 
-
-import sparse
+import numpy as np
 import time
 import resource
+import os
+from concurrent.futures import ThreadPoolExecutor
 """
 Dynamic programming approach for generation of schedules for PV patients. 
 !!! Caution: very high storage demand, especially with highly increasing NX !!!
@@ -41,15 +43,27 @@ Nperday:        Number of integration points per day, only used for integration
 x0:             Initial value of dynamical variables
 Base:           Steady state value of x3
 pv_lambda:      pv_lambda value of patient 
-patient_volume: patient blood volume
+patient_volume: patient blood volume, unused (the treatments are given by max_fraction), kept for compatibility
 allowed_opts:   dictionary options for allowed days in format similar to pv_schedule
-max_fraction:   maximal fractional blood loss
+                ('allowed_days', 'allowed_hours' with length Nperday, 'forbidden_days')
+max_fraction:   maximal fractional blood loss, control u removes the fraction u*max_fraction of x3
 x3_up:          upper bound for x3
 dp_options:     dictionary with options for dynamic programming including:
         NK:         number of RK4 steps per interval
-        NU:         number of discrete control values
+        NU:         number of discrete control values u in linspace(0, 1, NU), i.e. partial treatment volumes
         NX:         number of state values (highly increases precision, but also storage demand!)
         p_shift:    shifting factor in rounding rule
+        stages_per_day:     number of decision stages per day, has to divide Nperday (default: 1).
+                            A stage is allowed if one of its hours is allowed in 'allowed_hours',
+                            the treatment is placed at the first allowed hour of the stage
+        stationary_policy:  reuse the weekly policy block once it became stationary (default: False)
+        stationary_tol:     tolerance for stationarity of the relative cost-to-go J_k - J_{k+7} (default: 1e-9)
+        num_threads:        number of threads processing tiles of the state grid (default: number of cpus)
+        tile_size:          number of states per tile (default: 2**18)
+        memory_budget:      memory budget in bytes; if the estimated storage exceeds it, float32 values,
+                            int32 indices and if necessary a smaller NX are used (default: no budget)
+
+return_policy:  Option to return the closed-loop policy object additionally
 
 Outputs:
     x1_opt:     Trajectory for computed x1
@@ -58,40 +72,191 @@ Outputs:
     q_opt:      Trajectory for objective function
     u_dp:       Optimal control
     tgrid:      Time grid for plotting of trajectories
+Additional Output for return_policy == True:
+    policy:     DPPolicy object, which can be queried for other initial values and start days
+                (see Modules/DynamicProg/dp_policy.py)
 
+The backward pass is available separately as dp_policy_pv(Tf, Nperday, Base, pv_lambda, p_in, allowed_opts,
+max_fraction, dp_options), which returns the DPPolicy object only.
 """
 
 
-def dynamic_prog_pv(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume,
-                    allowed_opts, max_fraction, x3_up,  dp_options):
+"""
+Check whether the backward pass of the dynamic programming approach became stationary
+with respect to the week.
 
-    # start of time measurement
-    t = time.clock()
+Inputs:
+J_weeks:        Cost-to-go [J_k, J_{k+7}, J_{k+14}] at three consecutive week boundaries
+U_week:         Policy of the days k, ..., k+6
+U_week_next:    Policy of the days k+7, ..., k+13
+tol:            Tolerance for the change of the relative cost-to-go
 
-    # Number of control intervals = number of days here
-    N = int(Tf)
+Output:
+True if J_k - J_{k+7} equals J_{k+7} - J_{k+14} up to tol and both policy blocks coincide
+"""
+def _is_stationary(J_weeks, U_week, U_week_next, tol):
+    # policy blocks have to coincide
+    for u_a, u_b in zip(U_week, U_week_next):
+        if u_a is None or u_b is None:
+            if u_a is not u_b:
+                return False
+        elif not np.array_equal(u_a, u_b):
+            return False
+    # infeasible states have to coincide
+    inf_0 = np.isinf(J_weeks[0])
+    if not (np.array_equal(inf_0, np.isinf(J_weeks[1])) and np.array_equal(inf_0, np.isinf(J_weeks[2]))):
+        return False
+    feas = ~inf_0
+    J_diff = J_weeks[0][feas] - J_weeks[1][feas]
+    J_diff_next = J_weeks[1][feas] - J_weeks[2][feas]
+    if J_diff.size > 0 and np.max(np.abs(J_diff - J_diff_next)) > tol * (1 + np.max(np.abs(J_diff))):
+        return False
+    return True
 
-    # necessary transformation of allowed configuration for dp algorithm
-    allowed_days = allowed_opts['allowed_days']
-    allowed_idx = [i for i in range(7) if allowed_days[i]==1]
-    t_blocked = [j for j in range(N) if int(j/1) % 7 not in allowed_idx]
-    
-    if 'forbidden_days' in allowed_opts.keys():
-        forbidden_days = allowed_opts['forbidden_days']
-        for f in forbidden_days:
-            t_blocked += list(f)
+
+"""
+Estimation of the storage demand of the dynamic programming approach
+
+Inputs:
+NX:                 Number of state values per dimension
+NU:                 Number of discrete control values
+N_free:             Number of stages with allowed treatment, for which a policy is stored
+num_levels:         Number of composed transition maps for blocked periods
+stationary_policy:  Whether the cost-to-go of three week boundaries is stored additionally
+value_bytes:        Bytes per cost value
+index_bytes:        Bytes per state index
+
+Output:
+Estimated storage demand in bytes
+"""
+def _dp_memory_estimate(NX, NU, N_free, num_levels, stationary_policy, value_bytes, index_bytes):
+    num_states = NX**3
+    # transition tables of all controls and composed maps
+    tables = (NU + num_levels - 1) * num_states * (index_bytes + value_bytes)
+    # cost-to-go and its buffers
+    values = (3 + 3 * stationary_policy) * num_states * value_bytes
+    # packed policies of all free stages and the unpacked policy of the current stage
+    policies = N_free * num_states * max(int(np.ceil(np.log2(NU))), 1) / 8 + num_states
+    return int(tables + values + policies)
+
+
+"""
+Apply func(start, stop) to all tiles of [0, size) using the thread pool and wait for completion.
+NumPy releases the GIL in the arithmetic and gather kernels, so tiles are processed in parallel.
+"""
+def _parallel_tiles(pool, func, size, tile_size):
+    futures = [pool.submit(func, start, min(start + tile_size, size)) for start in range(0, size, tile_size)]
+    for future in futures:
+        future.result()
+
+
+def dp_policy_pv(Tf, Nperday, Base, pv_lambda, p_in, allowed_opts, max_fraction, dp_options):
+
+    # start of time measurement
+    t = time.perf_counter()
 
     # reading options from dp_options
+    # Number of decision stages per day
+    if 'stages_per_day' in dp_options.keys():
+        stages_per_day = dp_options['stages_per_day']
+    else:
+        stages_per_day = 1
+    if Nperday % stages_per_day != 0:
+        raise ValueError('stages_per_day has to divide Nperday')
+    hours_per_stage = Nperday // stages_per_day
+    # Number of stages in one week
+    N_week = 7 * stages_per_day
+
+    # Number of control intervals = number of stages
+    N = int(Tf * stages_per_day)
+
     # Number of Runge-Kutta 4 steps per interval and step size
     NK = dp_options['NK']  
     DT = Tf/(N*NK)
 
     # Number of discrete control values
     NU = dp_options['NU'] 
+    # Number of bits per state for storage of the policy
+    num_bits = max(int(np.ceil(np.log2(NU))), 1)
 
     # Number of discrete state values
     NX = dp_options['NX'] 
 
+    # Number of threads and number of states per tile
+    if 'num_threads' in dp_options.keys():
+        num_threads = dp_options['num_threads']
+    else:
+        num_threads = os.cpu_count()
+    if 'tile_size' in dp_options.keys():
+        tile_size = dp_options['tile_size']
+    else:
+        tile_size = 2**18
+
+    # Detection of a stationary weekly policy far from the end of the horizon
+    if 'stationary_policy' in dp_options.keys():
+        stationary_policy = dp_options['stationary_policy']
+    else:
+        stationary_policy = False
+    if 'stationary_tol' in dp_options.keys():
+        stationary_tol = dp_options['stationary_tol']
+    else:
+        stationary_tol = 1e-9
+
+    # Use shift in rounding rule if stated
+    if 'p_shift' in dp_options.keys():
+        p_shift = dp_options['p_shift']
+    else:
+        # default shift is 0
+        p_shift = 0.0
+
+    # necessary transformation of allowed configuration for dp algorithm
+    # t_blocked[k] is True if no treatment is allowed in stage k
+    if 'allowed_days' in allowed_opts.keys():
+        allowed_days = allowed_opts['allowed_days']
+    else:
+        allowed_days = [1] * 7
+    if 'allowed_hours' in allowed_opts.keys():
+        allowed_hours = allowed_opts['allowed_hours']
+    else:
+        allowed_hours = [1] * Nperday
+    # first allowed hour in each stage of a day, None if the stage is blocked
+    stage_hour = []
+    for s in range(stages_per_day):
+        hours = [h for h in range(s * hours_per_stage, (s + 1) * hours_per_stage) if allowed_hours[h] > 0]
+        stage_hour.append(hours[0] if hours else None)
+    stage_opts = {'allowed_hours': [0 if h is None else 1 for h in stage_hour], 'allowed_days': allowed_days}
+    # blocked stages caused by the weekly pattern only
+    t_weekly_blocked = ~allowed_generator(stages_per_day, stage_opts, N, 1./stages_per_day)
+    if 'forbidden_days' in allowed_opts.keys():
+        stage_opts['forbidden_days'] = allowed_opts['forbidden_days']
+        t_blocked = ~allowed_generator(stages_per_day, stage_opts, N, 1./stages_per_day)
+    else:
+        t_blocked = np.copy(t_weekly_blocked)
+
+    # Number of composed maps needed for the longest blocked period
+    max_blocked_run = 0
+    run = 0
+    for k in range(N):
+        run = run + 1 if t_blocked[k] else 0
+        max_blocked_run = max(max_blocked_run, run)
+    num_levels = 1
+    while 2**num_levels <= max_blocked_run:
+        num_levels += 1
+
+    # Choose data types and NX according to the memory budget
+    value_dtype = np.float64
+    index_dtype = np.int64
+    if 'memory_budget' in dp_options.keys():
+        memory_budget = dp_options['memory_budget']
+        N_free = int(N - np.sum(t_blocked))
+        memory = _dp_memory_estimate(NX, NU, N_free, num_levels, stationary_policy, 8, 8)
+        if memory > memory_budget:
+            value_dtype = np.float32
+            index_dtype = np.int32
+            while NX > 2 and _dp_memory_estimate(NX, NU, N_free, num_levels, stationary_policy, 4, 4) > memory_budget:
+                NX -= 1
+            print("Estimated memory of", memory / 1e9, "GB exceeds memory budget. Using float32/int32 with NX =", NX)
+
     # System dynamics, can be called with matricex
     def f(x1, x2, x3, u):
         k1 = 1./8
@@ -106,165 +271,188 @@ def dynamic_prog_pv(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume,
         return (x1_dot, x2_dot, x3_dot, q_dot)
 
     # Control enumeration
-    U  = linspace(0,1,NU)
+    U  = np.linspace(0,1,NU)
 
     # State space enumeration
     # This is a hard coded reasonable domain for x
     # Can be reduced for higher precision without increased storage demand if 
     # tighter bounds are known
-    x1 = linspace(50, 170, NX)
-    x2 = linspace(35, 150, NX)
-    x3 = linspace(0.8*Base, 1.1*Base, NX)
-    X1, X2, X3 = meshgrid(x1, x2, x3, indexing='ij')
-
-    # For each control action and state, precalculate next state and stage cost
-    stage_J = []
-    next_x1 = []
-    next_x2 = []
-    next_x3 = []
-    for u in U:
-      # Take number of integration steps
-      X1_k = copy(X1)
-      X2_k = copy(X2)
-      X3_k = copy(X3)
-      Q_k = zeros(X1.shape)
-      for k in range(NK):
-        # RK4 integration for x1, x2 and q
-        k1_x1, k1_x2, k1_x3, k1_q = f(X1_k, X2_k, X3_k, u)
-        k2_x1, k2_x2, k2_x3, k2_q = f(X1_k + DT/2 * k1_x1, X2_k + DT/2 * k1_x2, X3_k + DT/2 * k1_x3, u)
-        k3_x1, k3_x2, k3_x3, k3_q = f(X1_k + DT/2 * k2_x1, X2_k + DT/2 * k2_x2, X3_k + DT/2 * k2_x3, u)
-        k4_x1, k4_x2, k4_x3, k4_q = f(X1_k + DT * k3_x1, X2_k + DT * k3_x2, X3_k + DT * k3_x3, u)
-        X1_k += DT/6*(k1_x1 + 2*k2_x1 + 2*k3_x1 + k4_x1)
-        X2_k += DT/6*(k1_x2 + 2*k2_x2 + 2*k3_x2 + k4_x2)
-        X3_k += DT/6*(k1_x3 + 2*k2_x3 + 2*k3_x3 + k4_x3)
-        Q_k += DT/6*(k1_q + 2*k2_q + 2*k3_q + k4_q)
-
-      if u == 1:
-        X3_k *= (1-500./patient_volume)
-
-      # Save the stage cost and next state
-      next_x1.append(X1_k)
-      next_x2.append(X2_k)
-      next_x3.append(X3_k)
-      stage_J.append(Q_k)
-
-    X1_before_shift = copy(next_x1)
-    X2_before_shift = copy(next_x2)
-    X3_before_shift = copy(next_x3)
-    Q_before_shift = copy(stage_J)
-    
-    # Use shift in rounding rule if stated
-    if 'p_shift' in dp_options.keys():
-        p_shift = dp_options['p_shift']
-    else:
-        # default shift is 0
-        p_shift = 0.0
-
-#    for p_shift in P:
-    stage_J = []
-    next_x1 = []
-    next_x2 = []
-    next_x3 = []
-    X1_k = copy(X1)
-    X2_k = copy(X2)
-    X3_k = copy(X3)
-    Q_k = zeros(X1.shape)
-    for u in {0, 1}:
-        # Find out which state comes next (index)
-        X1_k = matrix.round(p_shift + (X1_before_shift[u] - x1[0]) / (x1[-1] - x1[0]) * (NX - 1)).astype(int)  
-        X2_k = matrix.round(p_shift + (X2_before_shift[u] - x2[0]) / (x2[-1] - x2[0]) * (NX - 1)).astype(int)
-        X3_k = matrix.round(p_shift + (X3_before_shift[u] - x3[0]) / (x3[-1] - x3[0]) * (NX - 1)).astype(int)
-
-        Q_k = Q_before_shift[u]
-        # Infinite cost if state gets out-of-bounds
-        I = X1_k < 0;
-        Q_k[I] = inf;
-        X1_k[I] = 0
-        I = X2_k < 0;
-        Q_k[I] = inf;
-        X2_k[I] = 0
-        I = X3_k < 0;
-        Q_k[I] = inf;
-        X3_k[I] = 0
-        I = X1_k >= NX;
-        Q_k[I] = inf;
-        X1_k[I] = 0
-        I = X2_k >= NX;
-        Q_k[I] = inf;
-        X2_k[I] = 0
-        I = X3_k >= NX;
-        Q_k[I] = inf;
-        X3_k[I] = 0
-
-        # Save the stage cost and next state
-        next_x1.append(X1_k)
-        next_x2.append(X2_k)
-        next_x3.append(X3_k)
-        stage_J.append(Q_k)
-
-    print("Initial table ready. This took ", time.clock() - t, " seconds.")
-    print("Memory: ", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000000, " GB")
-    t = time.clock()
-    for k in range(N):
-      print('-',end="")
-    print(' ')
-    
-    # Calculate cost-to-go (no end cost) and optimal control
-    J = zeros(X1.shape)
-    U_opt = []
-    for k in reversed(list(range(N))):
-        # Cost to go for the previous step, optimal control action
-        print('+',end="", flush=True)
-        J_prev = inf*ones(X1.shape)
-        u_prev = zeros(X1.shape, dtype=bool)
-        # if time in t_blocked fix control to 0, else allow 1
-        if k in t_blocked:
-            U_feas = [0]
-        else:
-            U_feas = [0, 1]
-            
-        # Test all control actions
-        for uind in U_feas:
-            J_prev_test = J[next_x1[uind], next_x2[uind], next_x3[uind]]+stage_J[uind]*1 # u_weights[k]
-            better = J_prev_test<J_prev
-            u_prev[better] = uind
-            J_prev[better] = J_prev_test[better]
-             
-        # Update cost-to-go and save optimal control
-        J = J_prev
-        u_sparse = sparse.COO(u_prev)
-        U_opt.append(u_sparse)
+    x1 = np.linspace(50, 170, NX)
+    x2 = np.linspace(35, 150, NX)
+    x3 = np.linspace(0.8*Base, 1.1*Base, NX)
+    shape = (NX, NX, NX)
+    num_states = NX**3
+
+    # For each control action and state, precalculate next state (flattened index) and stage cost.
+    # The state grid is split into tiles which are processed by a thread pool.
+    next_idx = [np.empty(num_states, dtype=index_dtype) for u in U]
+    stage_cost = [np.empty(num_states, dtype=value_dtype) for u in U]
+
+    def transition_tile(start, stop):
+        i1, i2, i3 = np.unravel_index(np.arange(start, stop), shape)
+        for uind in range(NU):
+            u = U[uind]
+            # Take number of integration steps
+            X1_k = x1[i1]
+            X2_k = x2[i2]
+            X3_k = x3[i3]
+            Q_k = np.zeros(stop - start)
+            for k in range(NK):
+                # RK4 integration for x1, x2 and q
+                k1_x1, k1_x2, k1_x3, k1_q = f(X1_k, X2_k, X3_k, u)
+                k2_x1, k2_x2, k2_x3, k2_q = f(X1_k + DT/2 * k1_x1, X2_k + DT/2 * k1_x2, X3_k + DT/2 * k1_x3, u)
+                k3_x1, k3_x2, k3_x3, k3_q = f(X1_k + DT/2 * k2_x1, X2_k + DT/2 * k2_x2, X3_k + DT/2 * k2_x3, u)
+                k4_x1, k4_x2, k4_x3, k4_q = f(X1_k + DT * k3_x1, X2_k + DT * k3_x2, X3_k + DT * k3_x3, u)
+                X1_k = X1_k + DT/6*(k1_x1 + 2*k2_x1 + 2*k3_x1 + k4_x1)
+                X2_k = X2_k + DT/6*(k1_x2 + 2*k2_x2 + 2*k3_x2 + k4_x2)
+                X3_k = X3_k + DT/6*(k1_x3 + 2*k2_x3 + 2*k3_x3 + k4_x3)
+                Q_k = Q_k + DT/6*(k1_q + 2*k2_q + 2*k3_q + k4_q)
+
+            # jump by the treatment with fractional volume u
+            X3_k *= (1 - u*max_fraction)
+
+            # Find out which state comes next (index)
+            j1 = np.round(p_shift + (X1_k - x1[0]) / (x1[-1] - x1[0]) * (NX - 1)).astype(np.int64)
+            j2 = np.round(p_shift + (X2_k - x2[0]) / (x2[-1] - x2[0]) * (NX - 1)).astype(np.int64)
+            j3 = np.round(p_shift + (X3_k - x3[0]) / (x3[-1] - x3[0]) * (NX - 1)).astype(np.int64)
+
+            # Infinite cost if state gets out-of-bounds
+            for j in (j1, j2, j3):
+                I = (j < 0) | (j >= NX)
+                Q_k[I] = np.inf
+                j[I] = 0
+
+            # Save the stage cost and next state
+            next_idx[uind][start:stop] = np.ravel_multi_index((j1, j2, j3), shape)
+            stage_cost[uind][start:stop] = Q_k
+
+    # the worker threads are shut down also if an exception occurs
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        _parallel_tiles(pool, transition_tile, num_states, tile_size)
+
+        # Composed transition maps for 2^j stages without treatment obtained by repeated squaring.
+        # Blocked stages only allow u=0 and the transition is time-invariant, so a blocked
+        # period of m stages needs only O(log m) gathers in the backward pass.
+        blocked_idx = [next_idx[0]]
+        blocked_cost = [stage_cost[0]]
+        while len(blocked_idx) < num_levels:
+            idx_half = blocked_idx[-1]
+            cost_half = blocked_cost[-1]
+            idx_new = np.empty(num_states, dtype=index_dtype)
+            cost_new = np.empty(num_states, dtype=value_dtype)
+
+            def compose_tile(start, stop):
+                idx_tile = idx_half[start:stop]
+                np.take(idx_half, idx_tile, out=idx_new[start:stop])
+                np.take(cost_half, idx_tile, out=cost_new[start:stop])
+                cost_new[start:stop] += cost_half[start:stop]
+
+            _parallel_tiles(pool, compose_tile, num_states, tile_size)
+            blocked_idx.append(idx_new)
+            blocked_cost.append(cost_new)
+
+        print("Initial table ready. This took ", time.perf_counter() - t, " seconds.")
+        print("Memory: ", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000000, " GB")
+        t = time.perf_counter()
+        for k in range(N):
+          print('-',end="")
+        print(' ')
+
+        # Calculate cost-to-go (no end cost) and optimal control
+        # Policy of blocked stages is known to be 0 and is stored as None,
+        # other policies are stored with num_bits bits per state
+        # J and J_prev are swapped after each stage to avoid reallocation
+        J = np.zeros(num_states, dtype=value_dtype)
+        J_prev = np.empty(num_states, dtype=value_dtype)
+        u_prev = np.empty(num_states, dtype=np.min_scalar_type(NU - 1))
+        U_opt = [None] * N
+
+        def blocked_tile(start, stop):
+            np.take(J, blocked_idx[j][start:stop], out=J_prev[start:stop])
+            J_prev[start:stop] += blocked_cost[j][start:stop]
+
+        def stage_tile(start, stop):
+            # Test all control actions
+            J_prev_tile = J_prev[start:stop]
+            u_prev_tile = u_prev[start:stop]
+            np.take(J, next_idx[0][start:stop], out=J_prev_tile)
+            J_prev_tile += stage_cost[0][start:stop]
+            u_prev_tile[:] = 0
+            for uind in range(1, NU):
+                J_prev_test = np.take(J, next_idx[uind][start:stop])
+                J_prev_test += stage_cost[uind][start:stop]
+                better = J_prev_test < J_prev_tile
+                u_prev_tile[better] = uind
+                np.copyto(J_prev_tile, J_prev_test, where=better)
+
+        # Cost-to-go at the last week boundaries k = N - N_week*w of consecutive weeks without forbidden days.
+        # Far from the horizon end the relative cost-to-go J_k - J_{k+N_week} becomes constant and the
+        # weekly policy block repeats, so it can be reused for all earlier weeks without forbidden days.
+        J_weeks = []
+        k = N - 1
+        while k >= 0:
+            if t_blocked[k]:
+                # Skip the whole blocked period [k_start, k] using the composed maps,
+                # stop at week boundaries if the stationarity is checked
+                k_start = k
+                while (k_start > 0 and t_blocked[k_start - 1] and
+                       not (stationary_policy and (N - k_start) % N_week == 0)):
+                    k_start -= 1
+                num_stages = k - k_start + 1
+                print('+' * num_stages, end="", flush=True)
+                j = 0
+                while num_stages > 0:
+                    if num_stages & 1:
+                        _parallel_tiles(pool, blocked_tile, num_states, tile_size)
+                        J, J_prev = J_prev, J
+                    num_stages >>= 1
+                    j += 1
+                k = k_start
+            else:
+                # Cost to go for the previous step, optimal control action
+                print('+',end="", flush=True)
+                _parallel_tiles(pool, stage_tile, num_states, tile_size)
+
+                # Update cost-to-go and save optimal control
+                J, J_prev = J_prev, J
+                U_opt[k] = _pack_policy(u_prev, num_bits)
+
+            if stationary_policy and (N - k) % N_week == 0:
+                if np.array_equal(t_blocked[k:k+N_week], t_weekly_blocked[k:k+N_week]):
+                    J_weeks = [np.copy(J)] + J_weeks[:2]
+                else:
+                    J_weeks = []
+                if len(J_weeks) == 3 and _is_stationary(J_weeks, U_opt[k:k+N_week], U_opt[k+N_week:k+2*N_week],
+                                                        stationary_tol):
+                    # Reuse the weekly block for all previous weeks without forbidden days
+                    J_diff = J_weeks[0] - J_weeks[1]
+                    J_diff[np.isinf(J_weeks[0])] = 0
+                    while k >= N_week and np.array_equal(t_blocked[k-N_week:k], t_weekly_blocked[k-N_week:k]):
+                        print('+' * N_week, end="", flush=True)
+                        J += J_diff
+                        U_opt[k-N_week:k] = U_opt[k:k+N_week]
+                        k -= N_week
+                    J_weeks = []
+            k -= 1
         
-    # Reorder U_opt by stage
-    U_opt.reverse()
     print(" ")
-    print("Computation of optimal control took ", time.clock() - t, " seconds.")
+    print("Computation of optimal control took ", time.perf_counter() - t, " seconds.")
+    params = {'Tf': Tf, 'Base': Base, 'pv_lambda': pv_lambda, 'p_in': list(p_in), 'max_fraction': max_fraction,
+              'p_shift': p_shift}
+    return DPPolicy(x1, x2, x3, U, next_idx, stage_cost, U_opt, J, stages_per_day, stage_hour, Nperday, params)
+
+
+def dynamic_prog_pv(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume,
+                    allowed_opts, max_fraction, x3_up,  dp_options, return_policy=False):
+
+    # backward pass for the closed-loop policy on the whole state grid
+    policy = dp_policy_pv(Tf, Nperday, Base, pv_lambda, p_in, allowed_opts, max_fraction, dp_options)
+
     # Find optimal control
-    u_opt = []
-    x1_opt = [x0[0]] 
-    x2_opt = [x0[1]] 
-    x3_opt = [x0[2]] 
-    i1 = int(round((x1_opt[0] - x1[0]) / (x1[-1] - x1[0]) * (NX - 1))) 
-    i2 = int(round((x2_opt[0] - x2[0]) / (x2[-1] - x2[0]) * (NX - 1)))
-    i3 = int(round((x3_opt[0] - x3[0]) / (x3[-1] - x3[0]) * (NX - 1)))
-    cost = 0
-    for k in range(N):
-        # Get the optimal control and go to next step
-        u_ind = U_opt[k][i1, i2, i3]
-        cost += stage_J[u_ind][ i1, i2, i3]
-        i1, i2, i3 = next_x1[u_ind][i1, i2, i3], next_x2[u_ind][i1, i2, i3], next_x3[u_ind][i1, i2, i3]
-
-        # Save the trajectories
-        if u_ind:
-            u_opt.append(1)
-        else:
-            u_opt.append(0)
-        x1_opt.append(x1[i1])
-        x2_opt.append(x2[i2])
-        x3_opt.append(x3[i3])
+    u_opt, x_grid, cost = policy.rollout(x0)
 
     # Optimal cost
-    print("\n Minimal cost: ", cost)
+    print("\n Minimal cost: ", cost[0])
 
     
     memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1000000
@@ -272,9 +460,8 @@ def dynamic_prog_pv(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume,
 
 
     # integration of solution for external plotting
-    u_dp = zeros(Tf*Nperday)
-    for i in range(len(u_opt)):
-        u_dp[int(i * Nperday)] = u_opt[i]
+    # the control of stage k is applied at the first allowed hour of the stage
+    u_dp = policy.grid_control(u_opt[0])
     dt = 1./Nperday
     N_int = int(Tf * Nperday)
 
@@ -284,4 +471,7 @@ def dynamic_prog_pv(Tf, Nperday, x0, Base, pv_lambda, p_in, patient_volume,
                                                                     Tf, integrator_function, None, max_fraction, p_in,
                                                                     sol_is_u=True)
 
-    return x1_opt, x2_opt, x3_opt, q_opt, u_dp, tgrid
\ No newline at end of file
+    if return_policy:
+        return x1_opt, x2_opt, x3_opt, q_opt, u_dp, tgrid, policy
+    else:
+        return x1_opt, x2_opt, x3_opt, q_opt, u_dp, tgrid
@@ -24,7 +24,6 @@ import sys
 sys.path.append('./Modules/Integrator')
 
 import numpy as np
-from Modules.Tools.plot_tools import state_separator
 
 """
 Heuristic algorithm for generation of treatment schedules according to Algorithm 1
@@ -40,7 +39,7 @@ integrator_function:    Casadi integrator function defined in pv_schedule routin
 p_in:                   Parameter vector (beta, gamma) of subject / patient
 max_fraction:           Maximal allowed fractional blood removal 
 Base:                   steady state value of x3 
-allowed_arr:            list indicating whether treatment is allowed at time point N
+allowed_arr:            list or boolean array indicating whether treatment is allowed at time point N
 
 Outputs: 
 x1_opt:                 Optimal trajectory (based on algorithm) of x1
@@ -51,17 +50,23 @@ u:                      Optimal control with control value for each valid grid p
 tgrid:                  Time grid of trajectories for plotting
 error_flag:             Indication whether the heuristic algorithm found a valid solution
 
+The trajectories x1_opt, x2_opt and x3_opt are views of the columns of one array with shape (N+1, 3).
 """
 
 
 def pv_heuristic_alg(Tf, N, x0, integrator_function, p_in, max_fraction, Base, allowed_arr):
     
     # time grid
-    tgrid = [Tf / N * k for k in range(N + 1)]
+    tgrid = Tf / N * np.arange(N + 1)
 
-    # Start values
-    x_opt = [x0]
-    q_opt = [0]
+    # allowed grid points as list of bools and their indices
+    allowed = (np.asarray(allowed_arr) >= 1e-8).tolist()
+    allowed_idx = np.flatnonzero(allowed)
+
+    # Start values, x_opt[k] and q_opt[k] are the solution at grid point k
+    x_opt = np.zeros((N + 1, 3))
+    q_opt = np.zeros(N + 1)
+    x_opt[0] = np.asarray(x0, dtype=float).ravel()
     u = [0]*N
     
     # Integration starts in forward mode
@@ -75,22 +80,21 @@ def pv_heuristic_alg(Tf, N, x0, integrator_function, p_in, max_fraction, Base, a
         count += 1
         # FORWARD MODE
         if not back_flag:        
-            i_out = integrator_function(x0=x_opt[-1], q0=q_opt[-1], u=u[k], p=p_in)   # forward integration
-            i_out['xf'][5] = i_out['xf'][5] * (1 - u[k]*max_fraction)                 # apply treatment if scheduled
+            i_out = integrator_function(x0=x_opt[k], q0=q_opt[k], u=u[k], p=p_in)   # forward integration
+            x_next = i_out['xf'][3:6].full().ravel()
+            x_next[2] = x_next[2] * (1 - u[k]*max_fraction)                        # apply treatment if scheduled
             
             
             # check if constraint in x3 is violated: start back search if yes
-            if i_out['xf'][5] > 1.1*Base:
+            if x_next[2] > 1.1*Base:
                 back_flag = True
-                first_step_back = True
-                q_opt_tmp = np.copy(q_opt)
-                x_opt_tmp = np.copy(x_opt)
+                k_violation = k
                 # print('Backtracking started at time ', tgrid[k])
    
-            else: # Append solution of integration to solution vector
+            else: # Store solution of integration
                 
-                x_opt.append(i_out['xf'][3:6])
-                q_opt.append(i_out['li'][1])
+                x_opt[k + 1] = x_next
+                q_opt[k + 1] = float(i_out['li'][1])
                 k = k + 1
         else:
             # BACKWARD MODE
@@ -98,52 +102,34 @@ def pv_heuristic_alg(Tf, N, x0, integrator_function, p_in, max_fraction, Base, a
             # Count >= number ensures that this happens at the beginning of the integration
             if count >=10 and k<=0:
                 print('Allowed grid is too sparse. Backward mode does not find a valid solution anymore')
-                # Store and return solution up to this point
-                x1_opt, x2_opt, x3_opt = state_separator(x_opt_tmp)
-                
-                # extend solutions to correct length by zero entries
-                x1_opt = np.concatenate([x1_opt, np.zeros(len(tgrid) - len(x1_opt))])
-                x2_opt = np.concatenate([x2_opt, np.zeros(len(tgrid) - len(x2_opt))])
-                x3_opt = np.concatenate([x3_opt, np.zeros(len(tgrid) - len(x3_opt))])
-                q_opt = np.concatenate([q_opt_tmp, np.zeros(len(tgrid) - len(q_opt_tmp))])
+                # Return solution up to the violation, extended to correct length by zero entries
+                x_opt[k_violation + 1:] = 0.
+                q_opt[k_violation + 1:] = 0.
                 
-                u = [u[i] for i in range(0, len(allowed_arr)) if allowed_arr[i]>=1e-8]
+                u = [u[i] for i in allowed_idx]
                 error_flag = 1  # error occured
-                return x1_opt, x2_opt, x3_opt, q_opt, u, tgrid, error_flag
-            
-            # first step back is actually no real step back, therefore it should not be deleted
-            if (k != 0 and not first_step_back):
-                del x_opt[-1]
-                del q_opt[-1]
-            elif first_step_back:
-                first_step_back = False
+                return x_opt[:, 0], x_opt[:, 1], x_opt[:, 2], q_opt, u, tgrid, error_flag
 
-            if allowed_arr[k]>=1e-8 and u[k] == 0:     
+            if allowed[k] and u[k] == 0:     
                 # if allowed time point and no treatment was applied, apply treatment
-                i_out = integrator_function(x0=x_opt[-1], q0=q_opt[-1], u=1, p=p_in)
-                i_out['xf'][5] = i_out['xf'][5] * (1 - max_fraction)
+                i_out = integrator_function(x0=x_opt[k], q0=q_opt[k], u=1, p=p_in)
+                x_next = i_out['xf'][3:6].full().ravel()
+                x_next[2] = x_next[2] * (1 - max_fraction)
                 #print('Applied treatment at time', tgrid[k])
-                if i_out['xf'][5] > 0.8*Base:    # if lower constraint is not violated, donate here
+                if x_next[2] > 0.8*Base:    # if lower constraint is not violated, donate here
                     back_flag = False
                     u[k] = 1
-                    x_opt.append(i_out['xf'][3:6])
-                    q_opt.append(i_out['li'][1])
+                    x_opt[k + 1] = x_next
+                    q_opt[k + 1] = float(i_out['li'][1])
                     k = k + 1
                 else:
                     # print('Lower constraint is violated. Going further back.')
                     k = k - 1
             else:
                 k = k - 1    # if time point not allowed, go further back to find last valid time point
-    
-    # split solution returned by integrator into a format suitable for evaluation
-    x1_opt, x2_opt, x3_opt = state_separator(x_opt)
         
     # Plot routine needs control only on valid time points
-    u = [u[i] for i in range(0, len(allowed_arr)) if allowed_arr[i]>=1e-8]
+    u = [u[i] for i in allowed_idx]
     
     error_flag = 0
-    return x1_opt, x2_opt, x3_opt, q_opt, u, tgrid, error_flag
-
-
-
-
+    return x_opt[:, 0], x_opt[:, 1], x_opt[:, 2], q_opt, u, tgrid, error_flag
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+import casadi as ca
+from Modules.Model.model_array import model_array
+from Modules.Integrator.integrator_rk4_array import rk4_array_integrator
+
+"""
+CasADi function integrating n_steps steps of one patient including the treatment jumps, generated
+from the numpy integrator evaluated on symbols. Used for the recomputation of single trajectories,
+which is too slow in numpy step by step.
+
+Inputs:
+F:          Numpy integrator function, see Modules/Integrator/integrator_rk4_array.py
+n_steps:    Number of steps per call
+
+Outputs:
+Function (x0, [u; p; max_fraction]) -> states after each of the n_steps steps with shape (3, n_steps),
+where u has length n_steps and the others are repeated over the steps
+"""
+def _step_accumulator(F, n_steps):
+    x = ca.SX.sym('x', 3)
+    p = ca.SX.sym('p', 4)
+    u = ca.SX.sym('u')
+    max_fraction = ca.SX.sym('max_fraction')
+    x_next, _ = F(np.array([x[0], x[1], x[2]], dtype=object), 0., 0., np.array([p[m] for m in range(4)], dtype=object))
+    step = ca.Function('step', [x, ca.vertcat(u, p, max_fraction)],
+                       [ca.vertcat(x_next[0], x_next[1], x_next[2] * (1 - u * max_fraction))])
+    return step.mapaccum(n_steps)
+
+
+"""
+Heuristic algorithm (Algorithm 1, see heuristic_alg.py) for many patients at once.
+All patients are integrated simultaneously in forward mode with the numpy integrator. If the upper
+constraint of a patient is violated, the latest valid treatment time is searched backwards for this
+patient only and its trajectory is recomputed from there.
+
+Optionally, the number of treatments per grid point is limited by a capacity shared by all patients
+(e.g. the number of phlebotomy chairs). A treatment time is valid if it is allowed for the patient,
+the lower constraint holds after the treatment and the capacity is not exhausted. If no such time
+exists, a conflict repair moves a treatment of another patient at a full grid point to an earlier
+valid time, if this keeps the other patient feasible.
+
+Inputs:
+Tf:                     End of time interval [0, Tf]
+N:                      Absolute number of integrator steps
+x0:                     Initial values with shape (K, 3)
+p_in:                   Parameters (beta, gamma) with shape (K, 2)
+pv_lambda:              Patient parameters pv_lambda with shape (K,)
+Base:                   Steady state values of x3 with shape (K,)
+max_fraction:           Maximal fractional blood removal with shape (K,)
+allowed_arr:            Allowed treatment times, boolean array with shape (N,) for all or (K, N) for each patient
+capacity:               Maximal number of treatments per grid point, None (unlimited), int or array with shape (N,)
+repair_depth:           Number of full grid points considered by the conflict repair of one violation
+
+Outputs:
+x_opt:                  Trajectories with shape (K, N+1, 3)
+q_opt:                  Trajectories of objective value with shape (K, N+1)
+u:                      Control on the integration grid with shape (K, N)
+tgrid:                  Time grid of trajectories
+load:                   Number of treatments at each grid point
+error_flag:             Array indicating for each patient whether no valid solution was found,
+                        such patients are returned without treatments
+"""
+def pv_heuristic_batch(Tf, N, x0, p_in, pv_lambda, Base, max_fraction, allowed_arr, capacity=None, repair_depth=5):
+
+    x0 = np.atleast_2d(np.asarray(x0, dtype=float))
+    p_in = np.atleast_2d(np.asarray(p_in, dtype=float))
+    K = x0.shape[0]
+    P = np.vstack([p_in[:, 0], p_in[:, 1],
+                   np.broadcast_to(pv_lambda, (K,)), np.broadcast_to(Base, (K,))]).astype(float)
+    max_fraction = np.broadcast_to(np.asarray(max_fraction, dtype=float), (K,))
+    x_up = 1.1 * P[3]
+    x_lo = 0.8 * P[3]
+    allowed = np.broadcast_to(np.asarray(allowed_arr) >= 1e-8, (K, N))
+    if capacity is None:
+        cap = np.full(N, np.inf)
+    else:
+        cap = np.broadcast_to(np.asarray(capacity, dtype=float), (N,))
+
+    dt = Tf / N
+    tgrid = [Tf / N * k for k in range(N + 1)]
+    F = rk4_array_integrator(model_array, dt, 1)
+
+    # states are stored as (time, state, patient) for contiguous access of all patients at one time
+    X = np.empty((N + 1, 3, K))
+    X[0] = x0.T
+    u = np.zeros((N, K), dtype=bool)
+    load = np.zeros(N)
+    active = np.ones(K, dtype=bool)
+    error_flag = np.zeros(K, dtype=int)
+
+    # recompute trajectory of patient i on [j_start, j_end + 1], return first upper violation
+    # and whether the lower constraint holds after all treatments until then
+    chunk = 64
+    F_acc = _step_accumulator(F, chunk)
+    def resimulate(i, j_start, j_end, stop=True):
+        args = np.empty((6, chunk))
+        args[1:5] = P[:, i:i + 1]
+        args[5] = max_fraction[i]
+        lower_ok = True
+        for j in range(j_start, j_end + 1, chunk):
+            m = min(chunk, j_end + 1 - j)
+            args[0] = 0.
+            args[0, :m] = u[j:j + m, i]
+            x = np.array(F_acc(X[j, :, i], args))[:, :m]
+            treated = u[j:j + m, i]
+            viol = np.flatnonzero(x[2] > x_up[i]) if stop else []
+            if len(viol) > 0:
+                m = viol[0] + 1
+                x = x[:, :m]
+                treated = treated[:m]
+            X[j + 1:j + m + 1, :, i] = x.T
+            lower_ok = lower_ok and np.all(x[2, treated] > x_lo[i])
+            if len(viol) > 0:
+                return j + m - 1, lower_ok
+        return None, lower_ok
+
+    # valid treatment times of patient i in [0, j] with free capacity
+    def valid_times(i, j):
+        return (allowed[i, :j + 1] & ~u[:j + 1, i] & (load[:j + 1] < cap[:j + 1]) &
+                (X[1:j + 2, 2, i] * (1 - max_fraction[i]) > x_lo[i]))
+
+    # set treatment of patient i at s (moved from s_old) and recompute the trajectory until k,
+    # the treatment is reverted if the lower constraint is violated afterwards or, if feasible
+    # is set, if the upper constraint is violated
+    def treat(i, s, k, s_old=None, feasible=False):
+        X_backup = np.copy(X[s + 1:k + 2, :, i])
+        u[s, i] = True
+        if s_old is not None:
+            u[s_old, i] = False
+        j_viol, lower_ok = resimulate(i, s, k)
+        if lower_ok and not (feasible and j_viol is not None):
+            load[s] += 1
+            if s_old is not None:
+                load[s_old] -= 1
+            return j_viol, True
+        u[s, i] = False
+        if s_old is not None:
+            u[s_old, i] = True
+        X[s + 1:k + 2, :, i] = X_backup
+        return None, False
+
+    # move a treatment of another patient from a full grid point to an earlier valid time,
+    # which keeps the other patient feasible
+    def repair(i, j, k, banned):
+        full = np.flatnonzero(allowed[i, :j + 1] & ~u[:j + 1, i] & ~banned[:j + 1] & (load[:j + 1] >= cap[:j + 1]) &
+                              (X[1:j + 2, 2, i] * (1 - max_fraction[i]) > x_lo[i]))
+        for s in full[::-1][:repair_depth]:
+            for q in np.flatnonzero(u[s] & active):
+                s_new = np.flatnonzero(valid_times(q, s - 1))
+                if len(s_new) > 0 and treat(q, s_new[-1], k, s_old=s, feasible=True)[1]:
+                    return s
+        return None
+
+    # Start integration in forward mode for all patients
+    for k in range(N):
+        x_next, _ = F(X[k], 0., 0., P)
+        x_next[2] *= np.where(u[k], 1 - max_fraction, 1.)
+        X[k + 1] = x_next
+
+        # BACKWARD MODE for each patient with violated upper constraint, most severe violation first
+        violated = np.flatnonzero(active & (X[k + 1, 2] > x_up))
+        for i in violated[np.argsort(-(X[k + 1, 2, violated] / x_up[violated]))]:
+            j = k
+            banned = np.zeros(N, dtype=bool)
+            while j is not None:
+                s = np.flatnonzero(valid_times(i, j) & ~banned[:j + 1])
+                if len(s) > 0:
+                    s = s[-1]
+                else:
+                    s = repair(i, j, k, banned)
+                if s is None:
+                    # Exceptional case: no valid treatment time is found, the treatments of the
+                    # patient are released for the others and the untreated trajectory is returned
+                    error_flag[i] = 1
+                    active[i] = False
+                    load[u[:, i]] -= 1
+                    u[:, i] = False
+                    resimulate(i, 0, k, stop=False)
+                    break
+                j_viol, lower_ok = treat(i, s, k)
+                if lower_ok:
+                    j = j_viol
+                else:
+                    # treatment would violate the lower constraint at a later treatment time
+                    banned[s] = True
+
+    x_opt = np.ascontiguousarray(X.transpose(2, 0, 1))
+    u_opt = u.T.astype(float)
+    q_opt = np.concatenate([np.zeros((K, 1)), np.cumsum(u_opt * dt, axis=1)], axis=1)
+    return x_opt, q_opt, u_opt, tgrid, load.astype(int), error_flag
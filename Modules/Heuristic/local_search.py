@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import time
+import numpy as np
+from Modules.Model.model_array import model_array
+from Modules.Integrator.integrator_rk4_array import rk4_array_integrator
+from Modules.Heuristic.heuristic_batch import _step_accumulator
+from Modules.Tools.schedule_result import ScheduleResult
+
+
+"""
+Trajectory of one schedule and margin of x3 to the range [0.8B, 1.1B] at each point of the time grid.
+The margin is checked from the fifth integration point on (as for the NLPs), earlier points have margin inf.
+
+Inputs:
+F_acc:          CasADi function integrating all steps, see _step_accumulator in Modules/Heuristic/heuristic_batch.py
+P:              Parameters [beta, gamma, pv_lambda, B]
+x0:             Initial value of x
+u_grid:         Control on the integration grid
+max_fraction:   Maximal fractional blood removal per treatment
+
+Outputs:
+X:              Trajectory with shape (N+1, 3)
+margin:         Distance of x3 to the bounds with shape (N+1,), negative for violations
+"""
+def _simulate(F_acc, P, x0, u_grid, max_fraction):
+    N = len(u_grid)
+    args = np.empty((6, N))
+    args[0] = u_grid
+    args[1:5] = P[:, None]
+    args[5] = max_fraction
+    X = np.vstack([np.asarray(x0, dtype=float)[None, :], np.array(F_acc(x0, args)).T])
+    margin = np.minimum(1.1 * P[3] - X[:, 2], X[:, 2] - 0.8 * P[3])
+    margin[:5] = np.inf
+    return X, margin
+
+
+"""
+Feasibility and margin of neighbors of a schedule. Each neighbor is only re-simulated from its first
+modified grid point on, starting in the state of the current trajectory. All neighbors are integrated
+at once, neighbors are added when their first modified point is reached and removed as soon as they
+leave the range of x3.
+
+Inputs:
+F:              Numpy integrator function
+P:              Parameters [beta, gamma, pv_lambda, B]
+X_base:         Trajectory of the current schedule with shape (N+1, 3)
+prefix_margin:  Minimal margin of the current trajectory up to each point with shape (N+1,)
+U:              Controls of the neighbors on the integration grid with shape (N, M)
+j0:             First modified grid point of each neighbor with shape (M,)
+max_fraction:   Maximal fractional blood removal per treatment
+
+Outputs:
+violation:      First grid point of each neighbor with x3 outside of the range, N+1 for feasible neighbors
+margin:         Minimal margin of x3 to the bounds of each feasible neighbor, -inf for the others
+"""
+def _evaluate_neighbors(F, P, X_base, prefix_margin, U, j0, max_fraction):
+    N, M = U.shape
+    x_up = 1.1 * P[3]
+    x_lo = 0.8 * P[3]
+    order = np.argsort(j0, kind='stable')
+    violation = np.full(M, N + 1)
+    cols = np.empty(0, dtype=int)
+    S = np.empty((3, 0))
+    m = np.empty(0)
+    pos = 0
+    for k in range(j0[order[0]], N):
+        # add neighbors modified at k with the state of the current trajectory
+        start = pos
+        while pos < M and j0[order[pos]] == k:
+            pos += 1
+        if pos > start:
+            cols = np.concatenate([cols, order[start:pos]])
+            S = np.concatenate([S, np.repeat(X_base[k][:, None], pos - start, axis=1)], axis=1)
+            m = np.concatenate([m, np.full(pos - start, prefix_margin[k])])
+        if len(cols) == 0:
+            if pos == M:
+                break
+            continue
+        S, _ = F(S, 0., 0., P)
+        S[2] *= 1 - U[k, cols] * max_fraction
+        if k >= 4:
+            np.minimum(m, np.minimum(x_up - S[2], S[2] - x_lo), out=m)
+            alive = m >= 0
+            if not np.all(alive):
+                violation[cols[~alive]] = k + 1
+                cols = cols[alive]
+                S = S[:, alive]
+                m = m[alive]
+    margin = np.full(M, -np.inf)
+    margin[cols] = m
+    return violation, margin
+
+
+"""
+Neighbors of a schedule given by the treatment times for the moves
+    'drop':     Remove one treatment
+    'merge':    Replace two consecutive treatments by one treatment at an allowed time between them
+    'shift':    Move one treatment by up to shift_range allowed times to a free allowed time
+    'shift_tail':   Move one treatment and all later treatments by the same number of allowed times
+    'add':      Add one treatment at a free allowed time
+
+Inputs:
+move:           Name of the move
+treat_idx:      Indices of the treatments in the allowed times
+num_allowed:    Number of allowed times
+shift_range:    Maximal shift in allowed times
+merge_slots:    Maximal number of tested times between two treatments for 'merge'
+
+Outputs:
+List of tuples (removed indices, added indices) in the allowed times
+"""
+def _moves(move, treat_idx, num_allowed, shift_range, merge_slots):
+    neighbors = []
+    if move == 'drop':
+        for a in treat_idx:
+            neighbors.append(([a], []))
+    elif move == 'merge':
+        for a, b in zip(treat_idx[:-1], treat_idx[1:]):
+            slots = np.arange(a + 1, b)
+            if len(slots) > merge_slots:
+                slots = slots[np.unique(np.linspace(0, len(slots) - 1, merge_slots).astype(int))]
+            for s in slots:
+                neighbors.append(([a, b], [s]))
+    elif move == 'shift':
+        occupied = set(treat_idx)
+        for a in treat_idx:
+            for s in range(max(a - shift_range, 0), min(a + shift_range, num_allowed - 1) + 1):
+                if s not in occupied:
+                    neighbors.append(([a], [s]))
+    elif move == 'shift_tail':
+        for pos in range(len(treat_idx)):
+            tail = list(treat_idx[pos:])
+            for d in range(-shift_range, shift_range + 1):
+                if d != 0 and 0 <= tail[0] + d and tail[-1] + d < num_allowed and (pos == 0 or treat_idx[pos - 1] < tail[0] + d):
+                    neighbors.append((tail, [a + d for a in tail]))
+    elif move == 'add':
+        occupied = set(treat_idx)
+        for s in range(num_allowed):
+            if s not in occupied:
+                neighbors.append(([], [s]))
+    return neighbors
+
+
+"""
+Evaluation of neighbors of a schedule in batches, see _evaluate_neighbors.
+
+Inputs:
+neighbors:      List of tuples (removed indices, added indices) in the allowed times
+u_grid:         Control of the current schedule on the integration grid
+allowed_idx:    Grid points of the allowed times
+cost_arr:       Cost of a treatment at each allowed time
+F, P, X, prefix_margin, max_fraction:   See _evaluate_neighbors
+
+Outputs:
+violation:      First grid point of each neighbor with x3 outside of the range, N+1 for feasible neighbors
+margin:         Minimal margin of x3 to the bounds of each feasible neighbor, -inf for the others
+cost_change:    Change of the cost by each neighbor
+"""
+def _evaluate_batch(neighbors, u_grid, allowed_idx, cost_arr, F, P, X, prefix_margin, max_fraction):
+    U = np.repeat(u_grid[:, None], len(neighbors), axis=1)
+    j0 = np.empty(len(neighbors), dtype=int)
+    cost_change = np.empty(len(neighbors))
+    for i, (removed, added) in enumerate(neighbors):
+        U[allowed_idx[removed], i] = 0
+        U[allowed_idx[added], i] = 1
+        j0[i] = allowed_idx[min(removed + added)]
+        cost_change[i] = np.sum(cost_arr[added]) - np.sum(cost_arr[removed])
+    violation, margin = _evaluate_neighbors(F, P, X, prefix_margin, U, j0, max_fraction)
+    return violation, margin, cost_change
+
+
+"""
+Local search for the improvement of an integer pv schedule, e.g. from sumup, the heuristic or BONMIN.
+An infeasible schedule (e.g. from sumup) is first repaired: treatments are added or shifted before the
+first violation of the bounds [0.8B, 1.1B] of x3, such that the first violation is later (with the lowest
+cost and then as late as possible).
+Starting from the feasible schedule, the moves 'drop', 'merge' and 'shift' (see _moves) are applied
+as long as they improve the schedule and the time budget is not exceeded. All neighbors of one move
+are evaluated in batches, where each neighbor is only re-simulated from its first modified time on,
+and the best feasible improving neighbor is accepted. After each accepted move the search restarts
+with the first move.
+
+A neighbor improves the schedule if its cost (number of treatments plus the sum of the slot costs of
+its treatments) is lower, where the neighbor with the largest minimal margin of x3 to the bounds is
+preferred. Shifts of equal cost improve the schedule if treatments are moved to later times, as in the
+heuristic (treatment at the latest valid time), which often allows further drops or merges.
+
+Inputs:
+Tf:                 End point of observed interval [0, Tf]
+u:                  0/1 schedule at the allowed times
+allowed_arr:        List or boolean array of allowed treatment integration points with length N
+x0:                 Initial value of x
+B:                  Steady state value of x3
+p_in:               Patient parameters [beta, gamma]
+pv_lambda:          Patient parameter pv_lambda
+max_fraction:       Maximal fractional blood removal per treatment
+dict_opts:          Dictionary with options
+    'time_budget':      Maximal computation time in seconds, default is 30
+    'moves':            List of applied moves, default is ['drop', 'merge', 'shift', 'shift_tail']
+    'shift_range':      Maximal shift of a treatment in allowed times, default is 12
+    'merge_slots':      Maximal number of tested times between two merged treatments, default is 8
+    'slot_cost':        Additional cost of a treatment at each allowed time, default is 0
+    'batch_size':       Number of neighbors evaluated at once, default is 256
+
+Outputs (ScheduleResult, see Modules/Tools/schedule_result.py):
+x:                  States of the improved schedule with shape (N+1, 3)
+q:                  Objective value (integral of the control) on the time grid
+u:                  Improved schedule at the allowed times
+tgrid:              Time grid of trajectories
+sol:                {}
+allowed_arr:        Boolean array of allowed times
+error_flag:         1 if the schedule could not be repaired, then the partly repaired schedule is returned
+"""
+def local_search(Tf, u, allowed_arr, x0, B, p_in, pv_lambda, max_fraction, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+    t_start = time.time()
+
+    # reading options from dict_opts
+    if 'time_budget' in dict_opts.keys():
+        time_budget = dict_opts['time_budget']
+    else:
+        time_budget = 30.
+    if 'moves' in dict_opts.keys():
+        moves = dict_opts['moves']
+    else:
+        moves = ['drop', 'merge', 'shift', 'shift_tail']
+    if 'shift_range' in dict_opts.keys():
+        shift_range = dict_opts['shift_range']
+    else:
+        shift_range = 12
+    if 'merge_slots' in dict_opts.keys():
+        merge_slots = dict_opts['merge_slots']
+    else:
+        merge_slots = 8
+    if 'batch_size' in dict_opts.keys():
+        batch_size = dict_opts['batch_size']
+    else:
+        batch_size = 256
+
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    allowed_idx = np.flatnonzero(allowed)
+    num_allowed = len(allowed_idx)
+    N = len(allowed)
+    dt = Tf / N
+    tgrid = [dt * k for k in range(N + 1)]
+    if 'slot_cost' in dict_opts.keys():
+        cost_arr = 1 + np.broadcast_to(np.asarray(dict_opts['slot_cost'], dtype=float), (num_allowed,))
+    else:
+        cost_arr = np.ones(num_allowed)
+
+    u = np.asarray(u, dtype=float)[:num_allowed] > 0.5
+    F = rk4_array_integrator(model_array, dt, 1)
+    F_acc = _step_accumulator(F, N)
+    P = np.array([p_in[0], p_in[1], pv_lambda, B], dtype=float)
+
+    u_grid = np.zeros(N)
+    u_grid[allowed_idx[u]] = 1
+    X, margin = _simulate(F_acc, P, x0, u_grid, max_fraction)
+    num_start = int(np.sum(u))
+    num_accepted = 0
+    out_of_time = False
+
+    # apply neighbor (removed, added) to the current schedule
+    def accept(neighbor):
+        removed, added = neighbor
+        u[removed] = False
+        u[added] = True
+        u_grid[allowed_idx[removed]] = 0
+        u_grid[allowed_idx[added]] = 1
+        return _simulate(F_acc, P, x0, u_grid, max_fraction)
+
+    # REPAIR: move the first violation as far as possible to the end by adding or shifting treatments
+    violation = np.argmax(margin < 0) if np.min(margin) < 0 else N + 1
+    while violation <= N:
+        if time.time() - t_start > time_budget:
+            out_of_time = True
+            break
+        prefix_margin = np.minimum.accumulate(margin)
+        treat_idx = np.flatnonzero(u)
+        last = np.searchsorted(allowed_idx, violation)
+        neighbors = [nb for nb in _moves('shift', treat_idx, num_allowed, shift_range, merge_slots) +
+                     _moves('shift_tail', treat_idx, num_allowed, shift_range, merge_slots) +
+                     _moves('add', treat_idx, num_allowed, shift_range, merge_slots) if nb[1][0] < last]
+        best = None
+        for b in range(0, len(neighbors), batch_size):
+            batch = neighbors[b:b + batch_size]
+            violation_new, _, cost_change = _evaluate_batch(batch, u_grid, allowed_idx, cost_arr,
+                                                            F, P, X, prefix_margin, max_fraction)
+            # lowest cost of the neighbors with later violation first, then latest violation
+            later = np.flatnonzero(violation_new > violation)
+            if len(later) == 0:
+                continue
+            i = later[np.lexsort((-violation_new[later], cost_change[later]))[0]]
+            if best is None or (cost_change[i], -violation_new[i]) < (best[1], -best[0]):
+                best = (violation_new[i], cost_change[i], batch[i])
+        if best is None:
+            break
+        X, margin = accept(best[2])
+        violation = best[0]
+        num_accepted += 1
+    if violation <= N:
+        print('Local search: schedule could not be repaired' + (' within the time budget' if out_of_time else '') +
+              ', x3 leaves the range at t =', tgrid[violation])
+        q = np.concatenate([[0.], np.cumsum(u_grid * dt)])
+        return ScheduleResult(X, q, u.astype(float), tgrid, {}, allowed, 1)
+    num_repaired = int(np.sum(u))
+
+    # IMPROVEMENT: apply the best improving neighbor of the first move with improving neighbors
+    improved = True
+    while improved and not out_of_time:
+        improved = False
+        prefix_margin = np.minimum.accumulate(margin)
+        treat_idx = np.flatnonzero(u)
+        for move in moves:
+            neighbors = _moves(move, treat_idx, num_allowed, shift_range, merge_slots)
+            best = None
+            for b in range(0, len(neighbors), batch_size):
+                if time.time() - t_start > time_budget:
+                    out_of_time = True
+                    break
+                batch = neighbors[b:b + batch_size]
+                violation_new, margin_new, cost_change = _evaluate_batch(batch, u_grid, allowed_idx, cost_arr,
+                                                                         F, P, X, prefix_margin, max_fraction)
+                feasible = violation_new > N
+                better = feasible & (cost_change < -1e-9)
+                # shifts of equal cost improve if the treatments are moved to later times, largest move first
+                score = -margin_new
+                if move in ['shift', 'shift_tail']:
+                    score = -np.array([np.sum(added) - np.sum(removed) for removed, added in batch], dtype=float)
+                    better |= feasible & (np.abs(cost_change) <= 1e-9) & (score < 0)
+                for i in np.flatnonzero(better):
+                    if best is None or (cost_change[i], score[i]) < best[:2]:
+                        best = (cost_change[i], score[i], batch[i])
+            if best is not None:
+                X, margin = accept(best[2])
+                num_accepted += 1
+                improved = True
+                break
+            if out_of_time:
+                break
+
+    # the last batch may have exceeded the time budget
+    t_search = time.time() - t_start
+    out_of_time = out_of_time or t_search > time_budget
+    message = 'Local search: treatments ' + str(num_start) + ' -> ' + str(int(np.sum(u)))
+    if num_repaired != num_start:
+        message += ' (after repair: ' + str(num_repaired) + ')'
+    message += ' with ' + str(num_accepted) + ' accepted moves in ' + str(round(t_search, 2)) + ' s'
+    if out_of_time:
+        message += ' (time budget exceeded)'
+    print(message)
+    q = np.concatenate([[0.], np.cumsum(u_grid * dt)])
+    return ScheduleResult(X, q, u.astype(float), tgrid, {}, allowed, 0)
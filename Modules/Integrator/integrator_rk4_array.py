@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+"""
+Generates a numpy function for integration of the dynamic model using the Runge-Kutta method of order 4.
+Same scheme as rk4_integrator, but evaluated on numpy arrays, so that many trajectories
+(patients, parameter samples or schedules) are integrated at once.
+
+Inputs: 
+    f:              Numpy function for the ode rhs; function inputs are (X, U, P),
+                    where X is state array, U is control and P is parameter array, see Modules/Model/model_array.py
+    dt:             Length of the control interval
+    M:              Number of integrator steps per control interval
+    
+Outputs: 
+    RK_func:        Integrator function RK_func(x0, q0, u, p) returning the state and
+                    objective at the end of the control interval (only the last of the M steps)
+"""
+def rk4_array_integrator(f, dt, M):
+
+    dt_m = dt/M     # integration step size
+
+    def RK_func(x0, q0, u, p):
+        X = x0
+        Q = q0
+        # RK4 integration scheme
+        for k in range(M):
+            k1, l1 = f(X, u, p)
+            k2, l2 = f(X + dt_m/2 * k1, u, p)
+            k3, l3 = f(X + dt_m/2 * k2, u, p)
+            k4, l4 = f(X + dt_m * k3, u, p)
+
+            # update solution
+            X = X + dt_m / 6 * (k1 + 2*k2 + 2*k3 + k4)
+            Q = Q + dt_m / 6 * (l1 + 2*l2 + 2*l3 + l4)
+        return X, Q
+
+    return RK_func
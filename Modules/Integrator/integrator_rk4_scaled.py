@@ -22,7 +22,6 @@
 
 
 import numpy as np
-import matplotlib.pyplot as plt
 import casadi as ca
 
 """
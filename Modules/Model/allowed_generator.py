@@ -22,6 +22,8 @@
 
 
 
+import numpy as np
+
 """
 Generation of an array of allowed times for each integration point using options
 'allowed_hours', 'allowed_days', 'forbidden_days' in 'dict_opts'
@@ -31,57 +33,43 @@ Nperday:        Number of steps per day
 dict_opts:      Dictionary options given to pv_schedule
 N:              Length of integration grid
 dt:             Integration stepsize
+return_indices: Option to return the indices of allowed grid points additionally
 
 Output:
-allowed_arr:    List with 0-1 entries for each grid point indicating whether a treatment is allowed or not
+allowed_arr:    Boolean numpy array indicating for each grid point whether a treatment is allowed or not
+Additional Output for return_indices == True:
+allowed_idx:    Indices of the allowed grid points
 """
-def allowed_generator(Nperday, dict_opts, N, dt):
+def allowed_generator(Nperday, dict_opts, N, dt, return_indices=False):
     
     if 'allowed_hours' in dict_opts.keys():
-        allowed_hours = dict_opts['allowed_hours']
+        allowed_hours = np.asarray(dict_opts['allowed_hours']) > 0
     else:
-        allowed_hours = [1]*Nperday
+        allowed_hours = np.ones(Nperday, dtype=bool)
         
     if 'allowed_days' in dict_opts.keys():
-        allowed_days = dict_opts['allowed_days']
+        allowed_days = np.asarray(dict_opts['allowed_days']) > 0
     else:
-        allowed_days = [1]*7
-    
+        allowed_days = np.ones(7, dtype=bool)
+
+    # day of each grid point, computed by integer arithmetic to avoid drift of the time
+    num_days = -(-N // Nperday)
+
+    # Forbidden days as boolean array over all days
+    day_allowed = np.tile(allowed_days, -(-num_days // 7))[:num_days]
     if 'forbidden_days' in dict_opts.keys():
-        tmp = dict_opts['forbidden_days']
-        forbidden_days = []
-        
-        for t in tmp:
-            if type(t) == int:
-                forbidden_days.append(t)
-            elif type(t) == range:
-                for i in t:
-                    forbidden_days.append(i)
-    else: 
-        forbidden_days = []   
+        for t in dict_opts['forbidden_days']:
+            if type(t) == range:
+                if t.step > 0:
+                    t = range(max(t.start, 0), min(t.stop, num_days), t.step)
+                day_allowed[t.start:t.stop:t.step] = False
+            elif 0 <= t < num_days:
+                day_allowed[t] = False
         
     # Weave all dictionary options together 
-    hour_idx = 0
-    day_idx = 0
-    current_time = 0  
-
-    allowed_arr = []
-    for k in range(N):
-        # evaluate current time step
-        allowed = allowed_hours[hour_idx] > 0 and allowed_days[day_idx] > 0 and int(current_time) not in forbidden_days
-        if allowed:
-            allowed_arr.append(1)
-        else:
-            allowed_arr.append(0)    
-    
-        # update indices
-        hour_idx +=1
-        if hour_idx == Nperday:
-            hour_idx = 0
-            day_idx +=1
-            if day_idx == 7:
-                day_idx = 0
-        current_time += dt
-        
-    return allowed_arr
+    allowed_arr = np.tile(allowed_hours, num_days)[:N] & np.repeat(day_allowed, Nperday)[:N]
 
+    if return_indices:
+        return allowed_arr, np.flatnonzero(allowed_arr)
+    else:
+        return allowed_arr
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+
+"""
+Right hand side of the dynamic pv model for numpy arrays. Same model as in model_integrator,
+but all patient parameters are inputs, so that many patients or parameter sets can be
+evaluated at once by broadcasting.
+
+Inputs:
+x:      State array with shape (3, ...)
+u:      Control, scalar or array broadcastable to x[0]
+p:      Parameter array with shape (4, ...) containing [beta, gamma, pv_lambda, B]
+
+Outputs:
+x_dot:  Time derivative of x with shape of x
+q_dot:  Time derivative of the objective (integral of the control)
+"""
+def model_array(x, u, p):
+    k1 = 1./8
+    k2 = 1./6  
+    alpha = 1./120    
+    beta, gamma, pv_lambda, B = p[0], p[1], p[2], p[3]
+
+    X0_const = alpha * B
+    gamma_pv = beta * 0.1
+
+    x_dot = np.array([beta * (X0_const - k1 * x[0]) +
+                      gamma * (1 - pv_lambda) * (1 - x[2]/B) * x[0] +
+                      pv_lambda * gamma_pv * x[0],
+                      beta * (k1 * x[0] - k2 * x[1]),
+                      beta * (k2 * x[1] - alpha * x[2])])
+    q_dot = u + 0. * x[0]
+    return x_dot, q_dot
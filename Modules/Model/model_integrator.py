@@ -24,6 +24,7 @@ from Modules.Integrator.integrator_rk4 import rk4_integrator
 from Modules.Integrator.integrator_rk4_scaled import rk4_scaled_integrator
 
 import casadi as ca
+from functools import lru_cache
 
 """
 Generation of casadi integrator function for use with the dynamic pv model. 
@@ -45,7 +46,9 @@ integrator_function:    Integrator function for the dynamic model
 Additional Output for two_stage == True:
 integrator_function_2:  Additional integrator function for the two_stage process
 
+The functions are cached for repeated calls with the same arguments (e.g. several methods for one patient).
 """
+@lru_cache(maxsize=32)
 def model_integrator(N, dt, Tf, Nperday, B, max_fraction, pv_lambda, two_stage=False):
     k1 = 1./8
     k2 = 1./6  
@@ -89,3 +92,41 @@ def model_integrator(N, dt, Tf, Nperday, B, max_fraction, pv_lambda, two_stage=F
 
 
 
+
+
+"""
+Generation of casadi integrator function for the dynamic pv model, where all patient parameters are
+inputs of the function instead of constants. One function can be used for all patients, e.g. in
+NLPs with patient parameters as NLP parameters.
+
+Inputs:
+dt:             Step size on the integration grid
+
+Output:
+integrator_function:    Integrator function for the dynamic model with parameter input
+                        p = [beta, gamma, pv_lambda, B]
+"""
+@lru_cache(maxsize=32)
+def model_integrator_parametric(dt):
+    k1 = 1./8
+    k2 = 1./6  
+    alpha = 1./120    
+    p = ca.SX.sym('p', 4)  
+    x = ca.SX.sym('x', 3)
+    u = ca.SX.sym('u', 1)
+    beta, gamma, pv_lambda, B = p[0], p[1], p[2], p[3]
+
+    # Dynamic model
+    X0_const = alpha * B
+    gamma_pv = beta * 0.1
+    
+    # Model equations
+    ode_rhs = ca.vertcat(beta * (X0_const - k1 * x[0]) +
+               gamma * (1 - pv_lambda) * (1 - x[2]/B) * x[0] +
+               pv_lambda * gamma_pv * x[0],
+               beta * (k1 * x[0] - k2 * x[1]),
+               beta * (k2 * x[1] - alpha * x[2]))
+    
+    # Casadi function for integration
+    f = ca.Function('f', [x, u, p], [ode_rhs, u])
+    return rk4_integrator(f, dt, 1, 4, 3)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+
+"""
+Trajectories of the casadi NLP solution taken directly from the multiple shooting variables of the
+solution vector built by nlp_builder, without integration. The solution vector consists of
+X_0, ..., X_N (states after the treatment jumps), for the integer end point method X_N+1, ..., X_N+20
+and Tf_inv, and finally the controls at the allowed times.
+The objective is the integral of the control, which is the cumulative sum of u*dt.
+
+Inputs:
+sol:                    Casadi 'sol' object
+allowed_arr:            List or boolean array of length N indicating integration points in which a treatment is allowed
+N:                      Number of grid points
+dt:                     Integration stepsize
+Tf:                     End time of observed time horizon [0, Tf]
+two_stage:              True if the NLP contains the second stage of the integer end point method
+
+Outputs:
+x1_opt:                 Optimal trajectory of x1
+x2_opt:                 Optimal trajectory of x2
+x3_opt:                 Optimal trajectory of x3
+q_opt:                  Objective value of optimal solution
+u_opt:                  Optimal control function for allowed time points
+tgrid:                  Time grid of trajectories for ploting
+
+The trajectories x1_opt, x2_opt and x3_opt are views of the columns of one array with shape (number of points, 3).
+"""
+def extract_nlp_sol(sol, allowed_arr, N, dt, Tf, two_stage=False):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    num_controls = int(np.sum(allowed))
+    num_two_stage = 20 if two_stage else 0
+    num_points = N + 1 + num_two_stage
+
+    w_opt = sol['x'].full().ravel()
+    x_opt = w_opt[:3 * num_points].reshape(num_points, 3)
+    u_opt = w_opt[len(w_opt) - num_controls:]
+
+    u_grid = np.zeros(N)
+    u_grid[allowed] = u_opt
+    q_opt = np.empty(num_points)
+    q_opt[0] = 0.
+    q_opt[1:N + 1] = np.cumsum(u_grid * dt)
+    # no treatments in the second stage
+    q_opt[N + 1:] = q_opt[N]
+
+    tgrid = np.empty(num_points)
+    tgrid[:N + 1] = Tf / N * np.arange(N + 1)
+    if two_stage:
+        scale = w_opt[3 * num_points]
+        dt_two_stage = 1. / 20
+        tgrid[N + 1:] = tgrid[N] + dt_two_stage / scale * np.arange(1, num_two_stage + 1)
+
+    return x_opt[:, 0], x_opt[:, 1], x_opt[:, 2], q_opt, u_opt, tgrid
@@ -21,7 +21,31 @@
 """
 
 import numpy as np
-from Modules.Tools.plot_tools import state_separator
+import casadi as ca
+
+"""
+Casadi function integrating N steps of the integrator function including the treatment jumps,
+so that a whole trajectory is obtained by a single call.
+
+Inputs:
+integrator_function:    Casadi Integrator function for NLP
+max_fraction:           Maximal fractional blood loss
+N:                      Number of integration steps
+
+Output:
+Function ([x0; q0], [u; p]) -> [x; q] after each of the N steps with shape (4, N), where u has length N
+and p is repeated over all steps
+"""
+def grid_integrator(integrator_function, max_fraction, N):
+    xq = ca.MX.sym('xq', 4)
+    up = ca.MX.sym('up', 3)
+    i_out = integrator_function(x0=xq[0:3], q0=xq[3], u=up[0], p=up[1:3])
+    x_next = i_out['xf'][3:6]
+    # include jump if control > 0
+    x_next = ca.vertcat(x_next[0:2], x_next[2] * (1 - up[0] * max_fraction))
+    step = ca.Function('step', [xq, up], [ca.vertcat(x_next, i_out['li'][1])])
+    return step.mapaccum(N)
+
 
 """
 Integration of the casadi NLP solution using the casadi 'sol' object. This function also can be used for a 
@@ -30,7 +54,7 @@ control u directly, if the according option is used.
 Inputs: 
 sol:                    Casadi 'sol' object, or list with control values u, if 'sol_is_u' is True
 x0:                     Initial values of the dynamical system
-allowed_arr:            Array of length N indication integration points in which a treatment is allowed
+allowed_arr:            List or boolean array of length N indicating integration points in which a treatment is allowed
 N:                      Number of grid points
 dt:                     Integration stepsize
 Nperday:                Number of integration points per day
@@ -51,66 +75,48 @@ q_opt:                  Objective value of optimal solution
 u_opt:                  Optimal control function for allowed time points
 tgrid:                  Time grid of trajectories for ploting
 
+The trajectories x1_opt, x2_opt and x3_opt are views of the columns of one array with shape (number of points, 3).
 """
 
 def integrate_nlp_sol(sol, x0, allowed_arr, N, dt, Nperday, Tf, integrator_function, integrator_function_2, max_fraction, p_in, sol_is_u=False):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    num_controls = int(np.sum(allowed))
     # check whether sol is the casadi solution object or the control directly
     if sol_is_u:
         u_opt = sol
     else:
         w1_opt = sol['x']
-        num_controls = np.sum(allowed_arr)
         w1_opt = w1_opt.full().flatten()
         u_opt = w1_opt[-num_controls:]
-    
-    tgrid = [Tf/N*k for k in range(N+1)]
+
+    # control on the integration grid, the last control value is repeated if u_opt is too short
+    u_grid = np.zeros(N)
+    u_vals = np.array([float(v) for v in u_opt])
+    u_grid[allowed] = u_vals[np.minimum(np.arange(num_controls), len(u_vals) - 1)]
+
+    num_two_stage = 20 if integrator_function_2 is not None else 0
+    x_opt = np.empty((N + 1 + num_two_stage, 3))
+    q_opt = np.empty(N + 1 + num_two_stage)
+    tgrid = np.empty(N + 1 + num_two_stage)
+    x_opt[0] = np.asarray(x0, dtype=float).ravel()
+    q_opt[0] = 0.
+    tgrid[:N + 1] = Tf / N * np.arange(N + 1)
 
     # integrate solution to obtain trajectories
-    x_opt = [x0]
-    q_opt = [0]
-    u_idx = 0
-
-    hour_idx = 0
-    day_idx = 0
-    current_time = 0
-
-    for k in range(N):
-        allowed = allowed_arr[k]
-
-        if allowed>=1e-8:
-            i_out = integrator_function(x0 = x_opt[-1], q0 = q_opt[-1], u = u_opt[u_idx], p=p_in)
-            # include jump if control > 0
-            i_out['xf'][5] = i_out['xf'][5]*(1 - u_opt[u_idx]*max_fraction)
-            if u_idx < len(u_opt) - 1:
-                u_idx+=1
-        else:
-            i_out = integrator_function(x0 = x_opt[-1], q0 = q_opt[-1], u = 0, p=p_in)
-
-        # update times
-        hour_idx +=1
-        if hour_idx == Nperday:
-            hour_idx = 0
-        day_idx +=1
-        if day_idx == 7:
-            day_idx = 0
-        current_time += dt
-
-        x_opt.append(i_out['xf'][3:6])
-        q_opt.append(i_out['li'][1])
-
-    
+    up = np.vstack([u_grid, np.repeat(np.reshape(np.asarray(p_in, dtype=float), (2, 1)), N, axis=1)])
+    xq = grid_integrator(integrator_function, max_fraction, N)(np.append(x_opt[0], 0.), up).full()
+    x_opt[1:N + 1] = xq[0:3].T
+    q_opt[1:N + 1] = xq[3]
+
     # integer end point extension if applicable
     if integrator_function_2 is not None:
         scale = w1_opt[-num_controls-1]
         dt_two_stage = 1./20
         retransformed_stepsize = dt_two_stage / scale
-        for k in range(20):
-            i_out = integrator_function_2(x0 = x_opt[-1], q0 = q_opt[-1], u = 0, p=p_in, scale = 1./scale)
-            x_opt.append(i_out['xf'][3:6])
-            q_opt.append(i_out['li'][1])    
-            tgrid.append(tgrid[-1] + retransformed_stepsize)   
-            
-    # separation of states in suitable format for plotting routine
-    x1_opt, x2_opt, x3_opt = state_separator(x_opt)   
-    return x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid
+        for k in range(N, N + num_two_stage):
+            i_out = integrator_function_2(x0 = x_opt[k], q0 = q_opt[k], u = 0, p=p_in, scale = 1./scale)
+            x_opt[k + 1] = i_out['xf'][3:6].full().ravel()
+            q_opt[k + 1] = float(i_out['li'][1])
+            tgrid[k + 1] = tgrid[k] + retransformed_stepsize
 
+    return x_opt[:, 0], x_opt[:, 1], x_opt[:, 2], q_opt, u_opt, tgrid
@@ -34,7 +34,7 @@ dt:                     Integration step size
 B:                      Steady state value of x3
 x0:                     Steady state value of x
 max_fraction:           Maximal fractional blood removal per treatment
-allowed_arr:            List of allowed treatment integration points
+allowed_arr:            List or boolean array of allowed treatment integration points
 integrator_function:    Casadi integrator function for NLP
 integrator_function_2:  Second integrator function for integer end point method, use 'None' if other method is used
 p_in:                   Patient parameter [beta, gamma]
@@ -62,7 +62,7 @@ def nlp_builder(N, Nperday, dt, B, x0, max_fraction, allowed_arr,
     lbu = 0
     ubu = 1
     lbx = [0, 0, 0]
-    ubx = [np.Infinity]*3
+    ubx = [np.inf]*3
     # ubx = [1000, 1000, 2000 ]    
    
     # get a feasible trajectory as initial guess
@@ -70,10 +70,13 @@ def nlp_builder(N, Nperday, dt, B, x0, max_fraction, allowed_arr,
     xk = ca.DM(x0)
     x_start = [xk]
     
+    # allowed grid points as list of bools for fast access in the loops below
+    allowed = (np.asarray(allowed_arr) >= 1e-8).tolist()
+
     # Integration for rest of x trajectory from given u_start
     u_idx = 0
     for k in range(N):
-        if allowed_arr[k]>=1e-8:
+        if allowed[k]:
             xk = integrator_function(x0=x_start[-1], q0 = 0, u = u_start[u_idx], p = p_in)
             u_idx+=1
         else:
@@ -120,7 +123,7 @@ def nlp_builder(N, Nperday, dt, B, x0, max_fraction, allowed_arr,
     
     # Integration
     for k in range(N):
-        if allowed_arr[k]>1e-8:
+        if allowed[k]:
             # New NLP variable for the control
             Uk = ca.MX.sym('U_' + str(k))
             w_u   += [Uk]
@@ -148,7 +151,7 @@ def nlp_builder(N, Nperday, dt, B, x0, max_fraction, allowed_arr,
         discrete += [False, False, False]
         
         # include jump if control > 0
-        if allowed_arr[k]>1e-8:  
+        if allowed[k]:  
             g   += [Xk_end[0]-Xk[0], Xk_end[1]-Xk[1], Xk_end[2]*(1 - Uk * max_fraction)-Xk[2]]
             lbg += [0, 0, 0]
             ubg += [0, 0, 0]        
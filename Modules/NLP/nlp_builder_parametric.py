@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+import casadi as ca
+from functools import lru_cache
+from Modules.Model.model_integrator import model_integrator_parametric
+
+
+"""
+Generation of the NLP of the relaxed problem (see nlp_builder) with the patient data as NLP parameters,
+so that one NLP solver can be used for all patients with the same grid and allowed treatment times.
+The order of the variables and constraints is the same as in nlp_builder. The initial value and the
+bounds on x3 enter only as bounds (see nlp_bounds_parametric).
+
+Inputs:
+N:                      Total number of integration points
+allowed_arr:            List or boolean array of allowed treatment integration points
+integrator_function:    Parametric casadi integrator function (see model_integrator_parametric)
+
+Outputs:
+Q:                      Cumulated objective function
+w:                      Optimization variables including x and u at certain time points
+g:                      Constraints g
+P:                      NLP parameters [beta, gamma, pv_lambda, B, max_fraction]
+"""
+def nlp_builder_parametric(N, allowed_arr, integrator_function):
+    allowed = (np.asarray(allowed_arr) >= 1e-8).tolist()
+    P = ca.MX.sym('P', 5)
+    p_model = P[0:4]
+    max_fraction = P[4]
+
+    w = []
+    w_u = []
+    g = []
+
+    X0 = ca.MX.sym('X0', 3)
+    w += [X0]
+    Q = 0
+    Xk = X0
+    for k in range(N):
+        if allowed[k]:
+            Uk = ca.MX.sym('U_' + str(k))
+            w_u += [Uk]
+            F_output = integrator_function(x0=Xk, q0=Q, u=Uk, p=p_model)
+        else:
+            F_output = integrator_function(x0=Xk, q0=Q, u=0, p=p_model)
+        Xk_end = F_output['xf'][3:6]
+        Q = F_output['li'][1]
+
+        # Multiple shooting
+        Xk = ca.MX.sym('X_' + str(k+1), 3)
+        w += [Xk]
+
+        # include jump if control > 0
+        if allowed[k]:
+            g += [Xk_end[0]-Xk[0], Xk_end[1]-Xk[1], Xk_end[2]*(1 - Uk * max_fraction)-Xk[2]]
+        else:
+            g += [Xk_end-Xk]
+
+        # constraints on x3 after a few integration steps
+        if k > 3:
+            g += [Xk[2]]
+
+    w = ca.vertcat(*(w + w_u))
+    g = ca.vertcat(*g)
+    return Q, w, g, P
+
+
+"""
+Bounds of the NLP of nlp_builder_parametric for one patient.
+
+Inputs:
+N:                      Total number of integration points
+allowed_arr:            List or boolean array of allowed treatment integration points
+x0:                     Initial value of x
+B:                      Steady state value of x3
+
+Outputs:
+lbw, ubw:               Lower and upper bound on w
+lbg, ubg:               Lower and upper bound of g
+"""
+def nlp_bounds_parametric(N, allowed_arr, x0, B):
+    num_controls = int(np.sum(np.asarray(allowed_arr) >= 1e-8))
+    lbw = np.concatenate([np.asarray(x0, dtype=float), np.zeros(3 * N), np.zeros(num_controls)])
+    ubw = np.concatenate([np.asarray(x0, dtype=float), np.full(3 * N, np.inf), np.ones(num_controls)])
+
+    # 3 shooting constraints per step and the constraint on x3 for k > 3
+    num_x3 = max(N - 4, 0)
+    lbg = np.zeros(3 * N + num_x3)
+    ubg = np.zeros(3 * N + num_x3)
+    idx_x3 = 3 * np.arange(5, N + 1) + np.arange(num_x3)
+    lbg[idx_x3] = 0.8 * B
+    ubg[idx_x3] = 1.1 * B
+    return lbw, ubw, lbg, ubg
+
+
+@lru_cache(maxsize=8)
+def _nlp_solver(N, dt, allowed_bytes, warm_start, max_iter=None):
+    allowed = np.unpackbits(np.frombuffer(allowed_bytes, dtype=np.uint8), count=N).astype(bool)
+    Q, w, g, P = nlp_builder_parametric(N, allowed, model_integrator_parametric(dt))
+    obj_factor = ca.MX.sym('obj_factor')
+    nlp_prob = {'f': obj_factor * Q, 'x': w, 'g': g, 'p': ca.vertcat(P, obj_factor)}
+    ipopt_opts = {'print_level': 0}
+    if warm_start:
+        # start from the given primal and dual point without pushing it into the interior
+        ipopt_opts.update({'warm_start_init_point': 'yes', 'mu_init': 1e-4,
+                           'warm_start_bound_push': 1e-9, 'warm_start_bound_frac': 1e-9,
+                           'warm_start_slack_bound_push': 1e-9, 'warm_start_slack_bound_frac': 1e-9,
+                           'warm_start_mult_bound_push': 1e-9})
+    if max_iter is not None:
+        ipopt_opts['max_iter'] = max_iter
+    # the solver is evaluated many times, expansion to SX makes each iteration several times faster
+    return ca.nlpsol('nlp_solver', 'ipopt', nlp_prob, {'ipopt': ipopt_opts, 'print_time': False, 'expand': True})
+
+
+"""
+IPOPT solver of the NLP of nlp_builder_parametric with objective obj_factor*Q. Solvers are cached
+for the last grids and allowed treatment times, so that the NLP is built only once for all patients
+and solves with the same calendar.
+
+Inputs:
+N:                      Total number of integration points
+dt:                     Integration step size
+allowed_arr:            List or boolean array of allowed treatment integration points
+warm_start:             Use IPOPT options for a warm start from given primal and dual values (lam_x0, lam_g0)
+max_iter:               Maximal number of IPOPT iterations, default is the IPOPT default
+
+Outputs:
+nlp_solver:             Casadi solver with parameter p = [beta, gamma, pv_lambda, B, max_fraction, obj_factor]
+"""
+def nlp_solver_parametric(N, dt, allowed_arr, warm_start=False, max_iter=None):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    return _nlp_solver(N, dt, np.packbits(allowed).tobytes(), warm_start, max_iter)
+
+
+@lru_cache(maxsize=8)
+def _nlp_forward(N, dt, allowed_bytes):
+    return _nlp_solver(N, dt, allowed_bytes, False).forward(1)
+
+
+"""
+Forward derivative of the solver of nlp_solver_parametric, which computes the directional derivative of the
+primal-dual solution from the nominal inputs and outputs by the KKT conditions without solving the NLP again.
+Cached as the solver.
+
+Inputs:
+N:                      Total number of integration points
+dt:                     Integration step size
+allowed_arr:            List or boolean array of allowed treatment integration points
+
+Outputs:
+Casadi function with the inputs of the solver, the nominal outputs (out_x, out_f, ...) and the seeds
+(fwd_p, ...), returning the derivatives (fwd_x, fwd_f, fwd_g, fwd_lam_x, fwd_lam_g, fwd_lam_p)
+"""
+def nlp_forward_parametric(N, dt, allowed_arr):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    return _nlp_forward(N, dt, np.packbits(allowed).tobytes())
+
+
+@lru_cache(maxsize=8)
+def _simulator(N, dt):
+    integrator_function = model_integrator_parametric(dt)
+    x = ca.MX.sym('x', 3)
+    up = ca.MX.sym('up', 6)
+    x_next = integrator_function(x0=x, q0=0, u=up[0], p=up[1:5])['xf'][3:6]
+    # include jump if control > 0
+    x_next = ca.vertcat(x_next[0:2], x_next[2] * (1 - up[0] * up[5]))
+    return ca.Function('step', [x, up], [x_next]).mapaccum(N)
+
+
+"""
+Initial guess for the NLP of nlp_builder_parametric by integration of a control from x0,
+which fulfills all multiple shooting constraints.
+
+Inputs:
+N:                      Total number of integration points
+dt:                     Integration step size
+allowed_arr:            List or boolean array of allowed treatment integration points
+x0:                     Initial value of x
+p_model:                Patient parameters [beta, gamma, pv_lambda, B]
+max_fraction:           Maximal fractional blood removal per treatment
+u_grid:                 Control on the integration grid, default is no treatment
+
+Outputs:
+w0:                     Initial guess for w
+"""
+def nlp_initial_guess(N, dt, allowed_arr, x0, p_model, max_fraction, u_grid=None):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    if u_grid is None:
+        u_grid = np.zeros(N)
+    args = np.empty((6, N))
+    args[0] = u_grid
+    args[1:5] = np.reshape(p_model, (4, 1))
+    args[5] = max_fraction
+    x_start = np.array(_simulator(N, dt)(x0, args))
+    return np.concatenate([np.asarray(x0, dtype=float), x_start.T.ravel(), np.asarray(u_grid, dtype=float)[allowed]])
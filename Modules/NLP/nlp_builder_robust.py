@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+import casadi as ca
+from Modules.Model.model_integrator import model_integrator_parametric
+from Modules.NLP.nlp_builder_parametric import nlp_initial_guess
+from Modules.Tools.parameter_estimation import p_lower, p_upper
+
+
+"""
+Generation of an NLP for schedules which are feasible for several parameter scenarios. The treatment controls
+are shared, each scenario has its own multiple shooting trajectory with the bounds on x3 of nlp_builder.
+The constraints of one scenario are generated by a function of its trajectory, the controls and its parameters,
+which is expanded to SX and evaluated for all scenarios by a parallel casadi map.
+
+The decision variables are X_0, ..., X_N of all scenarios (scenario by scenario) followed by the controls at
+the allowed times, so that for the first scenario the solution has the same format as for nlp_builder.
+
+Inputs:
+N:                      Total number of integration points
+dt:                     Integration step size
+B:                      Steady state value of x3
+x0:                     Initial value of x
+max_fraction:           Maximal fractional blood removal per treatment
+allowed_arr:            List or boolean array of allowed treatment integration points
+scenarios:              Parameters [beta, gamma, pv_lambda] of the scenarios with shape (S, 3)
+u_start:                Initialization of control values at allowed times
+num_threads:            Number of threads for the evaluation of the scenarios
+
+Outputs:
+Q:                      Cumulated objective function (integral of the control)
+w:                      Optimization variables
+w0:                     Initialization for w as list of parts (trajectories of the scenarios, controls)
+g:                      Constraints g
+lbw:                    Lower bound on w
+ubw:                    Upper bound on w
+lbg:                    Lower bound of g
+ubg:                    Upper bound of g
+"""
+def nlp_builder_robust(N, dt, B, x0, max_fraction, allowed_arr, scenarios, u_start, num_threads):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    allowed_idx = np.flatnonzero(allowed)
+    num_controls = len(allowed_idx)
+    scenarios = np.atleast_2d(np.asarray(scenarios, dtype=float))
+    S = scenarios.shape[0]
+    integrator_function = model_integrator_parametric(dt)
+
+    # one integration step including the jump by treatment
+    x = ca.MX.sym('x', 3)
+    up = ca.MX.sym('up', 5)
+    x_next = integrator_function(x0=x, q0=0, u=up[0], p=up[1:5])['xf'][3:6]
+    step = ca.Function('step', [x, up], [ca.vertcat(x_next[0:2], x_next[2] * (1 - up[0] * max_fraction))])
+
+    # multiple shooting constraints of one scenario
+    Xs = ca.MX.sym('Xs', 3, N + 1)
+    U = ca.MX.sym('U', N)
+    p = ca.MX.sym('p', 4)
+    X_end = step.map(N)(Xs[:, 0:N], ca.vertcat(U.T, ca.repmat(p, 1, N)))
+    g_s = ca.vec(X_end - Xs[:, 1:N + 1])
+    scenario = ca.Function('scenario', [Xs, U, p], [g_s]).expand()
+
+    # controls on the integration grid, 0 at forbidden times
+    w_u = ca.MX.sym('U', num_controls)
+    select = ca.DM(ca.Sparsity.triplet(N, num_controls, allowed_idx.tolist(), list(range(num_controls))),
+                   np.ones(num_controls))
+    U_grid = ca.mtimes(select, w_u)
+
+    X = ca.MX.sym('X', 3, S * (N + 1))
+    P = np.vstack([scenarios.T, np.full(S, B)])
+    g = ca.vec(scenario.map(S, 'thread', num_threads)(X, ca.repmat(U_grid, 1, S), P))
+    w = ca.vertcat(ca.vec(X), w_u)
+    Q = ca.sum1(w_u) * dt
+
+    # fixed initial value of each scenario, 0.8B <= x3 <= 1.1B after a few integration steps as in nlp_builder,
+    # here as bounds on the variables instead of constraints
+    lbw_s = np.concatenate([x0, np.zeros(3 * N)]).reshape(N + 1, 3)
+    ubw_s = np.concatenate([x0, np.full(3 * N, np.inf)]).reshape(N + 1, 3)
+    lbw_s[5:, 2] = 0.8 * B
+    ubw_s[5:, 2] = 1.1 * B
+    lbw = np.concatenate([np.tile(lbw_s.ravel(), S), np.zeros(num_controls)])
+    ubw = np.concatenate([np.tile(ubw_s.ravel(), S), np.ones(num_controls)])
+    lbg = np.zeros(3 * N * S)
+    ubg = np.zeros(3 * N * S)
+
+    # initialization by integration of u_start for each scenario
+    u_grid = np.zeros(N)
+    u_grid[allowed_idx] = np.asarray(u_start, dtype=float).ravel()
+    w0 = [nlp_initial_guess(N, dt, allowed, x0, list(s) + [B], max_fraction, u_grid)[:3 * (N + 1)]
+          for s in scenarios]
+    w0 += [u_grid[allowed_idx]]
+
+    return Q, w, w0, g, lbw, ubw, lbg, ubg
+
+
+"""
+Parameter scenarios for nlp_builder_robust: the nominal parameters followed by samples of a normal distribution
+(e.g. with the covariance of estimate_parameters), clipped to the parameter bounds of the estimation.
+
+Inputs:
+p_nominal:              Nominal parameters [beta, gamma, pv_lambda]
+p_cov:                  Covariance matrix of the parameters
+num_scenarios:          Total number of scenarios including the nominal one
+seed:                   Seed of the random samples
+
+Outputs:
+scenarios:              Parameters of the scenarios with shape (num_scenarios, 3)
+"""
+def robust_scenarios(p_nominal, p_cov, num_scenarios, seed=0):
+    rng = np.random.RandomState(seed)
+    samples = rng.multivariate_normal(np.asarray(p_nominal, dtype=float), np.asarray(p_cov, dtype=float),
+                                      num_scenarios - 1)
+    samples = np.clip(samples, p_lower, p_upper)
+    return np.vstack([p_nominal, samples])
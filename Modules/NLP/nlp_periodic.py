@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+import casadi as ca
+from Modules.NLP.extract_nlp_sol import extract_nlp_sol
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Model.model_integrator import model_integrator
+from Modules.Tools.schedule_result import ScheduleResult
+from Modules.Sumup.rounding import round_schedules
+
+
+"""
+Generation of the NLP of a periodic pv schedule over one cycle in casadi with multiple shooting structure
+as in nlp_builder. The initial state X_0 is free and the periodicity X_N = X_0 is a constraint. Since the
+schedule is repeated, x3 is constrained to [0.8B, 1.1B] at all points of the cycle.
+
+Inputs:
+N:                      Number of integration points of one cycle
+B:                      Steady state value of x3
+x0:                     Initial guess of the periodic state
+max_fraction:           Maximal fractional blood removal per treatment
+allowed_arr:            List or boolean array of allowed treatment integration points of one cycle
+integrator_function:    Casadi integrator function for NLP
+p_in:                   Patient parameter [beta, gamma]
+u_start:                Initialization of control values
+
+Outputs:
+Q:                      Cumulated objective function of one cycle
+w:                      Optimization variables X_0, ..., X_N and u at the allowed time points
+w0:                     Initialization for w
+g:                      Constraints g
+lbw:                    Lower bound on w
+ubw:                    Upper bound on w
+lbg:                    Lower bound of g
+ubg:                    Upper bound of g
+"""
+def nlp_builder_periodic(N, B, x0, max_fraction, allowed_arr, integrator_function, p_in, u_start):
+
+    # Bounds in u and x, x3 is bounded at all points
+    lbu = 0
+    ubu = 1
+    lbx = [0, 0, 0.8 * B]
+    ubx = [np.inf, np.inf, 1.1 * B]
+
+    # allowed grid points as list of bools for fast access in the loop below
+    allowed = (np.asarray(allowed_arr) >= 1e-8).tolist()
+
+    # initial guess of the states is constant
+    x_start = list(np.asarray(x0, dtype=float))
+    x_start[2] = min(max(x_start[2], 0.8 * B), 1.1 * B)
+
+    w = []
+    w0 = []
+    lbw = []
+    ubw = []
+    w_u = []
+    w0_u = []
+    lbw_u = []
+    ubw_u = []
+    g = []
+    lbg = []
+    ubg = []
+
+    # free initial state
+    X0 = ca.MX.sym('X0', 3)
+    w += [X0]
+    lbw += lbx
+    ubw += ubx
+    w0 += x_start
+
+    Q = 0
+    Xk = X0
+    u_idx = 0
+    for k in range(N):
+        if allowed[k]:
+            Uk = ca.MX.sym('U_' + str(k))
+            w_u += [Uk]
+            lbw_u += [lbu]
+            ubw_u += [ubu]
+            w0_u += [u_start[u_idx]]
+            u_idx += 1
+            F_output = integrator_function(x0=Xk, q0=Q, u=Uk, p=p_in)
+        else:
+            F_output = integrator_function(x0=Xk, q0=Q, u=0, p=p_in)
+        Xk_end = F_output['xf'][3:6]
+        Q = F_output['li'][1]
+
+        # Multiple shooting
+        Xk = ca.MX.sym('X_' + str(k + 1), 3)
+        w += [Xk]
+        lbw += lbx
+        ubw += ubx
+        w0 += x_start
+
+        # include jump if control > 0
+        if allowed[k]:
+            g += [Xk_end[0] - Xk[0], Xk_end[1] - Xk[1], Xk_end[2] * (1 - Uk * max_fraction) - Xk[2]]
+        else:
+            g += [Xk_end - Xk]
+        lbg += [0, 0, 0]
+        ubg += [0, 0, 0]
+
+    # periodicity
+    g += [Xk - X0]
+    lbg += [0, 0, 0]
+    ubg += [0, 0, 0]
+
+    # concatenate w_u with w
+    w += w_u
+    w0 += w0_u
+    lbw += lbw_u
+    ubw += ubw_u
+
+    w = ca.vertcat(*w)
+    g = ca.vertcat(*g)
+    w0 = [float(v) for v in w0]
+    return Q, w, w0, g, lbw, ubw, lbg, ubg
+
+
+"""
+Repetition of the solution of one cycle to the horizon [0, Tf] with N integration points
+
+Outputs:
+x_opt:          States with shape (N+1, 3)
+q_opt:          Cumulated objective
+u_opt:          Control at the allowed times
+allowed_arr:    Boolean array of allowed treatment integration points with length N
+"""
+def _repeat_cycle(sol, allowed_c, N_c, dt, days, N):
+    x1_c, x2_c, x3_c, q_c, u_c, _ = extract_nlp_sol(sol, allowed_c, N_c, dt, days)
+    x_c = np.column_stack([x1_c, x2_c, x3_c])
+    num_cycles = -(-N // N_c)
+    k = np.arange(N + 1)
+    x_opt = x_c[k % N_c]
+    q_opt = (k // N_c) * q_c[N_c] + q_c[k % N_c]
+    allowed_arr = np.tile(allowed_c, num_cycles)[:N]
+    u_opt = np.tile(u_c, num_cycles)[:int(np.sum(allowed_arr))]
+    return x_opt, q_opt, u_opt, allowed_arr
+
+
+"""
+Periodic pv schedule for maintenance therapy: The relaxed NLP minimizing the integral of the control
+is solved on one cycle with periodic states (see nlp_builder_periodic). The solution of the cycle
+is repeated to the horizon [0, Tf], so that the costs do not depend on Tf.
+
+The relaxed rate of treatments per day is the same for all cycle lengths in general (the relaxed control
+can spread the treatments evenly), so several cycle lengths are compared by their integer schedules:
+the repeated relaxed control of each cycle is rounded on [0, Tf] (see round_schedules) and the cycle with
+the fewest integer treatments is chosen (the shorter cycle for equal numbers). The output is the relaxed
+solution of the chosen cycle, its integer schedule is obtained by round_schedules of the output control.
+
+The trajectory starts on the periodic orbit and x0 is only the initial guess of the states. The allowed
+times of the cycle are generated from 'allowed_hours' and 'allowed_days', the cycle starts at the first day
+of the week. Cycle lengths which are no multiple of 7 days are skipped if not all days are allowed, as the
+repeated cycles would not match the week. 'forbidden_days' are not considered.
+
+Inputs:
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+x0:             Initial guess of the periodic state
+B:              Steady state value of x3
+pv_lambda:      Patient parameter pv_lambda
+p_in:           Patient parameters [beta, gamma]
+max_fraction:   Maximal fractional blood removal per treatment
+dict_opts:      Dictionary with options of pv_schedule, in addition
+    'cycle_days':   Length of the cycle in days or list of lengths which are compared, default is 28
+
+Outputs:
+ScheduleResult on [0, Tf] (see Modules/Tools/schedule_result.py), sol is the solution of the chosen cycle,
+error_flag is 1 if no cycle length was solved successfully
+"""
+def pv_periodic(Tf, Nperday, x0, B, pv_lambda, p_in, max_fraction, dict_opts):
+
+    # reading options from dict_opts
+    if 'cycle_days' in dict_opts.keys():
+        cycle_days = np.atleast_1d(dict_opts['cycle_days']).astype(int).tolist()
+    else:
+        cycle_days = [28]
+    if 'obj_factor' in dict_opts.keys():
+        obj_factor = dict_opts['obj_factor']
+    else:
+        obj_factor = 10
+    if 'forbidden_days' in dict_opts.keys() and dict_opts['forbidden_days']:
+        print('Periodic schedule: forbidden_days are not considered')
+    cycle_opts = {key: dict_opts[key] for key in ['allowed_hours', 'allowed_days'] if key in dict_opts.keys()}
+    weekly = 'allowed_days' in cycle_opts.keys() and not np.all(np.asarray(cycle_opts['allowed_days']) > 0)
+
+    N = int(Tf * Nperday)
+    dt = Tf / N
+
+    best = None
+    for days in cycle_days:
+        if weekly and days % 7 != 0:
+            print('Periodic schedule: cycle of', days, 'days skipped, as it is no multiple of a week')
+            continue
+        N_c = int(days * Nperday)
+        allowed_c = allowed_generator(Nperday, cycle_opts, N_c, dt)
+        integrator_function = model_integrator(N_c, dt, days, Nperday, B, max_fraction, pv_lambda)
+        u_start = [0.] * int(np.sum(allowed_c))
+        Q, w, w0, g, lbw, ubw, lbg, ubg = nlp_builder_periodic(N_c, B, x0, max_fraction, allowed_c,
+                                                               integrator_function, p_in, u_start)
+        nlp_prob = {'f': obj_factor * Q, 'x': w, 'g': g}
+        if len(cycle_days) > 1:
+            solver_opts = {'ipopt': {'print_level': 0}, 'print_time': False}
+        else:
+            solver_opts = {}
+        nlp_solver = ca.nlpsol('nlp_solver', 'ipopt', nlp_prob, solver_opts)
+        sol = nlp_solver(x0=w0, lbx=lbw, ubx=ubw, lbg=lbg, ubg=ubg)
+        success = nlp_solver.stats()['success']
+        if len(cycle_days) > 1 and not success:
+            print('Periodic schedule: cycle of', days, 'days failed')
+        elif len(cycle_days) > 1:
+            # number of integer treatments of the rounded schedule on [0, Tf], shorter cycles are preferred
+            x_opt, _, u_opt, allowed_arr = _repeat_cycle(sol, allowed_c, N_c, dt, days, N)
+            u_round, _, _, round_error = round_schedules(Tf, u_opt[None, :], allowed_arr, x_opt[0], B, p_in,
+                                                         pv_lambda, max_fraction)
+            count = np.sum(u_round[0]) if round_error[0] == 0 else np.inf
+            print('Periodic schedule: cycle of', days, 'days, treatments per year relaxed',
+                  round(365 * float(sol['f']) / obj_factor / dt / days, 4), 'rounded', round(365 * count / Tf, 4))
+            if best is None or count < best[0]:
+                best = (count, days, N_c, allowed_c, sol, nlp_solver.stats())
+        elif success:
+            best = (0, days, N_c, allowed_c, sol, nlp_solver.stats())
+
+    if best is None:
+        print('Periodic schedule: no cycle length solved successfully')
+        return ScheduleResult(np.tile(np.asarray(x0, dtype=float), (N + 1, 1)), np.zeros(N + 1), [],
+                              dt * np.arange(N + 1), {}, np.zeros(N, dtype=bool), 1)
+
+    # repeat the cycle to the horizon
+    _, days, N_c, allowed_c, sol, stats = best
+    x_opt, q_opt, u_opt, allowed_arr = _repeat_cycle(sol, allowed_c, N_c, dt, days, N)
+    return ScheduleResult(x_opt, q_opt, u_opt, dt * np.arange(N + 1), sol, allowed_arr, 0, stats)
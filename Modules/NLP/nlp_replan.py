@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from Modules.NLP.nlp_builder_parametric import nlp_solver_parametric, nlp_bounds_parametric, nlp_initial_guess
+from Modules.NLP.extract_nlp_sol import extract_nlp_sol
+from Modules.Tools.schedule_result import ScheduleResult
+
+
+"""
+Re-planning of a schedule from a state measured during the treatment (model predictive control).
+The NLP of the whole horizon of the previous result is used with the controls before the measurement and
+states fixed to the previous plan and the state at the measurement day fixed to the measured value. All
+constraints before the measurement day are released, so that the past states keep the previous plan
+(including the measurements of earlier re-plans) and only the remaining horizon is optimized. As in
+pv_schedule, the constraint on x3 holds from the fifth integration point after the measurement.
+
+Since the NLP has the same structure for all measurement days, the solver is built only once for each
+grid and calendar (see nlp_solver_parametric), and the previous solution is a warm start including its
+multipliers. The states after the measurement are initialized by integration of the previous controls
+from the measured state.
+
+Inputs:
+result:         ScheduleResult of pv_schedule ('relaxed_int_u' or 'heuristic') or of a previous pv_replan,
+                only results with multipliers ('relaxed_int_u') are used as a dual warm start
+day:            Day of the measurement, has to be a point of the integration grid
+x_meas:         Measured state at the measurement day
+B:              Steady state value of x3
+pv_lambda:      Patient parameter pv_lambda
+p_in:           Patient parameters [beta, gamma]
+patient_volume: Total blood volume of patient
+dict_opts:      Dictionary with options
+    'max_treatment_volume': Maximal volume of blood removal by one treatment, default is 500 ml
+    'obj_factor':           Factor multiplied to objective function, default is 10
+    'warm_start':           Use multipliers of result for the warm start, default is True
+
+Outputs:
+ScheduleResult on the whole horizon [0, Tf] of result, which equals the previous plan before the measurement,
+error_flag is 1 if the NLP solver failed
+"""
+def pv_replan(result, day, x_meas, B, pv_lambda, p_in, patient_volume, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+    allowed = result.allowed_arr
+    N = len(allowed)
+    Tf = result.tgrid[N]
+    dt = Tf / N
+    k0 = int(round(day / dt))
+    if abs(k0 * dt - day) > 1e-8 or k0 < 0 or k0 >= N:
+        raise ValueError('The measurement day has to be a point of the integration grid in [0, Tf)')
+
+    # maximal fractional blood removal, default treatment volume is 500 ml
+    if 'max_treatment_volume' in dict_opts.keys():
+        max_fraction = dict_opts['max_treatment_volume'] / patient_volume
+    else:
+        max_fraction = 500 / patient_volume
+    if 'obj_factor' in dict_opts.keys():
+        obj_factor = dict_opts['obj_factor']
+    else:
+        obj_factor = 10
+    p_model = [p_in[0], p_in[1], pv_lambda, B]
+
+    num_states = 3 * (N + 1)
+    num_past = int(np.count_nonzero(allowed[:k0]))
+    u_grid = result.u_grid
+
+    # previous plan before the measurement, integration of the previous controls from the measured state afterwards
+    w_rem = nlp_initial_guess(N - k0, dt, allowed[k0:], x_meas, p_model, max_fraction, u_grid[k0:])
+    w0 = np.concatenate([result.x[:k0].ravel(), w_rem[:3 * (N - k0 + 1)], result.u[:num_past],
+                         w_rem[3 * (N - k0 + 1):]])
+
+    # past states and controls are fixed to the previous plan, which includes the measurements of earlier
+    # re-plans, the state at the measurement day is fixed to the measured value
+    lbw, ubw, lbg, ubg = nlp_bounds_parametric(N, allowed, result.x[0], B)
+    lbw[:3 * k0] = result.x[:k0].ravel()
+    ubw[:3 * k0] = result.x[:k0].ravel()
+    lbw[3 * k0:3 * k0 + 3] = x_meas
+    ubw[3 * k0:3 * k0 + 3] = x_meas
+    lbw[num_states:num_states + num_past] = result.u[:num_past]
+    ubw[num_states:num_states + num_past] = result.u[:num_past]
+
+    # released constraints: all constraints of the steps before the measurement (the constraints of step k
+    # start at 3k + max(k-4, 0), the constraint on x3 is the fourth constraint of its step for k > 3) and
+    # x3 until 4 steps after the measurement
+    released = np.zeros(len(lbg), dtype=bool)
+    released[:3 * k0 + max(k0 - 4, 0)] = True
+    steps = np.arange(max(k0, 4), min(k0 + 4, N))
+    released[3 * (steps + 1) + steps - 4] = True
+    lbg[released] = -np.inf
+    ubg[released] = np.inf
+
+    warm_start = dict_opts['warm_start'] if 'warm_start' in dict_opts.keys() else True
+    warm_start = (warm_start and isinstance(result.sol, dict) and 'lam_g' in result.sol.keys() and
+                  result.sol['x'].numel() == len(w0))
+    solver = nlp_solver_parametric(N, dt, allowed, warm_start=warm_start)
+    args = {'x0': w0, 'p': p_model + [max_fraction, obj_factor], 'lbx': lbw, 'ubx': ubw, 'lbg': lbg, 'ubg': ubg}
+    if warm_start:
+        lam_g0 = result.sol['lam_g'].full().ravel()
+        lam_g0[released] = 0.
+        args.update({'lam_x0': result.sol['lam_x'], 'lam_g0': lam_g0})
+    sol = solver(**args)
+    error_flag = 0
+    if not solver.stats()['success']:
+        # e.g. the measured x3 is too high for the next allowed treatment times
+        print('Re-planning at day', day, 'failed:', solver.stats()['return_status'])
+        error_flag = 1
+
+    x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid = extract_nlp_sol(sol, allowed, N, dt, Tf)
+    return ScheduleResult(np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u_opt, tgrid, sol, allowed, error_flag)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from Modules.NLP.nlp_builder_parametric import (nlp_solver_parametric, nlp_forward_parametric, nlp_bounds_parametric,
+                                                nlp_initial_guess)
+from Modules.NLP.extract_nlp_sol import extract_nlp_sol
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Tools.schedule_result import ScheduleResult
+
+
+"""
+Active bounds of variables or constraints within a relative tolerance. Equality constraints are always active.
+
+Inputs:
+v:          Values
+lb, ub:     Lower and upper bounds
+tol:        Relative tolerance
+
+Outputs:
+at_lb:      Boolean array indicating values at the lower bound
+at_ub:      Boolean array indicating values at the upper bound (including equality constraints)
+"""
+def _active_bounds(v, lb, ub, tol):
+    at_lb = np.isfinite(lb) & (v - lb <= tol * np.maximum(1., np.abs(lb)))
+    at_ub = np.isfinite(ub) & (ub - v <= tol * np.maximum(1., np.abs(ub)))
+    return at_lb & (lb < ub), at_ub | (lb == ub)
+
+
+"""
+Tangential predictor of the solution of the NLP of nlp_solver_parametric for perturbed parameters. The
+directional derivative of the primal-dual solution is computed by the forward derivative of the solver
+(see nlp_forward_parametric), where the active set is given by the multipliers: The multipliers of the
+inactive bounds and constraints, which are small but non-zero in the IPOPT solution, are set to zero.
+The predictor is only valid if the active set does not change, i.e. if no inactive bound or constraint
+is violated and no multiplier of an active one changes its sign.
+
+Inputs:
+N:              Total number of integration points
+dt:             Integration step size
+allowed_arr:    List or boolean array of allowed treatment integration points
+args:           Dictionary with the inputs of the solver for the solution ('p', 'lbx', 'ubx', 'lbg', 'ubg')
+sol:            Solution of the solver
+p_new:          Perturbed parameters [beta, gamma, pv_lambda, B, max_fraction, obj_factor]
+active_tol:     Relative tolerance for active bounds and constraints
+
+Outputs:
+w_pred:             Predicted primal solution
+lam_x_pred:         Predicted multipliers of the bounds
+lam_g_pred:         Predicted multipliers of the constraints
+f_pred:             Predicted objective value
+active_set_changed: True if the active set changes for p_new
+"""
+def nlp_tangential_predictor(N, dt, allowed_arr, args, sol, p_new, active_tol=1e-6):
+    w = sol['x'].full().ravel()
+    g = sol['g'].full().ravel()
+    lbx, ubx = np.asarray(args['lbx'], dtype=float), np.asarray(args['ubx'], dtype=float)
+    lbg, ubg = np.asarray(args['lbg'], dtype=float), np.asarray(args['ubg'], dtype=float)
+    x_lb, x_ub = _active_bounds(w, lbx, ubx, active_tol)
+    g_lb, g_ub = _active_bounds(g, lbg, ubg, active_tol)
+    lam_x = np.where(x_lb | x_ub, sol['lam_x'].full().ravel(), 0.)
+    lam_g = np.where(g_lb | g_ub, sol['lam_g'].full().ravel(), 0.)
+
+    forward = nlp_forward_parametric(N, dt, allowed_arr)
+    d = forward(x0=w, p=args['p'], lbx=lbx, ubx=ubx, lbg=lbg, ubg=ubg, lam_x0=lam_x, lam_g0=lam_g,
+                out_x=w, out_f=sol['f'], out_g=g, out_lam_x=lam_x, out_lam_g=lam_g, out_lam_p=sol['lam_p'],
+                fwd_p=np.asarray(p_new, dtype=float) - np.asarray(args['p'], dtype=float))
+    w_pred = w + d['fwd_x'].full().ravel()
+    g_pred = g + d['fwd_g'].full().ravel()
+    lam_x_pred = lam_x + d['fwd_lam_x'].full().ravel()
+    lam_g_pred = lam_g + d['fwd_lam_g'].full().ravel()
+    f_pred = float(sol['f'] + d['fwd_f'])
+
+    # violated inactive bounds and constraints or active ones which are released (multiplier changes its sign,
+    # the multiplier is negative at lower and positive at upper bounds)
+    def changed(v, lb, ub, at_lb, at_ub, lam_pred):
+        tol = active_tol * np.maximum(1., np.abs(np.where(np.isfinite(lb), lb, 0.)))
+        inactive = ~(at_lb | at_ub)
+        violated = inactive & ((v < lb - tol) | (v > ub + tol))
+        released = (at_lb & (lam_pred > 0)) | (at_ub & (lb < ub) & (lam_pred < 0))
+        return np.any(violated | released)
+    active_set_changed = (changed(w_pred, lbx, ubx, x_lb, x_ub, lam_x_pred) or
+                          changed(g_pred, lbg, ubg, g_lb, g_ub, lam_g_pred))
+    return w_pred, lam_x_pred, lam_g_pred, f_pred, active_set_changed
+
+
+"""
+Continuation of the relaxed pv schedule (objective 'relaxed_int_u' of pv_schedule, solved with the NLP of
+nlp_builder_parametric) along a path of patient parameters, e.g. a sweep over beta or pv_lambda in small
+steps. The first point is solved by IPOPT. For each following point the solution is predicted from the
+previous one by the tangential predictor (see nlp_tangential_predictor) and corrected by a few IPOPT
+iterations started from the predicted primal-dual point. If the active set changes or the corrector does
+not converge, the NLP is solved by IPOPT with a warm start from the previous solution.
+
+Inputs:
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+x0:             Initial value of x
+B:              Steady state value of x3
+p_path:         Patient parameters [beta, gamma, pv_lambda] of the points of the path with shape (S, 3)
+patient_volume: Total blood volume of patient
+dict_opts:      Dictionary with options of pv_schedule ('allowed_hours', 'allowed_days', 'forbidden_days',
+                'max_treatment_volume', 'obj_factor'), in addition
+    'corrector_iter':   Maximal number of corrector iterations, default is 5
+    'active_tol':       Relative tolerance for active bounds and constraints, default is 1e-6
+
+Outputs:
+results:        List of ScheduleResult of the points of the path, error_flag is 1 if the NLP solver failed
+methods:        List with the method used for each point, 'solve', 'predictor-corrector' or 'warm start'
+"""
+def pv_sweep(Tf, Nperday, x0, B, p_path, patient_volume, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+
+    # reading options from dict_opts
+    if 'max_treatment_volume' in dict_opts.keys():
+        max_fraction = dict_opts['max_treatment_volume'] / patient_volume
+    else:
+        max_fraction = 500 / patient_volume
+    if 'obj_factor' in dict_opts.keys():
+        obj_factor = dict_opts['obj_factor']
+    else:
+        obj_factor = 10
+    if 'corrector_iter' in dict_opts.keys():
+        corrector_iter = dict_opts['corrector_iter']
+    else:
+        corrector_iter = 5
+    if 'active_tol' in dict_opts.keys():
+        active_tol = dict_opts['active_tol']
+    else:
+        active_tol = 1e-6
+
+    N = int(Tf * Nperday)
+    dt = Tf / N
+    allowed = allowed_generator(Nperday, dict_opts, N, dt)
+    p_path = np.atleast_2d(np.asarray(p_path, dtype=float))
+    lbw, ubw, lbg, ubg = nlp_bounds_parametric(N, allowed, x0, B)
+
+    solver = nlp_solver_parametric(N, dt, allowed)
+    warm_solver = nlp_solver_parametric(N, dt, allowed, warm_start=True)
+    corrector = nlp_solver_parametric(N, dt, allowed, warm_start=True, max_iter=corrector_iter)
+
+    results = []
+    methods = []
+    sol = None
+    args = None
+    for beta, gamma, pv_lambda in p_path:
+        p = [beta, gamma, pv_lambda, B, max_fraction, obj_factor]
+        args_new = {'p': p, 'lbx': lbw, 'ubx': ubw, 'lbg': lbg, 'ubg': ubg}
+        success = False
+        if sol is None:
+            w0 = nlp_initial_guess(N, dt, allowed, x0, p[:4], max_fraction)
+            sol_new = solver(x0=w0, **args_new)
+            success = solver.stats()['success']
+            method = 'solve'
+        else:
+            w_pred, lam_x_pred, lam_g_pred, _, active_set_changed = nlp_tangential_predictor(
+                N, dt, allowed, args, sol, p, active_tol)
+            if not active_set_changed:
+                sol_new = corrector(x0=np.clip(w_pred, lbw, ubw), lam_x0=lam_x_pred, lam_g0=lam_g_pred, **args_new)
+                success = corrector.stats()['success']
+                method = 'predictor-corrector'
+            if not success:
+                sol_new = warm_solver(x0=sol['x'], lam_x0=sol['lam_x'], lam_g0=sol['lam_g'], **args_new)
+                success = warm_solver.stats()['success']
+                method = 'warm start'
+        if not success:
+            print('Sweep: NLP solver failed for beta =', beta, 'gamma =', gamma, 'pv_lambda =', pv_lambda)
+        else:
+            # failed solutions are not used for the next points
+            sol = sol_new
+            args = args_new
+
+        x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid = extract_nlp_sol(sol_new, allowed, N, dt, Tf)
+        results.append(ScheduleResult(np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u_opt, tgrid, sol_new,
+                                      allowed, 0 if success else 1))
+        methods.append(method)
+    return results, methods
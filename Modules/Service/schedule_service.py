@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Model.model_integrator import model_integrator
+from Modules.NLP.nlp_builder_parametric import nlp_solver_parametric, nlp_bounds_parametric, nlp_initial_guess
+from Modules.NLP.extract_nlp_sol import extract_nlp_sol
+from Modules.NLP.integrate_nlp_sol import integrate_nlp_sol
+from Modules.Heuristic.heuristic_batch import pv_heuristic_batch
+from Modules.DynamicProg.dynamic_programming import dp_policy_pv
+from Modules.Tools.patient_parameters import return_parameters
+from Modules.Tools.result_cache import cache_key
+
+
+"""
+Patient data of a request, either given directly by 'patient': {'x0', 'B', 'pv_lambda', 'p_in', 'patient_volume'}
+or by 'patient': {'index', 'lambda_version'} (see Modules/Tools/patient_parameters.py)
+"""
+def _patient(request):
+    patient = request['patient']
+    if 'index' in patient.keys():
+        lambda_version = patient['lambda_version'] if 'lambda_version' in patient.keys() else None
+        gamma, beta, B, patient_volume, x0, pv_lambda = return_parameters(patient['index'], lambda_version)
+        return np.asarray(x0, dtype=float), B, pv_lambda, [beta, gamma], patient_volume
+    return (np.asarray(patient['x0'], dtype=float), patient['B'], patient['pv_lambda'], patient['p_in'],
+            patient['patient_volume'])
+
+
+"""
+Options of a request in format of pv_schedule, forbidden periods in JSON are given as [i, j] for range(i, j)
+"""
+def _dict_opts(request):
+    dict_opts = dict(request['dict_opts']) if 'dict_opts' in request.keys() else {}
+    if 'forbidden_days' in dict_opts.keys():
+        dict_opts['forbidden_days'] = [range(*d) if isinstance(d, list) else d for d in dict_opts['forbidden_days']]
+    return dict_opts
+
+
+def _allowed(request, Nperday, N, dt, dict_opts):
+    if 'allowed_arr' in request.keys():
+        return np.asarray(request['allowed_arr']) >= 1e-8
+    return allowed_generator(Nperday, dict_opts, N, dt)
+
+
+def _max_fraction(dict_opts, patient_volume):
+    if 'max_treatment_volume' in dict_opts.keys():
+        return dict_opts['max_treatment_volume'] / patient_volume
+    return 500. / patient_volume
+
+
+def _response(request, x, q, u_grid, tgrid, error_flag, t_start, **kwargs):
+    response = {'id': request['id'] if 'id' in request.keys() else None,
+                'x1': x[:, 0].tolist(), 'x2': x[:, 1].tolist(), 'x3': x[:, 2].tolist(),
+                'q': np.asarray(q, dtype=float).tolist(), 'u': np.asarray(u_grid, dtype=float).tolist(),
+                'tgrid': np.asarray(tgrid, dtype=float).tolist(), 'error_flag': int(error_flag),
+                'time': time.time() - t_start}
+    response.update(kwargs)
+    return response
+
+
+"""
+Scheduling service keeping integrators, parametric NLP solvers and DP policies in memory between requests.
+
+Requests are dictionaries with keys
+    'id':           Identifier returned with the response
+    'Tf':           End point of observed interval [0, Tf], default 365
+    'Nperday':      Number of integration points per day, default 6
+    'patient':      Patient data, see _patient
+    'dict_opts':    Options in format of pv_schedule ('objective', 'allowed_hours', 'allowed_days', 'forbidden_days',
+                    'max_treatment_volume', 'obj_factor'), where 'objective' is 'relaxed_int_u' (default),
+                    'heuristic' or 'dynamic_programming'
+    'allowed_arr':  Allowed treatment times on the integration grid (optional, replaces the calendar options)
+    'dp_options':   Options of dp_policy_pv for 'dynamic_programming'
+Responses contain the trajectories 'x1', 'x2', 'x3', 'q', the control 'u' on the integration grid, 'tgrid',
+'error_flag' and the computation 'time', or 'error' with a message if the request failed.
+
+The NLP solvers are built once for each grid and allowed times with the patient data as NLP parameters
+(see nlp_solver_parametric). Heuristic requests of one batch with the same grid are computed together
+by the batched heuristic (see Modules/Heuristic/heuristic_batch.py). Its schedules can differ from those of
+pv_schedule with 'heuristic' (pv_heuristic_alg): a treatment time is also rejected if the lower constraint
+is violated at a later treatment after the new one, which pv_heuristic_alg does not check.
+Requests which are no JSON objects are answered with 'id' None and 'error'.
+
+Inputs:
+max_policies:   Number of DP policies kept in memory
+"""
+class ScheduleService:
+
+    def __init__(self, max_policies=4):
+        self.max_policies = max_policies
+        self.policies = OrderedDict()
+
+    @staticmethod
+    def _lru_get(cache, key, build, max_size):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = build()
+        cache[key] = value
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+        return value
+
+    def handle_batch(self, requests):
+        responses = [None] * len(requests)
+        heuristic = {}
+        for i, request in enumerate(requests):
+            try:
+                if not isinstance(request, dict):
+                    raise TypeError('Request has to be a JSON object')
+                dict_opts = _dict_opts(request)
+                method = dict_opts['objective'] if 'objective' in dict_opts.keys() else 'relaxed_int_u'
+                if method == 'heuristic':
+                    grid = (request['Tf'] if 'Tf' in request.keys() else 365,
+                            request['Nperday'] if 'Nperday' in request.keys() else 6)
+                    heuristic.setdefault(grid, []).append(i)
+                elif method == 'relaxed_int_u':
+                    responses[i] = self.relaxed(request)
+                elif method == 'dynamic_programming':
+                    responses[i] = self.dynamic_programming(request)
+                else:
+                    raise ValueError('Unknown method ' + str(method))
+            except Exception as e:
+                responses[i] = {'id': request.get('id') if isinstance(request, dict) else None, 'error': repr(e)}
+
+        for (Tf, Nperday), idx in heuristic.items():
+            try:
+                for i, response in zip(idx, self.heuristic([requests[i] for i in idx], Tf, Nperday)):
+                    responses[i] = response
+            except Exception as e:
+                for i in idx:
+                    responses[i] = {'id': requests[i]['id'] if 'id' in requests[i].keys() else None, 'error': repr(e)}
+        return responses
+
+    def heuristic(self, requests, Tf, Nperday):
+        t_start = time.time()
+        N = int(Tf * Nperday)
+        dt = Tf / N
+        K = len(requests)
+        x0 = np.empty((K, 3))
+        p_in = np.empty((K, 2))
+        pv_lambda = np.empty(K)
+        B = np.empty(K)
+        max_fraction = np.empty(K)
+        allowed = np.empty((K, N), dtype=bool)
+        for k, request in enumerate(requests):
+            x0[k], B[k], pv_lambda[k], p_in[k], patient_volume = _patient(request)
+            dict_opts = _dict_opts(request)
+            max_fraction[k] = _max_fraction(dict_opts, patient_volume)
+            allowed[k] = _allowed(request, Nperday, N, dt, dict_opts)
+
+        x_opt, q_opt, u, tgrid, _, error_flag = pv_heuristic_batch(Tf, N, x0, p_in, pv_lambda, B, max_fraction, allowed)
+        return [_response(request, x_opt[k], q_opt[k], u[k], tgrid, error_flag[k], t_start, batch_size=K)
+                for k, request in enumerate(requests)]
+
+    def relaxed(self, request):
+        t_start = time.time()
+        Tf = request['Tf'] if 'Tf' in request.keys() else 365
+        Nperday = request['Nperday'] if 'Nperday' in request.keys() else 6
+        N = int(Tf * Nperday)
+        dt = Tf / N
+        x0, B, pv_lambda, p_in, patient_volume = _patient(request)
+        dict_opts = _dict_opts(request)
+        allowed = np.asarray(_allowed(request, Nperday, N, dt, dict_opts))
+        max_fraction = _max_fraction(dict_opts, patient_volume)
+        obj_factor = dict_opts['obj_factor'] if 'obj_factor' in dict_opts.keys() else 10
+
+        solver = nlp_solver_parametric(N, dt, allowed)
+        p_model = [p_in[0], p_in[1], pv_lambda, B]
+        w0 = nlp_initial_guess(N, dt, allowed, x0, p_model, max_fraction)
+        lbw, ubw, lbg, ubg = nlp_bounds_parametric(N, allowed, x0, B)
+        sol = solver(x0=w0, p=p_model + [max_fraction, obj_factor], lbx=lbw, ubx=ubw, lbg=lbg, ubg=ubg)
+
+        x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid = extract_nlp_sol(sol, allowed, N, dt, Tf)
+        u_grid = np.zeros(N)
+        u_grid[allowed] = u_opt
+        return _response(request, np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u_grid, tgrid, 0, t_start,
+                         f=float(sol['f']), success=solver.stats()['success'])
+
+    def dynamic_programming(self, request):
+        t_start = time.time()
+        Tf = request['Tf'] if 'Tf' in request.keys() else 365
+        Nperday = request['Nperday'] if 'Nperday' in request.keys() else 6
+        x0, B, pv_lambda, p_in, patient_volume = _patient(request)
+        dict_opts = _dict_opts(request)
+        max_fraction = _max_fraction(dict_opts, patient_volume)
+        dp_options = request['dp_options'] if 'dp_options' in request.keys() else {}
+
+        key = cache_key(Tf, Nperday, 0, B, pv_lambda, p_in, max_fraction, [dict_opts, dp_options])
+        policy = self._lru_get(self.policies, key,
+                               lambda: dp_policy_pv(Tf, Nperday, B, pv_lambda, p_in, dict_opts, max_fraction, dp_options),
+                               self.max_policies)
+        u_opt, _, cost = policy.rollout(x0)
+        u_grid = policy.grid_control(u_opt[0])
+        N = len(u_grid)
+        integrator_function = model_integrator(N, 1. / Nperday, Tf, Nperday, B, max_fraction, pv_lambda)
+        x1_opt, x2_opt, x3_opt, q_opt, _, tgrid = integrate_nlp_sol(u_grid, x0, [1] * N, N, 1. / Nperday, Nperday, Tf,
+                                                                    integrator_function, None, max_fraction, p_in,
+                                                                    sol_is_u=True)
+        return _response(request, np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u_grid, tgrid, 0, t_start,
+                         cost=float(cost[0]))
+
+
+"""
+JSON lines service: reads one request per line from stdin and writes one response per line to stdout.
+Requests arriving within batch_window seconds of each other are handled as one batch.
+All other output (e.g. of the solvers) is redirected to stderr, so stdout contains only responses.
+
+Inputs:
+service:        ScheduleService, default is a new one
+batch_window:   Waiting time for further requests of a batch in seconds
+max_batch:      Maximal number of requests of a batch
+"""
+def serve(service=None, batch_window=0.01, max_batch=256):
+    if service is None:
+        service = ScheduleService()
+
+    # responses use a copy of stdout, the original file descriptor is redirected to stderr
+    sys.stdout.flush()
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    lines = queue.Queue()
+
+    def reader():
+        for line in sys.stdin:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    finished = False
+    while not finished:
+        batch = [lines.get()]
+        while batch[-1] is not None and len(batch) < max_batch:
+            try:
+                batch.append(lines.get(timeout=batch_window))
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            finished = True
+            batch = batch[:-1]
+
+        requests = []
+        responses = []
+        for line in batch:
+            if not line.strip():
+                continue
+            try:
+                requests.append(json.loads(line))
+            except ValueError as e:
+                responses.append({'id': None, 'error': repr(e)})
+        responses += service.handle_batch(requests)
+        for response in responses:
+            out.write(json.dumps(response) + '\n')
+        out.flush()
@@ -0,0 +1,386 @@
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+
+
+import numpy as np
+from Modules.Model.model_array import model_array
+from Modules.Integrator.integrator_rk4_array import rk4_array_integrator
+from Modules.Heuristic.heuristic_batch import _step_accumulator
+
+
+"""
+Sum up rounding of many relaxed controls at once. The deviation w of the weighted relaxed control and the
+integer control is accumulated and a treatment is set if w exceeds the threshold. sumup in sumup_alg.py is
+the special case weight=1.5 and threshold=0. Optionally, no treatment is set within min_gap after the last
+treatment and after max_count treatments.
+
+Inputs:
+U:          Relaxed controls at the allowed times with shape (K, number of allowed times)
+weight:     Weight of the relaxed control
+threshold:  Treatment if the accumulated deviation exceeds threshold
+epsilon:    Minimal value of the relaxed control which is recognized as non-zero
+t_allowed:  Allowed times in days, only needed for min_gap > 0
+min_gap:    Minimal time between treatments in days
+max_count:  Maximal number of treatments, None for no limit
+
+Output:
+P:          Integer controls with shape (K, number of allowed times)
+"""
+def sur_rounding(U, weight=1., threshold=0.5, epsilon=1e-5, t_allowed=None, min_gap=0., max_count=None):
+    U = np.atleast_2d(np.asarray(U, dtype=float))
+    U = np.where(U > epsilon, weight * U, 0.)
+    if t_allowed is None:
+        t_allowed = np.zeros(U.shape[1])
+    if max_count is None:
+        max_count = np.inf
+    P = np.zeros(U.shape)
+    w = np.zeros(U.shape[0])
+    t_last = np.full(U.shape[0], -np.inf)
+    count = np.zeros(U.shape[0])
+    for k in range(U.shape[1]):
+        w += U[:, k]
+        P[:, k] = (w > threshold) & (t_allowed[k] - t_last >= min_gap - 1e-9) & (count < max_count)
+        w -= P[:, k]
+        t_last[P[:, k] > 0] = t_allowed[k]
+        count += P[:, k]
+    return P
+
+
+"""
+Next forced rounding of many relaxed controls at once. A treatment is set, if the relaxed control is 1
+or if the accumulated deviation of the weighted relaxed control including the next allowed time is at
+least 1, i.e. a treatment at the next allowed time would be forced otherwise. Optionally, no treatment is
+set within min_gap after the last treatment and after max_count treatments.
+
+Inputs:
+U:          Relaxed controls at the allowed times with shape (K, number of allowed times)
+weight:     Weight of the relaxed control
+epsilon:    Minimal value of the relaxed control which is recognized as non-zero
+t_allowed:  Allowed times in days, only needed for min_gap > 0
+min_gap:    Minimal time between treatments in days
+max_count:  Maximal number of treatments, None for no limit
+
+Output:
+P:          Integer controls with shape (K, number of allowed times)
+"""
+def nfr_rounding(U, weight=1., epsilon=1e-5, t_allowed=None, min_gap=0., max_count=None):
+    U = np.atleast_2d(np.asarray(U, dtype=float))
+    U = np.where(U > epsilon, weight * U, 0.)
+    if t_allowed is None:
+        t_allowed = np.zeros(U.shape[1])
+    if max_count is None:
+        max_count = np.inf
+    U_next = np.concatenate([U[:, 1:], np.zeros((U.shape[0], 1))], axis=1)
+    P = np.zeros(U.shape)
+    w = np.zeros(U.shape[0])
+    t_last = np.full(U.shape[0], -np.inf)
+    count = np.zeros(U.shape[0])
+    for k in range(U.shape[1]):
+        w += U[:, k]
+        P[:, k] = (((U[:, k] >= 1 - epsilon) | (w + U_next[:, k] >= 1 - epsilon)) &
+                   (t_allowed[k] - t_last >= min_gap - 1e-9) & (count < max_count))
+        w -= P[:, k]
+        t_last[P[:, k] > 0] = t_allowed[k]
+        count += P[:, k]
+    return P
+
+
+"""
+Searchsorted in each row of an array with non-decreasing rows, applied to all rows at once. The rows
+are shifted by offsets into disjoint ranges and concatenated, such that one searchsorted call suffices.
+
+Inputs:
+C_flat:     Concatenated shifted rows (C + offset[:, None]).ravel()
+offset:     Offset of each row with shape (K,)
+n:          Length of the rows
+values:     Searched value for each row with shape (K,), values + offset has to be in the range of the row
+side:       'left' or 'right', see numpy.searchsorted
+
+Output:
+Index of the value in each row with shape (K,)
+"""
+def _row_searchsorted(C_flat, offset, n, values, side):
+    return np.searchsorted(C_flat, values + offset, side=side) - n * np.arange(len(offset))
+
+
+"""
+Combinatorial integral approximation (CIA) of many relaxed controls at once: The maximal deviation
+max_k |sum_{j<=k} weight*u_j - p_j| of the accumulated relaxed and integer controls is minimized with a
+minimal time between treatments and a maximal number of treatments.
+
+For a fixed deviation theta the number of treatments is the smallest one with deviation theta at the last
+allowed time. Since the accumulated relaxed control is non-decreasing, the m-th treatment has to take place
+after the accumulated control reaches m-theta and before it exceeds m-1+theta. The earliest such times
+respecting the minimal gap are feasible iff any times are, which is checked for all controls at once.
+The minimal deviation is found by bisection.
+
+Inputs:
+U:          Relaxed controls at the allowed times with shape (K, number of allowed times)
+t_allowed:  Allowed times in days
+min_gap:    Minimal time between treatments in days
+max_count:  Maximal number of treatments, None for no limit
+weight:     Weight of the relaxed control
+tol:        Tolerance of the deviation in the bisection
+
+Outputs:
+P:          Integer controls with shape (K, number of allowed times)
+theta:      Maximal deviation of each control with shape (K,)
+"""
+def cia_rounding(U, t_allowed, min_gap=0., max_count=None, weight=1., tol=1e-3):
+    U = np.atleast_2d(np.asarray(U, dtype=float))
+    K, n = U.shape
+    t_allowed = np.asarray(t_allowed, dtype=float)
+    C = np.cumsum(weight * np.maximum(U, 0.), axis=1)
+    c_end = C[:, -1]
+    rows = np.arange(K)
+    # searched values m-theta and m-1+theta are in [-c_max-1, 2*c_max+2] for m <= c_end+1 and theta <= c_end+1
+    c_max = max(c_end.max(), 0.)
+    offset = (3 * c_max + 5) * rows + c_max + 1
+    C_flat = (C + offset[:, None]).ravel()
+    # index of the first allowed time after the minimal gap for each allowed time
+    next_idx = np.append(np.searchsorted(t_allowed, t_allowed + min_gap - 1e-9, side='left'), n)
+
+    # earliest treatment indices for deviation theta, feasibility of each control
+    def placement(theta):
+        M = np.maximum(np.ceil(c_end - theta - 1e-9), 0).astype(int)
+        feasible = np.ones(K, dtype=bool) if max_count is None else M <= max_count
+        S = np.full((K, max(M.max(), 0)), n)
+        s = np.full(K, -1)
+        for m in range(1, M.max() + 1):
+            active = M >= m
+            earliest = _row_searchsorted(C_flat, offset, n, m - theta, 'left')
+            latest = _row_searchsorted(C_flat, offset, n, m - 1 + theta, 'right')
+            s_next = np.where(s >= 0, next_idx[np.maximum(s, 0)], 0)
+            s = np.maximum(earliest, s_next)
+            feasible &= ~active | ((s <= latest) & (s < n))
+            S[:, m - 1] = np.where(active, s, n)
+            s = np.where(active, s, n)
+        return S, feasible
+
+    # without treatments the deviation is c_end, which is always feasible
+    lo = np.zeros(K)
+    hi = np.maximum(c_end, 0.) + tol
+    while np.any(hi - lo > tol):
+        mid = (lo + hi) / 2
+        _, feasible = placement(mid)
+        lo = np.where(feasible, lo, mid)
+        hi = np.where(feasible, mid, hi)
+    S, _ = placement(hi)
+
+    P = np.zeros((K, n + 1))
+    for m in range(S.shape[1]):
+        P[rows, S[:, m]] = 1
+    return P[:, :n], hi
+
+
+"""
+Forward simulation of many integer schedules at once with repair of violations of x3 in [0.8B, 1.1B]
+(checked from the fifth integration point on, as for the NLPs). If a schedule violates the upper bound,
+a treatment is added at the latest valid allowed time before, i.e. without treatment within min_gap of
+it and with x3 above the lower bound after the treatment. If a schedule violates the lower bound, its
+latest treatment before is removed and not used again. The trajectory of the repaired schedule is
+recomputed from the modified time on with the CasADi step accumulator, as in the heuristic
+(see Modules/Heuristic/heuristic_batch.py), while all other schedules wait at the end of the current chunk
+of integration steps.
+
+Inputs:
+F:              Numpy integrator function, see Modules/Integrator/integrator_rk4_array.py
+P:              Parameters [beta, gamma, pv_lambda, B]
+x0:             Initial value of x
+U:              Integer schedules on the integration grid with shape (N, K), modified in place
+allowed:        Boolean array of allowed integration points
+max_fraction:   Maximal fractional blood removal per treatment
+gap_steps:      Minimal number of integration steps between treatments
+repair_violations:  Repair the schedules, otherwise violations are only indicated by error_flag
+
+Outputs:
+X:              Trajectories with shape (N+1, 3, K)
+error_flag:     Array indicating for each schedule whether it could not be repaired
+num_repairs:    Number of added and removed treatments of each schedule
+"""
+def _repair_schedules(F, P, x0, U, allowed, max_fraction, gap_steps, repair_violations=True):
+    N, K = U.shape
+    x_up = 1.1 * P[3]
+    x_lo = 0.8 * P[3]
+    X = np.empty((N + 1, 3, K))
+    X[0] = np.asarray(x0, dtype=float)[:, None]
+    banned = np.zeros((N, K), dtype=bool)
+    error_flag = np.zeros(K, dtype=bool)
+    num_repairs = np.zeros(K, dtype=int)
+
+    # recompute trajectory of schedule i on [j_start, j_end + 1]
+    chunk = 64
+    F_acc = _step_accumulator(F, chunk)
+    args = np.empty((6, chunk))
+    args[1:5] = P[:, None]
+    args[5] = max_fraction
+    def resimulate(i, j_start, j_end):
+        for j in range(j_start, j_end + 1, chunk):
+            m = min(chunk, j_end + 1 - j)
+            args[0] = 0.
+            args[0, :m] = U[j:j + m, i]
+            X[j + 1:j + m + 1, :, i] = np.array(F_acc(X[j, :, i], args))[:, :m].T
+
+    # repair schedule i until it is feasible on [0, k + 1]
+    def repair(i, k):
+        while True:
+            x3 = X[5:k + 2, 2, i]
+            viol = np.flatnonzero((x3 > x_up) | (x3 < x_lo))
+            if len(viol) == 0:
+                return
+            j = viol[0] + 4
+            if x3[viol[0]] > x_up:
+                # number of treatments within the minimal gap of each time
+                cum = np.concatenate([[0], np.cumsum(U[:, i])])
+                s_idx = np.arange(j + 1)
+                near = cum[np.minimum(s_idx + gap_steps, N)] - cum[np.maximum(s_idx - gap_steps + 1, 0)]
+                s = np.flatnonzero(allowed[:j + 1] & ~banned[:j + 1, i] & (near == 0) &
+                                   (X[1:j + 2, 2, i] * (1 - max_fraction) > x_lo))
+                if len(s) == 0:
+                    error_flag[i] = True
+                    return
+                U[s[-1], i] = True
+            else:
+                s = np.flatnonzero(U[:j + 1, i])
+                if len(s) == 0:
+                    error_flag[i] = True
+                    return
+                U[s[-1], i] = False
+                banned[s[-1], i] = True
+            num_repairs[i] += 1
+            resimulate(i, s[-1], k)
+
+    # all schedules are simulated chunk by chunk, few schedules with the mapped CasADi step accumulator and
+    # many schedules with the numpy integrator, which has a large overhead per step but not per schedule
+    F_map = F_acc.map(K) if K < 100 else None
+    args_map = np.empty((6, K, chunk))
+    args_map[1:5] = P[:, None, None]
+    args_map[5] = max_fraction
+    for j in range(0, N, chunk):
+        m = min(chunk, N - j)
+        if F_map is not None:
+            args_map[0] = 0.
+            args_map[0, :, :m] = U[j:j + m].T
+            x = np.array(F_map(X[j], args_map.reshape(6, K * chunk))).reshape(3, K, chunk)
+            X[j + 1:j + m + 1] = x[:, :, :m].transpose(2, 0, 1)
+        else:
+            for k in range(j, j + m):
+                x, _ = F(X[k], 0., 0., P)
+                x[2] *= np.where(U[k], 1 - max_fraction, 1.)
+                X[k + 1] = x
+        x3 = X[max(j + 1, 5):j + m + 1, 2]
+        for i in np.flatnonzero(np.any((x3 > x_up) | (x3 < x_lo), axis=0) & ~error_flag):
+            if repair_violations:
+                repair(i, j + m - 1)
+            else:
+                error_flag[i] = True
+    return X, error_flag.astype(int), num_repairs
+
+
+"""
+Rounding of many relaxed pv schedules at once. For each relaxed control the integer controls of the chosen
+rounding methods are generated, simulated and repaired if they leave [0.8B, 1.1B] (see _repair_schedules).
+The feasible candidate with the fewest treatments is returned (the first method in case of equal numbers).
+
+Inputs:
+Tf:                 End point of observed interval [0, Tf]
+U:                  Relaxed controls at the allowed times with shape (K, number of allowed times)
+allowed_arr:        List or boolean array of allowed treatment integration points with length N
+x0:                 Initial value of x
+B:                  Steady state value of x3
+p_in:               Patient parameters [beta, gamma]
+pv_lambda:          Patient parameter pv_lambda
+max_fraction:       Maximal fractional blood removal per treatment
+dict_opts:          Dictionary with options
+    'methods':          List of rounding methods 'sur' (sum up rounding), 'nfr' (next forced rounding) and
+                        'cia' (combinatorial integral approximation), default is ['sur', 'nfr', 'cia']
+    'weight':           Weight of the relaxed control, default is 1
+    'min_gap':          Minimal time between treatments in days for the rounding and the repair, default is 0
+    'max_count':        Maximal number of treatments for the rounding, default is None (no limit)
+    'repair':           Repair candidates violating the bounds of x3, default is True
+
+Outputs:
+u_round:            Integer controls at the allowed times with shape (K, number of allowed times)
+method:             Name of the rounding method of each integer control
+num_repairs:        Number of treatments added or removed by the repair for each integer control
+error_flag:         Array indicating for each relaxed control whether no feasible integer control was found,
+                    then the candidate of the first method is returned
+"""
+def round_schedules(Tf, U, allowed_arr, x0, B, p_in, pv_lambda, max_fraction, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+
+    # reading options from dict_opts
+    if 'methods' in dict_opts.keys():
+        methods = dict_opts['methods']
+    else:
+        methods = ['sur', 'nfr', 'cia']
+    if 'weight' in dict_opts.keys():
+        weight = dict_opts['weight']
+    else:
+        weight = 1.
+    if 'min_gap' in dict_opts.keys():
+        min_gap = dict_opts['min_gap']
+    else:
+        min_gap = 0.
+    if 'max_count' in dict_opts.keys():
+        max_count = dict_opts['max_count']
+    else:
+        max_count = None
+    if 'repair' in dict_opts.keys():
+        repair = dict_opts['repair']
+    else:
+        repair = True
+
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    allowed_idx = np.flatnonzero(allowed)
+    N = len(allowed)
+    dt = Tf / N
+    U = np.atleast_2d(np.asarray(U, dtype=float))[:, :len(allowed_idx)]
+    K = U.shape[0]
+
+    candidates = []
+    for method in methods:
+        if method == 'sur':
+            candidates.append(sur_rounding(U, weight, t_allowed=allowed_idx * dt, min_gap=min_gap, max_count=max_count))
+        elif method == 'nfr':
+            candidates.append(nfr_rounding(U, weight, t_allowed=allowed_idx * dt, min_gap=min_gap, max_count=max_count))
+        elif method == 'cia':
+            candidates.append(cia_rounding(U, allowed_idx * dt, min_gap, max_count, weight)[0])
+        else:
+            raise ValueError('Unknown rounding method ' + str(method))
+
+    # simulation of all candidates at once, candidate j of method m is column m*K + j
+    U_grid = np.zeros((N, len(methods) * K), dtype=bool)
+    U_grid[allowed_idx] = np.concatenate(candidates).T > 0.5
+    F = rk4_array_integrator(model_array, dt, 1)
+    P = np.array([p_in[0], p_in[1], pv_lambda, B], dtype=float)
+    gap_steps = max(int(np.ceil(min_gap / dt - 1e-9)), 1)
+    _, error_flag, num_repairs = _repair_schedules(F, P, x0, U_grid, allowed, max_fraction, gap_steps, repair)
+
+    # feasible candidate with fewest treatments for each relaxed control
+    count = U_grid.sum(axis=0).reshape(len(methods), K)
+    score = np.where(error_flag.reshape(len(methods), K), np.inf, count)
+    best = np.argmin(score, axis=0)
+    cols = best * K + np.arange(K)
+    u_round = U_grid[allowed_idx][:, cols].T.astype(float)
+    method = [methods[m] for m in best]
+    return u_round, method, num_repairs[cols], error_flag[cols]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from Modules.Model.model_array import model_array
+from Modules.Integrator.integrator_rk4_array import rk4_array_integrator
+
+
+"""
+Range [0.8B, 1.1B] of x3 widened by the relative tolerance rtol, so that solutions on the bound
+(e.g. of the relaxed NLP) are not flagged
+
+Inputs:
+B:      Steady state value of x3
+rtol:   Relative tolerance of the bounds
+
+Outputs:
+x_lo:   Lower bound of x3
+x_up:   Upper bound of x3
+"""
+def x3_range(B, rtol):
+    return 0.8 * B * (1 - rtol), 1.1 * B * (1 + rtol)
+
+
+"""
+Forward simulation of K trajectories at once with the numpy integrator. Generator over the integration steps,
+yielding the states after each step and the treatment jump at its end.
+As for the NLPs, x3 is checked against its range from the fifth integration point on (k >= 4).
+
+Inputs:
+dt:             Step size of the integration grid
+X:              Initial states with shape (3, K)
+P:              Parameters [beta, gamma, pv_lambda, B] with shape (4,) or (4, K)
+u:              Control on the integration grid with shape (N,) or (N, K)
+max_fraction:   Maximal fractional blood removal per treatment
+
+Outputs (for each step k):
+k:              Index of the step, the states are those at grid point k+1
+X:              States with shape (3, K)
+checked:        True if x3 at grid point k+1 is checked against its range
+"""
+def simulate_array(dt, X, P, u, max_fraction):
+    u = np.asarray(u, dtype=float)
+    N = u.shape[0]
+    jump = 1 - u * max_fraction
+    treated_any = np.any(u.reshape(N, -1) != 0, axis=1)
+    F = rk4_array_integrator(model_array, dt, 1)
+    for k in range(N):
+        X, _ = F(X, 0., 0., P)
+        if treated_any[k]:
+            X[2] *= jump[k]
+        yield k, X, k >= 4
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import os
+import time
+import multiprocessing
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from pv_schedule import pv_schedule
+from Modules.Tools.patient_parameters import return_parameters
+
+
+"""
+Result arrays of a cohort run stored as .npy files in a directory. The files are opened as memory maps,
+so that all worker processes write their trajectories directly into the same arrays and the results
+can be loaded later without reading everything into memory.
+
+Arrays (J is the number of jobs, n_max the maximal number of trajectory points):
+x:              States with shape (J, n_max, 3), nan-padded
+q:              Objective value with shape (J, n_max), nan-padded
+tgrid:          Time grid with shape (J, n_max), nan-padded
+u:              Control on the integration grid with shape (J, n_max - 1)
+allowed:        Allowed treatment times on the integration grid with shape (J, n_max - 1)
+num_points:     Number of trajectory points of each job
+error_flag:     Error flag of each job, -1 for jobs that are not finished
+f:              Final objective value of each job
+time:           Computation time of each job
+
+Inputs:
+out_dir:        Directory of the result files
+mode:           'r' for reading, 'r+' for writing into existing files
+"""
+_result_names = ['x', 'q', 'tgrid', 'u', 'allowed', 'num_points', 'error_flag', 'f', 'time']
+
+
+def cohort_results(out_dir, mode='r'):
+    return {name: open_memmap(os.path.join(out_dir, name + '.npy'), mode=mode) for name in _result_names}
+
+
+def _create_results(out_dir, num_jobs, n_max):
+    os.makedirs(out_dir, exist_ok=True)
+    specs = {'x': (np.float64, (num_jobs, n_max, 3), np.nan),
+             'q': (np.float64, (num_jobs, n_max), np.nan),
+             'tgrid': (np.float64, (num_jobs, n_max), np.nan),
+             'u': (np.float64, (num_jobs, n_max - 1), 0.),
+             'allowed': (np.bool_, (num_jobs, n_max - 1), False),
+             'num_points': (np.int64, (num_jobs,), 0),
+             'error_flag': (np.int64, (num_jobs,), -1),
+             'f': (np.float64, (num_jobs,), np.nan),
+             'time': (np.float64, (num_jobs,), np.nan)}
+    for name, (dtype, shape, fill) in specs.items():
+        arr = open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+        arr[...] = fill
+        arr.flush()
+        del arr
+
+
+# result arrays of the worker process, opened once per worker
+_worker_results = {}
+
+
+def _init_worker(out_dir):
+    _worker_results.clear()
+    _worker_results.update(cohort_results(out_dir, mode='r+'))
+
+
+"""
+Computation of one job in a worker process. The trajectories are written into the result arrays,
+only a small summary is sent back to the main process.
+"""
+def _run_job(job_arg):
+    j, (index, lambda_version, dict_opts, Tf, Nperday) = job_arg
+    gamma, beta, Base, patient_volume, x0, pv_lambda = return_parameters(index, lambda_version=lambda_version)
+
+    t_start = time.time()
+    result = pv_schedule(Tf, Nperday, x0, Base, pv_lambda, [beta, gamma], patient_volume, dict_opts)
+    t_job = time.time() - t_start
+
+    u = result.u_grid
+    n = len(result.tgrid)
+    f = float(result.sol['f']) if 'f' in result.sol else result.q[-1]
+
+    res = _worker_results
+    res['x'][j, :n] = result.x
+    res['q'][j, :n] = result.q
+    res['tgrid'][j, :n] = result.tgrid
+    res['u'][j, :len(u)] = u
+    res['allowed'][j, :len(u)] = result.allowed_arr
+    res['num_points'][j] = n
+    res['f'][j] = f
+    res['time'][j] = t_job
+    res['error_flag'][j] = result.error_flag
+    for arr in res.values():
+        arr.flush()
+
+    return j, {'index': index, 'lambda_version': lambda_version, 'error_flag': int(result.error_flag), 'f': f,
+               'num_treatments': int(np.sum(u > 0.5)), 'time': t_job}
+
+
+"""
+Parallel computation of pv schedules for a list of jobs using a process pool. Every worker process
+keeps its imports and integrator functions (see model_integrator) over all its jobs and writes
+the trajectories directly into memory mapped result arrays in out_dir (see cohort_results).
+The function is a generator yielding the summary of each job as soon as it is finished.
+
+Inputs:
+jobs:           List of jobs (patient index, lambda_version, dict_opts, Tf, Nperday),
+                see Modules/Tools/patient_parameters.py and pv_schedule.py
+out_dir:        Directory for the result arrays, existing results are overwritten
+num_workers:    Number of worker processes, default is the number of cpus. For 1 the jobs are computed in
+                the calling process
+
+Outputs (yielded for each finished job):
+j:              Position of the job in jobs
+info:           Dictionary with index, lambda_version, error_flag, f, num_treatments and time of the job
+"""
+def run_cohort(jobs, out_dir, num_workers=None):
+    jobs = list(jobs)
+    # two_stage extension of integer end point method adds 20 points
+    n_max = max(int(Tf * Nperday) + 21 for (_, _, _, Tf, Nperday) in jobs)
+    _create_results(out_dir, len(jobs), n_max)
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_workers = min(num_workers, len(jobs))
+
+    if num_workers <= 1:
+        _init_worker(out_dir)
+        for job_arg in enumerate(jobs):
+            yield _run_job(job_arg)
+        _worker_results.clear()
+    else:
+        with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(out_dir,)) as pool:
+            for result in pool.imap_unordered(_run_job, enumerate(jobs)):
+                yield result
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import os
+import numpy as np
+import casadi as ca
+from functools import lru_cache
+from Modules.Model.model_integrator import model_integrator_parametric
+
+# bounds of the parameters [beta, gamma, pv_lambda]
+p_lower = np.array([0.01, 0.01, 0.])
+p_upper = np.array([10., 5., 1.])
+
+
+"""
+Least squares NLP for the parameters [beta, gamma, pv_lambda] with multiple shooting on all integration
+points and CasADi functions for the initialization and the covariance. The NLP is solved for num_starts
+initializations at once, in num_threads threads.
+Variables:  w = [beta, gamma, pv_lambda, X_0, ..., X_N]
+Parameters: [u (fraction of blood removal on the grid), B, measurements of x3, weights of the measurements]
+"""
+@lru_cache(maxsize=8)
+def _estimation_functions(N, dt, meas_idx, num_starts, num_threads):
+    M = len(meas_idx)
+    integrator_function = model_integrator_parametric(dt)
+    x = ca.MX.sym('x', 3)
+    up = ca.MX.sym('up', 5)
+    x_next = integrator_function(x0=x, q0=0, u=0, p=up[1:5])['xf'][3:6]
+    # jump by the removed fraction of blood
+    step = ca.Function('step', [x, up], [ca.vertcat(x_next[0:2], x_next[2] * (1 - up[0]))])
+    simulate = step.mapaccum(N)
+
+    theta = ca.MX.sym('theta', 3)
+    X = ca.MX.sym('X', 3, N + 1)
+    P = ca.MX.sym('P', N + 1 + 2 * M)
+    u = P[0:N]
+    B = P[N]
+    y = P[N + 1:N + 1 + M]
+    weights = P[N + 1 + M:]
+    args = ca.vertcat(u.T, ca.repmat(ca.vertcat(theta, B), 1, N))
+    g = ca.vec(step.map(N)(X[:, 0:N], args) - X[:, 1:N + 1])
+    r = weights * (X[2, list(meas_idx)].T - y)
+    nlp_prob = {'f': 0.5 * ca.sumsqr(r), 'x': ca.vertcat(theta, ca.vec(X)), 'g': g, 'p': P}
+    solver = ca.nlpsol('estimation', 'ipopt', nlp_prob,
+                       {'ipopt': {'print_level': 0}, 'print_time': False, 'expand': True})
+    if num_starts > 1:
+        solver = solver.map(num_starts, 'thread', num_threads)
+
+    # weighted residuals of the simulation and their jacobian for the covariance
+    x0 = ca.MX.sym('x0', 3)
+    X_sim = ca.horzcat(x0, simulate(x0, args))
+    r_sim = weights * (X_sim[2, list(meas_idx)].T - y)
+    residuals = ca.Function('residuals', [theta, x0, P], [r_sim, ca.jacobian(r_sim, theta)])
+    return solver, simulate, residuals
+
+
+"""
+Estimation of the patient parameters beta, gamma and pv_lambda from measurements of tHb (x3) by weighted
+least squares. The measurement and treatment times are rounded to the integration grid, a treatment at
+time t is applied at the end of the step to t, i.e. a measurement at the same time is after the treatment.
+The NLP is solved from several initializations (multi-start), the initial states are obtained by
+simulation with the initial parameters. The covariance of the parameters is the Gauss-Newton
+approximation inv(J^T J) of the weighted residuals at the best fit, multiplied with the estimated
+variance of the residuals if no standard deviation of the measurements is given.
+The time scales of the model are days, so Nperday = 1 is usually sufficient for the estimation
+(one year: about 3 seconds for 16 initializations, compared to about 25 seconds with Nperday = 6).
+
+Inputs:
+Tf:                 End point of observed interval [0, Tf]
+Nperday:            Number of integration points per day
+thb_times:          Times of the measurements (days)
+thb_values:         Measured tHb
+B:                  Steady state value of x3
+patient_volume:     Total blood volume of patient
+treatment_times:    Times of treatments (days) in (0, Tf], a treatment at time t reduces x3 at the grid point t
+treatment_volumes:  Volumes of blood removal of the treatments, single value or list (ml), default is 500
+x0:                 Initial value of x, default is the steady state calc_x0(B)
+dict_opts:          Dictionary with options
+    'num_starts':       Number of random initializations, default is 16
+    'p_start':          List of additional initializations [beta, gamma, pv_lambda]
+    'num_threads':      Number of threads for the solution of the NLPs, default is the number of cpus
+    'seed':             Seed of the random initializations, default is 0
+    'sigma':            Standard deviation of the measurements, single value or list (optional)
+
+Outputs:
+p_opt:              Estimated parameters [beta, gamma, pv_lambda]
+cov:                Covariance matrix of the estimated parameters
+x_fit:              Fitted trajectory with shape (N+1, 3)
+tgrid:              Time grid of x_fit
+residuals:          Residuals of the measurements
+costs:              Least squares costs of all initializations, inf for failed solutions
+A RuntimeError is raised if no initialization converged.
+"""
+def estimate_parameters(Tf, Nperday, thb_times, thb_values, B, patient_volume, treatment_times=None,
+                        treatment_volumes=500, x0=None, dict_opts=None):
+    if treatment_times is None:
+        treatment_times = []
+    if dict_opts is None:
+        dict_opts = {}
+    N = int(Tf * Nperday)
+    dt = Tf / N
+    tgrid = dt * np.arange(N + 1)
+    if x0 is None:
+        x0 = [B * (8 / 120), B * (6 / 120), B]
+    x0 = np.asarray(x0, dtype=float)
+
+    # reading options from dict_opts
+    if 'num_starts' in dict_opts.keys():
+        num_starts = dict_opts['num_starts']
+    else:
+        num_starts = 16
+    if 'num_threads' in dict_opts.keys():
+        num_threads = dict_opts['num_threads']
+    else:
+        num_threads = os.cpu_count()
+    if 'seed' in dict_opts.keys():
+        seed = dict_opts['seed']
+    else:
+        seed = 0
+    if 'sigma' in dict_opts.keys():
+        sigma = dict_opts['sigma']
+    else:
+        sigma = None
+
+    # measurements and treatments on the grid
+    y = np.asarray(thb_values, dtype=float)
+    meas_idx = np.rint(np.asarray(thb_times, dtype=float) / dt).astype(int)
+    if np.any(meas_idx < 0) or np.any(meas_idx > N):
+        raise ValueError('Measurement times have to be in [0, Tf]')
+    if len(y) <= 3:
+        raise ValueError('More than 3 measurements are needed for the estimation of 3 parameters')
+    u = np.zeros(N)
+    treatment_idx = np.rint(np.asarray(treatment_times, dtype=float) / dt).astype(int)
+    if np.any(treatment_idx < 1) or np.any(treatment_idx > N):
+        raise ValueError('Treatment times have to be in (0, Tf]')
+    np.add.at(u, treatment_idx - 1, np.broadcast_to(treatment_volumes, treatment_idx.shape) / patient_volume)
+    weights = np.ones(len(y)) if sigma is None else 1. / np.broadcast_to(np.asarray(sigma, dtype=float), y.shape)
+    P = np.concatenate([u, [B], y, weights])
+
+    # initializations: given ones and random ones, beta and gamma log-uniform
+    rng = np.random.RandomState(seed)
+    starts = np.column_stack([np.exp(rng.uniform(np.log(0.1), np.log(5.), num_starts)),
+                              np.exp(rng.uniform(np.log(0.05), np.log(2.), num_starts)),
+                              rng.uniform(0., 1., num_starts)])
+    if 'p_start' in dict_opts.keys():
+        starts = np.vstack([np.atleast_2d(dict_opts['p_start']), starts])
+    num_starts = len(starts)
+
+    solver, simulate, residuals = _estimation_functions(N, dt, tuple(meas_idx.tolist()), num_starts, num_threads)
+    W0 = np.empty((3 + 3 * (N + 1), num_starts))
+    for s, theta in enumerate(starts):
+        args = np.vstack([u, np.repeat(np.append(theta, B)[:, None], N, axis=1)])
+        W0[:3, s] = theta
+        W0[3:, s] = np.concatenate([x0, np.array(simulate(x0, args)).T.ravel()])
+    lbw = np.concatenate([p_lower, x0, np.zeros(3 * N)])
+    ubw = np.concatenate([p_upper, x0, np.full(3 * N, np.inf)])
+    sol = solver(x0=W0, p=np.repeat(P[:, None], num_starts, axis=1), lbx=np.repeat(lbw[:, None], num_starts, axis=1),
+                 ubx=np.repeat(ubw[:, None], num_starts, axis=1), lbg=0, ubg=0)
+
+    # best solution among the initializations fulfilling the shooting constraints
+    W = np.array(sol['x']).reshape(-1, num_starts)
+    costs = np.array(sol['f']).ravel()
+    violation = np.max(np.abs(np.array(sol['g']).reshape(-1, num_starts)), axis=0)
+    costs[~(violation < 1e-6) | ~np.isfinite(costs)] = np.inf
+    if not np.any(np.isfinite(costs)):
+        raise RuntimeError('No initialization of the parameter estimation converged')
+    best = int(np.argmin(costs))
+    p_opt = W[:3, best]
+    x_fit = W[3:, best].reshape(N + 1, 3)
+
+    # Gauss-Newton covariance
+    r, J = residuals(p_opt, x0, P)
+    r = np.array(r).ravel()
+    J = np.array(J)
+    cov = np.linalg.pinv(J.T @ J)
+    if sigma is None:
+        if len(r) <= 3:
+            raise ValueError('More than 3 residuals are needed for the estimation of the variance')
+        cov *= np.sum(r ** 2) / (len(r) - 3)
+    residuals_out = r / weights
+    return p_opt, cov, x_fit, tgrid, residuals_out, costs
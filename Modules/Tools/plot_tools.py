@@ -24,10 +24,68 @@ algorithm for Casadi NLP output
 
 """
 
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import matplotlib.cm as cm
+# state_separator is located in schedule_result, so that computations do not depend on matplotlib
+from Modules.Tools.schedule_result import state_separator
+
+# matplotlib is imported in the plotting functions only when they are called
+
+
+"""
+Reduction of a trajectory to at most max_points points for plotting. The trajectory is split into
+max_points/2 bins and the minimum and maximum of each bin are kept in their original order,
+so that the plotted envelope (e.g. jumps by treatments) is preserved.
+
+Inputs:
+t:              Time grid
+y:              Trajectory
+max_points:     Maximal number of points, None for no reduction
+
+Outputs:
+t_out:          Reduced time grid
+y_out:          Reduced trajectory
+"""
+def minmax_decimate(t, y, max_points):
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return t, y
+    num_bins = max(max_points // 2, 1)
+    size = int(np.ceil(n / num_bins))
+    y_pad = np.concatenate([y, np.full(num_bins * size - n, y[-1])]).reshape(num_bins, size)
+    offsets = size * np.arange(num_bins)
+    idx = np.sort(np.stack([np.argmin(y_pad, axis=1), np.argmax(y_pad, axis=1)], axis=1), axis=1)
+    idx = np.minimum(idx + offsets[:, None], n - 1).ravel()
+    idx = np.unique(np.concatenate([[0], idx, [n - 1]]))
+    return t[idx], y[idx]
+
+
+"""
+Spans of consecutive forbidden time points as one collection of rectangles covering the full height of the
+axis, each span extends half a grid step to both sides.
+
+Inputs:
+ax:             Matplotlib axis
+forbid_time:    Sorted forbidden time points on an equidistant grid
+dt:             Step size of the grid
+
+Output:
+Collection added to ax
+"""
+def forbidden_spans(ax, forbid_time, dt, **kwargs):
+    forbid_time = np.asarray(forbid_time, dtype=float)
+    if len(forbid_time) == 0:
+        return None
+    breaks = np.flatnonzero(np.diff(forbid_time) > 1.5 * dt)
+    starts = forbid_time[np.concatenate([[0], breaks + 1])] - dt / 2
+    ends = forbid_time[np.concatenate([breaks, [len(forbid_time) - 1]])] + dt / 2
+    verts = [[(a, 0), (a, 1), (b, 1), (b, 0)] for a, b in zip(starts, ends)]
+    from matplotlib.collections import PolyCollection
+    collection = PolyCollection(verts, transform=ax.get_xaxis_transform(), **kwargs)
+    ax.add_collection(collection)
+    return collection
 
 
 """
@@ -57,6 +115,9 @@ show_plot:          Show plot at end of execution (optional)
 limit:              Number for upper bound which is displayed in x3 plot (optional)
 marker_styles:      List of marker styles of trajectories (optional)
 line_width:         List of line widths of trajectories (optional)
+max_points:         Maximal number of plotted points per trajectory, longer trajectories are reduced
+                    by minmax_decimate (optional)
+save_path:          File name for saving the figure, the figure is closed afterwards if it is not shown (optional)
 
 Outputs:
 Function has no return values. 
@@ -65,7 +126,10 @@ Function has no return values.
 
 def plot_sol(x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrids, allowed_arr, num_inputs=1,
              input_names=None, title=None, color_inputs=None, colorbar_type=None, show_forbidden=True,
-             show_plot=False, limit=None, marker_styles=None, line_width=None):
+             show_plot=False, limit=None, marker_styles=None, line_width=None, max_points=None, save_path=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+    import matplotlib.cm as cm
     
     # for consistency: single array input will be put into list 
     if num_inputs == 1:
@@ -139,20 +203,18 @@ def plot_sol(x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrids, allowed_arr, num_inpu
         q_i = q_opt[i]
         
         # Get suitable time grids for allowed and forbidden times
-        u_time = [tgrid[j] for j in range(0, len(allowed_arr[i])) if allowed_arr[i][j] >= 1e-8]
-        forbid_time = [tgrid[j] for j in range(0, len(allowed_arr[i])) if allowed_arr[i][j] == 0]
+        allowed_i = np.asarray(allowed_arr[i], dtype=float)
+        tgrid_i = np.asarray(tgrid, dtype=float)[:len(allowed_i)]
+        u_time = tgrid_i[allowed_i >= 1e-8]
+        forbid_time = tgrid_i[allowed_i == 0]
 
         # Plot trajectories
         if color_inputs is not None:
-            p1.plot(tgrid, x1_i, color=color, marker = marker_styles[i], linewidth=line_width[i])
-            p2.plot(tgrid, x2_i, color=color, marker = marker_styles[i], linewidth=line_width[i])
-            p3.plot(tgrid, x3_i, color=color, marker = marker_styles[i], linewidth=line_width[i])
-            p5.plot(tgrid, q_i, color=color, marker = marker_styles[i], linewidth=line_width[i])
+            plot_opts = {'color': color, 'marker': marker_styles[i], 'linewidth': line_width[i]}
         else:
-            p1.plot(tgrid, x1_i, marker = marker_styles[i], linewidth=line_width[i])
-            p2.plot(tgrid, x2_i, marker = marker_styles[i], linewidth=line_width[i])
-            p3.plot(tgrid, x3_i, marker = marker_styles[i], linewidth=line_width[i])
-            p5.plot(tgrid, q_i, marker = marker_styles[i], linewidth=line_width[i])
+            plot_opts = {'marker': marker_styles[i], 'linewidth': line_width[i]}
+        for ax, y in [(p1, x1_i), (p2, x2_i), (p3, x3_i), (p5, q_i)]:
+            ax.plot(*minmax_decimate(tgrid, y, max_points), **plot_opts)
 
         
         # Check: due to rounding last entry of u_time might not be needed
@@ -166,9 +228,8 @@ def plot_sol(x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrids, allowed_arr, num_inpu
             p4.plot(u_time, u_i, marker='x', linestyle='None')
         
         # Plot forbidden times
-        if i == 0 and show_forbidden:
-            for f in forbid_time:
-                p4.axvline(f, color='red', alpha=0.3 )
+        if i == 0 and show_forbidden and len(tgrid_i) > 1:
+            forbidden_spans(p4, forbid_time, tgrid_i[1] - tgrid_i[0], facecolor='red', alpha=0.3, edgecolor='none')
     # Plot color bar
     if color_inputs is not None and colorbar_type is not None:
         plt.colorbar(s_map, orientation='horizontal')
@@ -176,43 +237,35 @@ def plot_sol(x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrids, allowed_arr, num_inpu
     # Plot legend in plot 1
     p1.legend(legend_arr)
     
-    # Show plot 
+    # Save and show plot 
+    if save_path is not None:
+        f.savefig(save_path)
     if show_plot:
         plt.show()
-    
-"""
-Separate state x obtained from casadi solution into plotable trajectories
-
-Input:
-x_in:   List of Casadi state vectors
-
-Outputs:
-x1_out: Numpy array with trajectory for x1
-x2_out: Numpy array with trajectory for x2
-x3_out: Numpy array with trajectory for x3
-"""   
-
-def state_separator(x_in):
-    x1_out = []
-    x2_out = []
-    x3_out = []
-
-    for x in x_in:
-        x1_out.append(x[0])
-        x2_out.append(x[1])
-        x3_out.append(x[2])
-
-    # conversion to numpy array
-    x1_out = np.array(x1_out)
-    x2_out = np.array(x2_out)
-    x3_out = np.array(x3_out)    
-
-    return x1_out, x2_out, x3_out
+    elif save_path is not None:
+        plt.close(f)
 
 
+def _init_plot_worker():
+    import matplotlib
+    matplotlib.use('Agg')
 
 
+def _plot_to_file(plot_args, save_path):
+    plot_sol(**dict(plot_args, save_path=save_path, show_plot=False))
 
 
+"""
+Headless plotting of many figures in parallel worker processes using the Agg backend.
 
+Inputs:
+plot_args:      List of dictionaries with the inputs of plot_sol for each figure
+save_paths:     List of file names of the figures
+num_workers:    Number of worker processes, default is the number of cpus
 
+Outputs:
+Function has no return values. 
+"""
+def plot_sol_batch(plot_args, save_paths, num_workers=None):
+    with multiprocessing.Pool(num_workers, initializer=_init_plot_worker) as pool:
+        pool.starmap(_plot_to_file, zip(plot_args, save_paths))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Heuristic.heuristic_batch import pv_heuristic_batch
+from Modules.Tools.patient_parameters import return_parameters
+
+
+"""
+Interval of pv_lambda for which the heuristic algorithm needs between u_lim_lo and u_lim_up treatments.
+The batched heuristic (pv_heuristic_batch) is used, its numbers of treatments can differ from pv_schedule
+with 'heuristic', as it also rejects treatment times violating the lower constraint at a later treatment.
+The number of treatments is nondecreasing in pv_lambda, so both ends of the interval are found by
+bisection on [0, 1]. Both bisections are evaluated together in one call of the batched heuristic, equal
+midpoints (as long as both ends are in the same interval) only once, and pv_lambda 0 and 1 only if an end
+of the interval is close to them. The returned interval is always inside the exact one and shorter by at most
+tol at each end.
+
+Inputs:
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+x0:             Initial value of x
+B:              Steady state value of x3
+p_in:           Patient parameters [beta, gamma]
+patient_volume: Total blood volume of patient
+u_lim_lo:       Minimal number of treatments
+u_lim_up:       Maximal number of treatments
+dict_opts:      Dictionary with 'allowed_hours', 'allowed_days', 'forbidden_days' and 'max_treatment_volume'
+                in format of pv_schedule
+tol:            Length of the bisection intervals at termination, default is 0.02
+
+Outputs:
+pv_lambda_lo:   Lower end of the pv_lambda interval, None if the interval is empty
+pv_lambda_up:   Upper end of the pv_lambda interval, None if the interval is empty
+num_runs:       Number of heuristic evaluations (batched evaluations count once per pv_lambda)
+"""
+def pv_lambda_interval(Tf, Nperday, x0, B, p_in, patient_volume, u_lim_lo, u_lim_up, dict_opts=None, tol=2e-2):
+    if dict_opts is None:
+        dict_opts = {}
+    N = int(Tf * Nperday)
+    dt = Tf / N
+    if 'max_treatment_volume' in dict_opts.keys():
+        max_treatment_volume = dict_opts['max_treatment_volume']
+    else:
+        max_treatment_volume = 500
+    max_fraction = max_treatment_volume / patient_volume
+    allowed_arr = allowed_generator(Nperday, dict_opts, N, dt)
+
+    # number of treatments for several pv_lambdas, schedules without valid solution count as too many treatments
+    def num_treatments(pv_lambdas):
+        K = len(pv_lambdas)
+        _, _, u, _, _, error_flag = pv_heuristic_batch(Tf, N, np.tile(x0, (K, 1)), np.tile(p_in, (K, 1)),
+                                                       np.asarray(pv_lambdas, dtype=float), B, max_fraction,
+                                                       allowed_arr)
+        return np.where(error_flag, np.inf, np.sum(u, axis=1))
+
+    # invariants: count(lo[0]) < u_lim_lo <= count(lo[1]) and count(up[0]) <= u_lim_up < count(up[1]),
+    # where the counts of pv_lambda 0 and 1 are only evaluated at the end if needed
+    lo = [0., 1.]
+    up = [0., 1.]
+    num_runs = 0
+    while lo[1] - lo[0] > tol or up[1] - up[0] > tol:
+        mids = [(lo[0] + lo[1]) / 2 if lo[1] - lo[0] > tol else None,
+                (up[0] + up[1]) / 2 if up[1] - up[0] > tol else None]
+        values = sorted(set(mid for mid in mids if mid is not None))
+        counts = dict(zip(values, num_treatments(values)))
+        num_runs += len(values)
+        if mids[0] is not None:
+            lo[counts[mids[0]] >= u_lim_lo] = mids[0]
+        if mids[1] is not None:
+            up[counts[mids[1]] > u_lim_up] = mids[1]
+
+    # ends of the interval at 0 or 1
+    ends = [v for v, needed in [(0., lo[0] == 0. or up[0] == 0.), (1., lo[1] == 1. or up[1] == 1.)] if needed]
+    if ends:
+        counts = dict(zip(ends, num_treatments(ends)))
+        num_runs += len(ends)
+        if 0. in counts and counts[0.] >= u_lim_lo:
+            lo[1] = 0.
+        if 0. in counts and counts[0.] > u_lim_up:
+            return None, None, num_runs
+        if 1. in counts and counts[1.] <= u_lim_up:
+            up[0] = 1.
+        if 1. in counts and counts[1.] < u_lim_lo:
+            return None, None, num_runs
+
+    if lo[1] > up[0]:
+        return None, None, num_runs
+    return lo[1], up[0], num_runs
+
+
+"""
+Generation of plausible pv_lambda parameters for subjects, such that the heuristic algorithm needs between
+u_lim_lo and u_lim_up treatments on [0, Tf]. The pv_lambdas are drawn uniformly from the interval
+computed by pv_lambda_interval with a random generator seeded by seed and the subject index,
+so that the result of a subject does not depend on the other subjects.
+
+Inputs:
+indices:        List of subject indices, see Modules/Tools/patient_parameters.py
+num_pv_lambdas: Number of pv_lambdas per subject
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+u_lim_lo:       Minimal number of treatments
+u_lim_up:       Maximal number of treatments
+seed:           Seed of the random generators
+dict_opts:      Dictionary with options of pv_lambda_interval
+tol:            Tolerance of pv_lambda_interval
+
+Outputs:
+pv_lambdas:     Dictionary with list of pv_lambdas for each subject index, empty list if no pv_lambda is valid
+intervals:      Dictionary with pv_lambda interval for each subject index
+"""
+def pv_lambda_calibration(indices, num_pv_lambdas, Tf, Nperday, u_lim_lo, u_lim_up, seed=0, dict_opts=None, tol=2e-2):
+    if dict_opts is None:
+        dict_opts = {}
+    pv_lambdas = {}
+    intervals = {}
+    for index in indices:
+        gamma, beta, Base, patient_volume, x0, _ = return_parameters(index)
+        pv_lambda_lo, pv_lambda_up, num_runs = pv_lambda_interval(Tf, Nperday, x0, Base, [beta, gamma], patient_volume,
+                                                                  u_lim_lo, u_lim_up, dict_opts, tol)
+        intervals[index] = (pv_lambda_lo, pv_lambda_up)
+        if pv_lambda_lo is None:
+            print('No valid pv_lambda for subject', index)
+            pv_lambdas[index] = []
+            continue
+        rng = np.random.RandomState([seed] + [ord(c) for c in index])
+        pv_lambdas[index] = rng.uniform(pv_lambda_lo, pv_lambda_up, num_pv_lambdas).tolist()
+        print('Subject', index, 'pv_lambda interval', [pv_lambda_lo, pv_lambda_up], 'heuristic runs', num_runs)
+    return pv_lambdas, intervals
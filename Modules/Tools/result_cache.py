@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import casadi as ca
+
+try:
+    import fcntl
+except ImportError:
+    # no file locking available (e.g. Windows), eviction is then not protected against other processes
+    fcntl = None
+
+from pv_schedule import pv_schedule
+from Modules.Tools.schedule_result import ScheduleResult
+
+
+_default_cache_dir = os.environ.get('PVSCHEDULE_CACHE_DIR',
+                                    os.path.join(os.path.expanduser('~'), '.cache', 'pvschedule'))
+_code_hash = None
+
+
+"""
+Canonical representation of the inputs of pv_schedule, which does not depend on the types used
+(lists, tuples, numpy arrays, casadi DM, ranges) and on the order of dictionary keys.
+"""
+def _canonical(obj):
+    if isinstance(obj, dict):
+        return {str(key): _canonical(value) for key, value in obj.items()}
+    if isinstance(obj, range):
+        return ['range', obj.start, obj.stop, obj.step]
+    if isinstance(obj, (ca.DM, np.ndarray)):
+        obj = np.asarray(obj, dtype=float).ravel().tolist()
+        return [_canonical(v) for v in obj] if len(obj) != 1 else _canonical(obj[0])
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, (bool, np.bool_)):
+        return bool(obj)
+    if isinstance(obj, (int, float, np.integer, np.floating)):
+        return repr(float(obj))
+    return obj
+
+
+"""
+Hash of the source code of pv_schedule and all modules, so that cached results of older code versions
+are not used.
+"""
+def _source_hash():
+    global _code_hash
+    if _code_hash is None:
+        root = os.path.dirname(os.path.abspath(__import__('pv_schedule').__file__))
+        h = hashlib.sha256()
+        files = [os.path.join(root, 'pv_schedule.py')]
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, 'Modules')):
+            dirnames.sort()
+            files += [os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith('.py')]
+        for path in files:
+            h.update(os.path.relpath(path, root).encode())
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        _code_hash = h.hexdigest()
+    return _code_hash
+
+
+def cache_key(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts):
+    inputs = _canonical([Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts])
+    text = json.dumps([inputs, _source_hash()], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _save(path, result):
+    arrays = {'x': result.x, 'q': result.q, 'u': result.u, 'tgrid': result.tgrid,
+              'allowed_arr': result.allowed_arr, 'error_flag': np.array(result.error_flag)}
+    for key, value in result.sol.items():
+        arrays['sol_' + key] = np.array(value, dtype=float)
+    # solver statistics with scalar values (success, return status, iteration count and timings) as JSON
+    stats = {key: value for key, value in result.stats.items() if isinstance(value, (bool, int, float, str))}
+    arrays['stats'] = np.array(json.dumps(stats))
+    # write to temporary file and rename, so that other processes never see incomplete files
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _load(path):
+    with np.load(path) as data:
+        sol = {key[4:]: ca.DM(data[key]) for key in data.files if key.startswith('sol_')}
+        stats = json.loads(str(data['stats'])) if 'stats' in data.files else {}
+        return ScheduleResult(data['x'], data['q'], data['u'], data['tgrid'], sol, data['allowed_arr'],
+                              int(data['error_flag']), stats)
+
+
+"""
+Removal of the least recently used results until the cache is smaller than max_size bytes.
+"""
+def _evict(cache_dir, max_size):
+    with open(os.path.join(cache_dir, '.lock'), 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+"""
+pv_schedule with a persistent cache of the results on disk. The results are stored in compressed
+NumPy containers named by the hash of all inputs and of the source code, so identical calls are only
+computed once, also over several sessions and processes. Results are written atomically and the least
+recently used results are removed if the cache exceeds max_size.
+
+Inputs:
+Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts:    Inputs of pv_schedule
+cache_dir:      Directory of the cache, default is $PVSCHEDULE_CACHE_DIR or ~/.cache/pvschedule
+max_size:       Maximal size of the cache in bytes
+
+Outputs:
+ScheduleResult as returned by pv_schedule, where sol is a dictionary with casadi DM values ({} for 'heuristic')
+and stats contains the scalar solver statistics
+"""
+def cached_pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts, cache_dir=None,
+                       max_size=2**30):
+    if cache_dir is None:
+        cache_dir = _default_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, cache_key(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts) + '.npz')
+
+    try:
+        result = _load(path)
+        # update access time for the least recently used eviction
+        os.utime(path)
+        return result
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        pass
+
+    result = pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts)
+    _save(path, result)
+    result = _load(path)
+    _evict(cache_dir, max_size)
+    return result
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+from Modules.Tools.array_simulation import simulate_array, x3_range
+
+
+"""
+Feasibility check and scores of many candidate integer schedules (e.g. from sumup, BONMIN iterations, manual
+edits or local search) for one patient. All schedules are simulated at once with the numpy integrator.
+As for the NLPs, the range [0.8B, 1.1B] of x3 is checked from the fifth integration point on.
+
+Inputs:
+Tf:                 End point of observed interval [0, Tf]
+schedules:          0/1 schedules at the allowed times with shape (K, number of allowed times)
+allowed_arr:        List or boolean array of allowed treatment integration points with length N
+x0:                 Initial value of x
+B:                  Steady state value of x3
+p_in:               Patient parameters [beta, gamma]
+pv_lambda:          Patient parameter pv_lambda
+max_fraction:       Maximal fractional blood removal per treatment
+rtol:               Relative tolerance of the range of x3, default is 1e-6
+
+Outputs:
+first_violation:    Index of the first point of the time grid with x3 outside of the range, -1 for feasible schedules
+x3_min:             Minimum of x3 in the checked points
+x3_max:             Maximum of x3 in the checked points
+num_treatments:     Number of treatments
+time_in_range:      Fraction of the checked points with x3 in range
+"""
+def check_schedules(Tf, schedules, allowed_arr, x0, B, p_in, pv_lambda, max_fraction, rtol=1e-6):
+    allowed = np.asarray(allowed_arr) >= 1e-8
+    N = len(allowed)
+    dt = Tf / N
+    schedules = np.atleast_2d(np.asarray(schedules, dtype=float))
+    K = schedules.shape[0]
+
+    # control on the grid with shape (N, K) for contiguous access of all schedules at one time
+    u = np.zeros((N, K))
+    u[allowed] = schedules.T
+    P = np.array([p_in[0], p_in[1], pv_lambda, B])
+    X = np.repeat(np.asarray(x0, dtype=float)[:, None], K, axis=1)
+    x_lo, x_up = x3_range(B, rtol)
+
+    first_violation = np.full(K, -1)
+    x3_min = np.full(K, np.inf)
+    x3_max = np.full(K, -np.inf)
+    in_range = np.zeros(K)
+    for k, X, checked in simulate_array(dt, X, P, u, max_fraction):
+        if checked:
+            x3 = X[2]
+            np.minimum(x3_min, x3, out=x3_min)
+            np.maximum(x3_max, x3, out=x3_max)
+            ok = (x3 <= x_up) & (x3 >= x_lo)
+            in_range += ok
+            first_violation[(first_violation < 0) & ~ok] = k + 1
+
+    num_treatments = np.sum(schedules > 0.5, axis=1)
+    time_in_range = in_range / max(N - 4, 1)
+    return first_violation, x3_min, x3_max, num_treatments, time_in_range
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+
+
+"""
+Result of pv_schedule. The states are stored in one array with shape (number of points, 3),
+x1, x2 and x3 are views of its columns. For existing code the result can be used like the former
+output tuple (x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, error_flag),
+e.g. by unpacking or indexing.
+
+Attributes:
+x:              States with shape (number of points, 3)
+q:              Objective value on the time grid
+u:              Control for the allowed time points
+tgrid:          Time grid of trajectories
+sol:            Casadi NLP solution object, {} for 'heuristic'
+allowed_arr:    Boolean array of allowed times
+error_flag:     Error flag of heuristic approach, 0 for other methods
+stats:          Statistics of the NLP solver (e.g. 'success', 'iter_count', 't_wall_total'), {} for 'heuristic'
+
+Properties:
+x1, x2, x3:     Trajectories of the states (views of x)
+u_grid:         Control on the integration grid (0 at forbidden times)
+"""
+class ScheduleResult:
+
+    __slots__ = ('x', 'q', 'u', 'tgrid', 'sol', 'allowed_arr', 'error_flag', 'stats')
+
+    def __init__(self, x, q, u, tgrid, sol, allowed_arr, error_flag, stats=None):
+        self.x = np.asarray(x, dtype=float)
+        self.q = np.asarray(q, dtype=float)
+        self.u = np.asarray(u, dtype=float)
+        self.tgrid = np.asarray(tgrid, dtype=float)
+        self.sol = sol
+        self.allowed_arr = np.asarray(allowed_arr) >= 1e-8
+        self.error_flag = error_flag
+        self.stats = {} if stats is None else stats
+
+    @property
+    def x1(self):
+        return self.x[:, 0]
+
+    @property
+    def x2(self):
+        return self.x[:, 1]
+
+    @property
+    def x3(self):
+        return self.x[:, 2]
+
+    @property
+    def u_grid(self):
+        u_grid = np.zeros(len(self.allowed_arr))
+        u_grid[self.allowed_arr] = self.u[:np.count_nonzero(self.allowed_arr)]
+        return u_grid
+
+    def as_tuple(self):
+        return (self.x1, self.x2, self.x3, self.q, self.u, self.tgrid, self.sol, self.allowed_arr, self.error_flag)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __getitem__(self, i):
+        return self.as_tuple()[i]
+
+    def __len__(self):
+        return 9
+
+
+"""
+Separate state x obtained from casadi solution into plotable trajectories
+
+Input:
+x_in:   List of Casadi state vectors
+
+Outputs:
+x1_out: Numpy array with trajectory for x1
+x2_out: Numpy array with trajectory for x2
+x3_out: Numpy array with trajectory for x3
+"""   
+
+def state_separator(x_in):
+    x = np.array([np.asarray(xk, dtype=float).ravel()[:3] for xk in x_in])
+    return x[:, 0], x[:, 1], x[:, 2]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import numpy as np
+from Modules.Tools.array_simulation import simulate_array, x3_range
+
+
+"""
+Monte Carlo stress test of a fixed treatment schedule. The schedule is simulated for many parameter samples
+at once with the numpy integrator (all samples in one array) and the risk of x3 leaving [0.8B, 1.1B]
+is reported. As for the NLPs, the range is checked from the fifth integration point on, since a patient may
+start with too high x3. Optionally, the initial state and the tHb measurements are disturbed by noise,
+then the statistics are those of the measured x3.
+
+Inputs:
+Tf:             End point of observed interval [0, Tf]
+u_grid:         Control on the integration grid with length N (e.g. u_grid of a ScheduleResult)
+x0:             Initial value of x
+B:              Steady state value of x3
+p_samples:      Parameter samples [beta, gamma, pv_lambda] with shape (K, 3)
+max_fraction:   Maximal fractional blood removal per treatment
+dict_opts:      Dictionary with options
+    'x0_noise':     Relative standard deviation of the initial state, default is 0
+    'thb_noise':    Relative standard deviation of the tHb measurements, default is 0
+    'quantiles':    Quantiles of x3 over the samples, default is [0.05, 0.5, 0.95]
+    'seed':         Seed of the noise, default is 0
+    'rtol':         Relative tolerance of the range of x3, default is 1e-6
+
+Outputs:
+p_violation:    Probability of x3 leaving [0.8B, 1.1B]
+p_upper:        Probability of x3 > 1.1B
+p_lower:        Probability of x3 < 0.8B
+time_in_range:  Fraction of the checked integration points with x3 in range for each sample, shape (K,)
+daily_risk:     Probability of x3 leaving the range during each day, shape (number of days,)
+x3_quantiles:   Quantiles of x3 at each integration point, shape (number of quantiles, N+1)
+"""
+def stress_test(Tf, u_grid, x0, B, p_samples, max_fraction, dict_opts=None):
+    if dict_opts is None:
+        dict_opts = {}
+    u_grid = np.asarray(u_grid, dtype=float)
+    N = len(u_grid)
+    dt = Tf / N
+    Nperday = int(round(N / Tf))
+    p_samples = np.atleast_2d(np.asarray(p_samples, dtype=float))
+    K = p_samples.shape[0]
+
+    # reading options from dict_opts
+    if 'x0_noise' in dict_opts.keys():
+        x0_noise = dict_opts['x0_noise']
+    else:
+        x0_noise = 0.
+    if 'thb_noise' in dict_opts.keys():
+        thb_noise = dict_opts['thb_noise']
+    else:
+        thb_noise = 0.
+    if 'quantiles' in dict_opts.keys():
+        quantiles = dict_opts['quantiles']
+    else:
+        quantiles = [0.05, 0.5, 0.95]
+    if 'seed' in dict_opts.keys():
+        seed = dict_opts['seed']
+    else:
+        seed = 0
+    if 'rtol' in dict_opts.keys():
+        rtol = dict_opts['rtol']
+    else:
+        rtol = 1e-6
+    rng = np.random.RandomState(seed)
+
+    P = np.vstack([p_samples.T, np.full(K, B)])
+    X = np.asarray(x0, dtype=float)[:, None] * (1 + x0_noise * rng.randn(3, K))
+    x_lo, x_up = x3_range(B, rtol)
+
+    upper = np.zeros(K, dtype=bool)
+    lower = np.zeros(K, dtype=bool)
+    in_range = np.zeros(K)
+    daily_risk = np.zeros(int(np.ceil(N / Nperday)))
+    out_today = np.zeros(K, dtype=bool)
+    x3_quantiles = np.empty((len(quantiles), N + 1))
+    x3_quantiles[:, 0] = np.quantile(X[2], quantiles)
+    for k, X, checked in simulate_array(dt, X, P, u_grid, max_fraction):
+        x3 = X[2] * (1 + thb_noise * rng.randn(K)) if thb_noise > 0 else X[2]
+        x3_quantiles[:, k + 1] = np.quantile(x3, quantiles)
+        if checked:
+            above = x3 > x_up
+            below = x3 < x_lo
+            upper |= above
+            lower |= below
+            in_range += ~(above | below)
+            out_today |= above | below
+        # grid point k+1 belongs to the day of the time interval (k*dt, (k+1)*dt]
+        if (k + 1) % Nperday == 0 or k == N - 1:
+            daily_risk[k // Nperday] = np.mean(out_today)
+            out_today[:] = False
+
+    p_violation = np.mean(upper | lower)
+    time_in_range = in_range / max(N - 4, 1)
+    return p_violation, np.mean(upper), np.mean(lower), time_in_range, daily_risk, x3_quantiles
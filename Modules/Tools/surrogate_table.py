@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+
+import os
+import bisect
+import pickle
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from pv_schedule import pv_schedule
+from Modules.Model.allowed_generator import allowed_generator
+from Modules.Heuristic.heuristic_batch import pv_heuristic_batch
+from Modules.NLP.nlp_builder_parametric import nlp_solver_parametric, nlp_bounds_parametric, nlp_initial_guess
+from Modules.Tools.patient_parameters import calc_x0
+
+"""
+Surrogate table of schedule summaries over a grid of patient parameters. The model is invariant under scaling
+of x and B (all constraints are relative to B and the treatments remove a fraction of x3), so for patients
+starting in the steady state calc_x0(B) the schedules depend only on beta, gamma, pv_lambda and the maximal
+fractional blood removal max_fraction = max_treatment_volume / patient_volume. The heuristic schedules are
+those of the batched heuristic (pv_heuristic_batch), which can differ from pv_schedule with 'heuristic', as it
+also rejects treatment times violating the lower constraint at a later treatment.
+
+Files in the table directory:
+table.npy:      Summaries with shape (len(beta), len(gamma), len(pv_lambda), len(max_fraction), 5), float32
+meta.pkl:       Axes of the grid, Tf, Nperday and dict_opts of the schedules
+
+Summaries (nan if not available):
+treatments_per_year:    Number of treatments of the heuristic schedule per 365 days
+mean_interval:          Mean time between treatments of the heuristic schedule (days), at least 2 treatments
+first_treatment:        Time of the first treatment of the heuristic schedule (days)
+error_flag:             Error flag of the heuristic algorithm
+relaxed_per_year:       Sum of the relaxed NLP control per 365 days (only if built with relaxed=True)
+"""
+axis_names = ['beta', 'gamma', 'pv_lambda', 'max_fraction']
+summary_names = ['treatments_per_year', 'mean_interval', 'first_treatment', 'error_flag', 'relaxed_per_year']
+
+
+def _heuristic_summaries(u, dt, Tf):
+    treated = u > 0.5
+    count = np.sum(treated, axis=1)
+    N = u.shape[1]
+    # treatment in step k is applied at time (k+1)*dt
+    first = (np.argmax(treated, axis=1) + 1) * dt
+    last = (N - np.argmax(treated[:, ::-1], axis=1)) * dt
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_interval = np.where(count >= 2, (last - first) / (count - 1), np.nan)
+    return np.column_stack([count * 365. / Tf, mean_interval, np.where(count > 0, first, np.nan)])
+
+
+"""
+Offline computation of a surrogate table by the batched heuristic algorithm and optionally the relaxed NLP
+(one NLP solver for all grid points, see nlp_solver_parametric).
+
+Inputs:
+out_dir:        Directory of the table, an existing table is overwritten
+beta:           Increasing grid of beta
+gamma:          Increasing grid of gamma
+pv_lambda:      Increasing grid of pv_lambda
+max_fraction:   Increasing grid of max_fraction
+Tf:             End point of observed interval [0, Tf]
+Nperday:        Number of integration points per day
+dict_opts:      Dictionary with 'allowed_hours', 'allowed_days', 'forbidden_days' in format of pv_schedule
+relaxed:        Also compute the relaxed NLP for each grid point (slow)
+batch_size:     Number of grid points per call of the batched heuristic
+verbose:        Print the progress after each batch
+
+Outputs:
+table:          Memory mapped table of summaries
+"""
+def build_surrogate_table(out_dir, beta, gamma, pv_lambda, max_fraction, Tf=365, Nperday=6, dict_opts=None,
+                          relaxed=False, batch_size=1024, verbose=False):
+    if dict_opts is None:
+        dict_opts = {}
+    axes = [np.asarray(a, dtype=float) for a in (beta, gamma, pv_lambda, max_fraction)]
+    for name, a in zip(axis_names, axes):
+        if len(a) < 2 or np.any(np.diff(a) <= 0):
+            raise ValueError('Grid of ' + name + ' has to be increasing with at least 2 points')
+    N = int(Tf * Nperday)
+    dt = Tf / N
+    allowed_arr = allowed_generator(Nperday, dict_opts, N, dt)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'meta.pkl'), 'wb') as f:
+        pickle.dump({'axes': axes, 'Tf': Tf, 'Nperday': Nperday, 'dict_opts': dict_opts}, f)
+    shape = tuple(len(a) for a in axes)
+    table = open_memmap(os.path.join(out_dir, 'table.npy'), mode='w+', dtype=np.float32,
+                        shape=shape + (len(summary_names),))
+    flat = table.reshape(-1, len(summary_names))
+    flat[...] = np.nan
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 4)
+
+    # the scaling invariance allows B = 1 for all grid points
+    B = 1.
+    x0 = np.array(calc_x0(B))
+    for start in range(0, len(points), batch_size):
+        p = points[start:start + batch_size]
+        K = len(p)
+        _, _, u, _, _, error_flag = pv_heuristic_batch(Tf, N, np.tile(x0, (K, 1)), p[:, 0:2], p[:, 2], B, p[:, 3],
+                                                       allowed_arr)
+        flat[start:start + K, 0:3] = _heuristic_summaries(u, dt, Tf)
+        flat[start:start + K, 3] = error_flag
+        if verbose:
+            print('Surrogate table:', start + K, 'of', len(points), 'grid points', flush=True)
+
+    if relaxed:
+        solver = nlp_solver_parametric(N, dt, allowed_arr)
+        lbw, ubw, lbg, ubg = nlp_bounds_parametric(N, allowed_arr, x0, B)
+        for i, p in enumerate(points):
+            p_model = [p[0], p[1], p[2], B]
+            w0 = nlp_initial_guess(N, dt, allowed_arr, x0, p_model, p[3])
+            sol = solver(x0=w0, p=p_model + [p[3], 1.], lbx=lbw, ubx=ubw, lbg=lbg, ubg=ubg)
+            if solver.stats()['success']:
+                flat[i, 4] = float(sol['f']) / dt * 365. / Tf
+        if verbose:
+            print('Surrogate table: relaxed NLP for', len(points), 'grid points')
+    table.flush()
+    return table
+
+
+"""
+Surrogate table loaded as memory map with multilinear interpolation. Queries outside the grid are
+clipped to its boundary.
+
+Inputs:
+out_dir:        Directory of the table (see build_surrogate_table)
+
+Methods:
+query(beta, gamma, pv_lambda, max_fraction):    Interpolated summaries of one patient (in order of summary_names)
+query_batch(points):                            Interpolated summaries for points with shape (K, 4)
+"""
+class SurrogateTable:
+
+    def __init__(self, out_dir):
+        with open(os.path.join(out_dir, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+        self.axes = meta['axes']
+        self.Tf = meta['Tf']
+        self.Nperday = meta['Nperday']
+        self.dict_opts = meta['dict_opts']
+        self.table = np.load(os.path.join(out_dir, 'table.npy'), mmap_mode='r')
+        # plain array view of the same memory and python lists for fast single queries
+        self._data = self.table.view(np.ndarray)
+        self._axes_lists = [a.tolist() for a in self.axes]
+
+    def query(self, beta, gamma, pv_lambda, max_fraction):
+        idx = []
+        # weights of the 16 corners of the grid cell, first axis slowest
+        weights = [1.]
+        for a, v in zip(self._axes_lists, (beta, gamma, pv_lambda, max_fraction)):
+            i = min(max(bisect.bisect_right(a, v) - 1, 0), len(a) - 2)
+            t = min(max((v - a[i]) / (a[i + 1] - a[i]), 0.), 1.)
+            idx.append(i)
+            weights = [w * s for w in weights for s in (1. - t, t)]
+        i0, i1, i2, i3 = idx
+        block = self._data[i0:i0 + 2, i1:i1 + 2, i2:i2 + 2, i3:i3 + 2].reshape(16, -1)
+        return np.dot(weights, block)
+
+    def query_batch(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        idx = []
+        weights = []
+        for j, a in enumerate(self.axes):
+            i = np.clip(np.searchsorted(a, points[:, j], side='right') - 1, 0, len(a) - 2)
+            idx.append(i)
+            weights.append(np.clip((points[:, j] - a[i]) / (a[i + 1] - a[i]), 0., 1.))
+        result = 0.
+        for corner in range(16):
+            bits = [(corner >> j) & 1 for j in range(4)]
+            w = np.ones(len(points))
+            for j in range(4):
+                w = w * (weights[j] if bits[j] else 1 - weights[j])
+            result = result + w[:, None] * self._data[idx[0] + bits[0], idx[1] + bits[1], idx[2] + bits[2],
+                                                      idx[3] + bits[3]]
+        return result
+
+
+"""
+Interpolation error of a surrogate table relative to direct computations by pv_schedule ('heuristic' and,
+if the table contains relaxed results, 'relaxed_int_u') for random patients inside the grid.
+The steady state values B of the patients are random as well (the table does not depend on B).
+
+Inputs:
+surrogate:      SurrogateTable
+num_samples:    Number of random patients
+seed:           Seed of the random patients
+
+Outputs:
+points:         Parameters [beta, gamma, pv_lambda, max_fraction] of the patients with shape (num_samples, 4)
+direct:         Summaries of pv_schedule with shape (num_samples, 5)
+interpolated:   Summaries of the table with shape (num_samples, 5)
+"""
+def surrogate_error(surrogate, num_samples=20, seed=0):
+    rng = np.random.RandomState(seed)
+    points = np.column_stack([rng.uniform(a[0], a[-1], num_samples) for a in surrogate.axes])
+    Tf = surrogate.Tf
+    Nperday = surrogate.Nperday
+    dt = Tf / int(Tf * Nperday)
+    dict_opts = dict(surrogate.dict_opts)
+    if 'max_treatment_volume' in dict_opts.keys():
+        max_treatment_volume = dict_opts['max_treatment_volume']
+    else:
+        max_treatment_volume = 500
+    relaxed = not np.all(np.isnan(surrogate.table[..., 4]))
+
+    direct = np.full((num_samples, len(summary_names)), np.nan)
+    for i, (beta, gamma, pv_lambda, max_fraction) in enumerate(points):
+        B = rng.uniform(500, 1000)
+        patient_volume = max_treatment_volume / max_fraction
+        result = pv_schedule(Tf, Nperday, calc_x0(B), B, pv_lambda, [beta, gamma], patient_volume,
+                             dict(dict_opts, objective='heuristic'))
+        direct[i, 0:3] = _heuristic_summaries(result.u_grid[None, :], dt, Tf)[0]
+        direct[i, 3] = result.error_flag
+        if relaxed:
+            result = pv_schedule(Tf, Nperday, calc_x0(B), B, pv_lambda, [beta, gamma], patient_volume,
+                                 dict(dict_opts, objective='relaxed_int_u'))
+            direct[i, 4] = np.sum(result.u) * 365. / Tf
+
+    interpolated = surrogate.query_batch(points)
+    for j, name in enumerate(summary_names):
+        err = np.abs(interpolated[:, j] - direct[:, j])
+        if np.any(np.isfinite(err)):
+            print(name, ': mean absolute error', np.nanmean(err), ', maximal absolute error', np.nanmax(err))
+    return points, direct, interpolated
@@ -22,11 +22,16 @@
 """
 
 from Modules.NLP.nlp_builder import nlp_builder
+from Modules.NLP.nlp_builder_robust import nlp_builder_robust, robust_scenarios
 from Modules.NLP.integrate_nlp_sol import integrate_nlp_sol
+from Modules.NLP.extract_nlp_sol import extract_nlp_sol
+from Modules.NLP.nlp_periodic import pv_periodic
 from Modules.Heuristic.heuristic_alg import pv_heuristic_alg
 from Modules.Model.allowed_generator import allowed_generator
 from Modules.Model.model_integrator import model_integrator
+from Modules.Tools.schedule_result import ScheduleResult
 
+import os
 import numpy as np
 import casadi as ca
 
@@ -49,24 +54,36 @@ dict_opts:      Dictionary specifiying more options:
         'relaxed_int_u' :       Using the integral of the control u as objective of an NLP formulation of the problem.
                                 This problem is solved as a relaxed problem using IPOPT
         'integer_end_point':    Using end point optimzation on an NLP maximizing Tf. This problem is solved using BONMIN
+        'robust':               Relaxed NLP as 'relaxed_int_u' with one control for several parameter scenarios,
+                                each with its own trajectory and constraints on x3 (see nlp_builder_robust)
+        'periodic':             Relaxed NLP as 'relaxed_int_u' on one cycle with periodic states, repeated to [0, Tf]
+                                (see Modules/NLP/nlp_periodic.py)
     max_treatment_volume:   Maximal treatment volume in ml                      -> default: 500             ,other: any float > 0
     obj_factor:             Scaling factor of objective                         -> default: 10              ,other: any float > 0
     allowed_hours:          Daily allowed treatment time sections               -> default: [1]*Nperday     ,other: 0/1 list with length = Nperday
     allowed_days:           Weekly allowed treatment days                       -> default: [1]*7           ,other: 0/1 list with length = 7
     forbidden_days:         Absolute days in which a treatment is not allowed   -> default: None            ,other: 0/1 list with integers (single days) or range(i, j+1) (forbidden from day i to day j)
     u_start:                Initial control trajectory for optimization         -> default: zero control    ,other: list of numbers valid for control
+    verify_integration:     Integrate NLP solution and print deviation from the -> default: False           ,other: True
+                            trajectories of the multiple shooting variables
                                     
     'u_max':                number of treatments used for integer end point method
+    'scenarios':            parameters [beta, gamma, pv_lambda] of additional scenarios for the robust method, shape (S, 3)
+    'p_cov':                covariance of [beta, gamma, pv_lambda] for sampled scenarios of the robust method (if no 'scenarios')
+    'num_scenarios':        number of scenarios including the nominal one for 'p_cov', default: 50
+    'seed':                 seed of the sampled scenarios, default: 0
+    'num_threads':          number of threads for the evaluation of the scenarios, default: number of cpus
+    'cycle_days':           length of the cycle in days or list of lengths compared by their rounded schedules for the periodic method, default: 28
 
-Outputs:
-x1_opt:         Optimal trajectory for x1
+Outputs (ScheduleResult, see Modules/Tools/schedule_result.py, which can be unpacked into):
+x1_opt:         Optimal trajectory for x1 (of the nominal parameters for 'robust')
 x2_opt:         Optimal trajectory for x2
 x3_opt:         Optimal trajectory for x3
 q_opt:          Objective value
 u:              Optimal control
 tgrid:          Time grid of trajectories for plotting
 sol:            Casadi NLP solution object, {} for 'heuristic'
-allowed_arr:    Returns list of allowed times formatted for plotting
+allowed_arr:    Returns boolean array of allowed times formatted for plotting
 error_flag:     Error flag of heuristic approach, 0 for other methods
  
 """    
@@ -86,25 +103,29 @@ def pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts):
     
 
     # Allowed treatment times
-    if 'allowed_days' in dict_opts.keys() or 'allowed_hours' in dict_opts.keys() or 'forbidden_days' in dict_opts.keys():
-        allowed_arr = allowed_generator(Nperday, dict_opts, N, dt)
-    else:
-        allowed_arr = [1]*N
+    allowed_arr, allowed_idx = allowed_generator(Nperday, dict_opts, N, dt, return_indices=True)
 
     # initial value for control, default is zero control
     if 'u_start' in dict_opts.keys():
         u_start = dict_opts['u_start']
     else:
-        u_start = [ca.DM(0.)] * len(allowed_arr)
+        u_start = [ca.DM(0.)] * len(allowed_idx)
     
     # obtaining objective
     if 'objective' in dict_opts.keys() and dict_opts['objective'] == 'integer_end_point':
         objective = 'integer_end_point'
     elif 'objective' in dict_opts.keys() and dict_opts['objective'] == 'heuristic':
         objective = 'heuristic'
+    elif 'objective' in dict_opts.keys() and dict_opts['objective'] == 'robust':
+        objective = 'robust'
+    elif 'objective' in dict_opts.keys() and dict_opts['objective'] == 'periodic':
+        objective = 'periodic'
     else: # default
         objective = 'relaxed_int_u'
     
+    if objective == 'periodic':
+        return pv_periodic(Tf, Nperday, x0, B, pv_lambda, p_in, max_fraction, dict_opts)
+
     if objective == 'integer_end_point':
         # model formulation and integrator
         integrator_function, integrator_function_2 = model_integrator(N, dt, Tf, Nperday, B, max_fraction, pv_lambda,  two_stage=True)    
@@ -115,7 +136,7 @@ def pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts):
         
     if objective == 'heuristic':
         x1_opt, x2_opt, x3_opt, q_opt, u, tgrid, error_flag = pv_heuristic_alg(Tf, N, np.array(x0), integrator_function, p_in, max_fraction, B, allowed_arr)
-        return x1_opt, x2_opt, x3_opt, q_opt, u, tgrid, {}, allowed_arr, error_flag        
+        return ScheduleResult(np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u, tgrid, {}, allowed_arr, error_flag)
     else:
         # NLP based problem
         # maximal number of donations, default is none
@@ -123,7 +144,20 @@ def pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts):
             u_max = dict_opts['u_max']
         else:
             u_max = None    
-        Q, w, w0, g, lbw, ubw, lbg, ubg, discrete = nlp_builder(N, Nperday, 0.05, B, x0, max_fraction, allowed_arr, integrator_function, integrator_function_2, p_in, u_start, u_max)
+        if objective == 'robust':
+            # nominal parameters are the first scenario
+            p_nominal = [p_in[0], p_in[1], pv_lambda]
+            if 'scenarios' in dict_opts.keys():
+                scenarios = np.vstack([p_nominal, dict_opts['scenarios']])
+            else:
+                num_scenarios = dict_opts['num_scenarios'] if 'num_scenarios' in dict_opts.keys() else 50
+                seed = dict_opts['seed'] if 'seed' in dict_opts.keys() else 0
+                scenarios = robust_scenarios(p_nominal, dict_opts['p_cov'], num_scenarios, seed)
+            num_threads = dict_opts['num_threads'] if 'num_threads' in dict_opts.keys() else os.cpu_count()
+            Q, w, w0, g, lbw, ubw, lbg, ubg = nlp_builder_robust(N, dt, B, np.asarray(x0, dtype=float), max_fraction,
+                                                                 allowed_arr, scenarios, u_start, num_threads)
+        else:
+            Q, w, w0, g, lbw, ubw, lbg, ubg, discrete = nlp_builder(N, Nperday, 0.05, B, x0, max_fraction, allowed_arr, integrator_function, integrator_function_2, p_in, u_start, u_max)
             
         # build NLP
         # Solve problem using NLP solver
@@ -143,13 +177,24 @@ def pv_schedule(Tf, Nperday, x0, B, pv_lambda, p_in, patient_volume, dict_opts):
             # bonmin_options = {}   
             nlp_solver = ca.nlpsol('nlp_solver', 'bonmin', nlp_prob, {"discrete": discrete, "bonmin": bonmin_options});            
 
-        else: # objective == 'relaxed_int_u'
+        else: # objective == 'relaxed_int_u' or 'robust'
             ipopt_opts = {}  
+            if objective == 'robust':
+                # the scenarios with active bounds need far fewer iterations with adaptive barrier parameter
+                ipopt_opts = {'mu_strategy': 'adaptive'}
             nlp_solver = ca.nlpsol('nlp_solver', 'ipopt', nlp_prob, {"ipopt": ipopt_opts});
         sol = nlp_solver(x0=ca.vertcat(*w0), lbx=lbw, ubx=ubw, lbg=lbg, ubg=ubg)
         
-        # Integrate solution object to obtain trajectories
-        x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid = integrate_nlp_sol(sol, x0, allowed_arr,  N, dt, Nperday, Tf, integrator_function, integrator_function_2, max_fraction, p_in)
-        return x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid, sol, allowed_arr, 0 
+        # Obtain trajectories from the multiple shooting variables of the solution
+        x1_opt, x2_opt, x3_opt, q_opt, u_opt, tgrid = extract_nlp_sol(sol, allowed_arr, N, dt, Tf, two_stage=integrator_function_2 is not None)
+
+        # Optional verification of the trajectories by integration of the solution
+        if 'verify_integration' in dict_opts.keys() and dict_opts['verify_integration']:
+            x1_int, x2_int, x3_int, q_int, _, _ = integrate_nlp_sol(sol, x0, allowed_arr,  N, dt, Nperday, Tf, integrator_function, integrator_function_2, max_fraction, p_in)
+            print('Maximal deviation of integrated trajectories:',
+                  np.max(np.abs(np.column_stack([x1_int - x1_opt, x2_int - x2_opt, x3_int - x3_opt]))),
+                  'objective:', np.max(np.abs(q_int - q_opt)))
+        return ScheduleResult(np.column_stack([x1_opt, x2_opt, x3_opt]), q_opt, u_opt, tgrid, sol, allowed_arr, 0,
+                              nlp_solver.stats()) 
 
 
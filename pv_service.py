@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# This file is part of PVschedule.
+#
+# Copyright 2019-2020 Patrick Lilienthal, Manuel Tetschke and Sebastian Sager
+#
+# PVschedule is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PVschedule is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with PVschedule. If not, see <http://www.gnu.org/licenses/>.
+
+
+Long running scheduling service reading JSON requests line by line from stdin and
+writing one JSON response per line to stdout, see Modules/Service/schedule_service.py.
+
+Example request:
+{"id": 1, "Tf": 365, "Nperday": 6, "patient": {"index": "F02", "lambda_version": 1},
+ "dict_opts": {"objective": "heuristic", "allowed_hours": [0, 0, 1, 1, 1, 0], "allowed_days": [1, 1, 1, 1, 1, 0, 0], "forbidden_days": [[81, 96]]}}
+"""
+
+from Modules.Service.schedule_service import serve
+
+if __name__ == '__main__':
+    serve()